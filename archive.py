@@ -0,0 +1,184 @@
+import argparse
+import os
+import sys
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+from sqlalchemy import insert, delete, select, text
+from sqlmodel import SQLModel
+
+from models import (
+    Appointments, Medical_Records, Prescriptions, Services_Rendered, Appointment_Statuses,
+    Appointments_Archive, Medical_Records_Archive, Prescriptions_Archive, Services_Rendered_Archive
+)
+from database import engine
+from versions import table_versions
+from cache import cache, CACHE_BACKEND
+from feed import change_feed, FEED_BACKEND
+
+# ===================================================================================
+# --- АРХИВ ПРИЕМОВ ---
+# ===================================================================================
+# Рабочие таблицы appointments / medical_records / prescriptions / services_rendered хранят только
+# недавние и будущие приемы — их читают все эндпоинты, и объем не растет с историей.
+# Завершенные приемы (статусы ARCHIVE_STATUSES) старше ARCHIVE_HORIZON_DAYS переносятся в *_archive
+# вместе с медкартами, назначениями и услугами, пачками по batch_size приемов, каждая пачка — своя транзакция:
+#   python archive.py run [--horizon-days 365] [--batch-size 5000]
+# На PostgreSQL appointments_archive секционирована по месяцам (RANGE по datetime), секции создаются по мере
+# переноса, строки вне секций попадают в секцию по умолчанию. Выборка за период читает только нужные месяцы.
+# Архив читается только по явному флагу ?include_archive=true (списки и записи приемов и медкарт,
+# календарь, медкарта целиком, экспорт). Сводки взаиморасчетов перенос не меняет (см. billing.py).
+# Перенос идет мимо API, поэтому после него поднимаются версии таблиц (ETag), сбрасывается кэш ответов и
+# подписчикам ленты изменений уходит resync — но из процесса archive.py. Работающие процессы API видят это,
+# только если версии и кэш у них общие (CACHE_BACKEND=redis), а лента — через NOTIFY (FEED_BACKEND=postgres).
+# С memory-бэкендами серверы отдают списки и ETag с перенесенными приемами, пока не истечет CACHE_TTL_SECONDS,
+# поэтому в этом режиме перенос не запускается без --allow-stale-servers (и тогда API нужно перезапустить).
+
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+ARCHIVE_STATUSES = [name.strip() for name in os.getenv("ARCHIVE_STATUSES", "Завершен,Отменен,Неявка").split(",")]
+DEFAULT_ARCHIVE_BATCH = 5000
+
+# Рабочая таблица -> архивная; перенос идет в этом порядке, удаление — в обратном
+ARCHIVES = {
+    Appointments: Appointments_Archive,
+    Medical_Records: Medical_Records_Archive,
+    Prescriptions: Prescriptions_Archive,
+    Services_Rendered: Services_Rendered_Archive,
+}
+PARTITION_PREFIX = Appointments_Archive.__tablename__
+
+
+# --- Секции (PostgreSQL) ---
+
+def _month_start(moment: datetime) -> date:
+    return date(moment.year, moment.month, 1)
+
+def _next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def ensure_archive(engine):
+    """Секция по умолчанию для appointments_archive: без нее строка вне месячных секций не вставится"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}_default "
+                          f"PARTITION OF {PARTITION_PREFIX} DEFAULT"))
+
+def ensure_partitions(conn, first: datetime, last: datetime):
+    """Месячные секции, покрывающие [first, last]"""
+    month = _month_start(first)
+    while month <= last.date():
+        following = _next_month(month)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}_{month:%Y_%m} PARTITION OF {PARTITION_PREFIX} "
+            f"FOR VALUES FROM ('{month}') TO ('{following}')"))
+        month = following
+
+
+# --- Перенос ---
+
+def archive_batch(conn, cutoff: datetime, status_ids: list, batch_size: int) -> int:
+    """Переносит до batch_size приемов старше cutoff со статусами status_ids. Возвращает их число"""
+    postgres = conn.dialect.name == "postgresql"
+    candidates = (select(Appointments.id, Appointments.datetime)
+                  .where(Appointments.datetime < cutoff, Appointments.status_id.in_(status_ids))
+                  .order_by(Appointments.id).limit(batch_size))
+    if postgres:
+        # Строки, которые сейчас правит API, пропускаем — они уйдут следующим запуском
+        candidates = candidates.with_for_update(skip_locked=True)
+    rows = conn.execute(candidates).all()
+    if not rows:
+        return 0
+    ids = [id for id, _ in rows]
+    record_ids = select(Medical_Records.id).where(Medical_Records.appointment_id.in_(ids))
+    if postgres:
+        ensure_partitions(conn, min(start for _, start in rows), max(start for _, start in rows))
+        # Медкарты блокируются: новая услуга или назначение к ним дождется конца переноса и получит ошибку
+        # внешнего ключа, а не пропадет вместе с удалением
+        conn.execute(record_ids.order_by(Medical_Records.id).with_for_update()).all()
+    conditions = {
+        Appointments: Appointments.id.in_(ids),
+        Medical_Records: Medical_Records.id.in_(record_ids),
+        Prescriptions: Prescriptions.record_id.in_(record_ids),
+        Services_Rendered: Services_Rendered.record_id.in_(record_ids),
+    }
+    for model, archive in ARCHIVES.items():
+        columns = [column.name for column in model.__table__.columns]
+        conn.execute(insert(archive.__table__).from_select(
+            columns, select(*model.__table__.columns).where(conditions[model])))
+    for model in reversed(ARCHIVES):
+        conn.execute(delete(model.__table__).where(conditions[model]))
+    return len(ids)
+
+def local_backends() -> list:
+    """Бэкенды, через которые работающие процессы API не узнают о переносе"""
+    local = []
+    if CACHE_BACKEND != "redis":
+        local.append(f"CACHE_BACKEND={CACHE_BACKEND}")
+    if FEED_BACKEND != "postgres":
+        local.append(f"FEED_BACKEND={FEED_BACKEND}")
+    return local
+
+def run_archive(engine=engine, horizon_days: int = ARCHIVE_HORIZON_DAYS, batch_size: int = DEFAULT_ARCHIVE_BATCH,
+                log=print, allow_stale_servers: bool = False) -> int:
+    """Переносит в архив все подходящие приемы. Возвращает их число.
+    С бэкендами из local_backends() — RuntimeError, если не разрешено allow_stale_servers"""
+    local = local_backends()
+    if local and not allow_stale_servers:
+        raise RuntimeError(f"{', '.join(local)}: работающие процессы API не увидят перенос до истечения "
+                           f"CACHE_TTL_SECONDS или перезапуска")
+    if local:
+        log(f"ВНИМАНИЕ: {', '.join(local)} — после переноса перезапустите API, иначе оно будет отдавать "
+            f"перенесенные приемы и прежние ETag")
+    cutoff = datetime.combine(date.today() - timedelta(days=horizon_days), datetime.min.time())
+    with engine.connect() as conn:
+        status_ids = conn.execute(select(Appointment_Statuses.id)
+                                  .where(Appointment_Statuses.name.in_(ARCHIVE_STATUSES))).scalars().all()
+    if not status_ids:
+        log(f"Нет статусов {ARCHIVE_STATUSES} — переносить нечего")
+        return 0
+    ensure_archive(engine)
+    moved = 0
+    started = perf_counter()
+    try:
+        while True:
+            with engine.begin() as conn:
+                count = archive_batch(conn, cutoff, status_ids, batch_size)
+            if not count:
+                break
+            moved += count
+            log(f"перенесено {moved} приемов, {moved / (perf_counter() - started):.0f} приемов/с")
+    finally:
+        if moved:
+            # Перенос идет мимо crud_router: кэш ответов и ETag по этим таблицам больше не действительны
+            tables = [model.__tablename__ for model in ARCHIVES] + [model.__tablename__ for model in ARCHIVES.values()]
+            for table in tables:
+                table_versions.bump(table)
+                if cache is not None:
+                    cache.invalidate(table)
+            change_feed.resync(engine, *[model.__tablename__ for model in ARCHIVES])
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Перенос завершенных приемов старше горизонта в архивные таблицы")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--horizon-days", type=int, default=ARCHIVE_HORIZON_DAYS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_ARCHIVE_BATCH)
+    parser.add_argument("--allow-stale-servers", action="store_true",
+                        help="Запустить и с memory-бэкендами кэша и ленты (API затем перезапустить)")
+    args = parser.parse_args(argv)
+
+    SQLModel.metadata.create_all(engine)
+    started = perf_counter()
+    try:
+        moved = run_archive(engine, args.horizon_days, args.batch_size, allow_stale_servers=args.allow_stale_servers)
+    except RuntimeError as e:
+        print(f"Перенос не запущен: {e}. Нужны CACHE_BACKEND=redis и FEED_BACKEND=postgres "
+              f"либо --allow-stale-servers", file=sys.stderr)
+        return 2
+    print(f"Готово: {moved} приемов за {perf_counter() - started:.1f} с")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import os
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from time import monotonic
+from typing import Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import SQLModel, Session, select
+
+from models import Schedule, Appointments, Medical_Records, Services_Rendered, Service_Catalog
+from crud import RETURNED_ROWS
+
+# ===================================================================================
+# --- ДВИЖОК СВОБОДНЫХ СЛОТОВ ---
+# ===================================================================================
+# Для каждого врача в памяти хранится недельный шаблон Schedule и отсортированные интервалы
+# занятости по будущим записям, для каждого кабинета — интервалы всех врачей, принимающих в нем.
+# Структуры строятся при первом запросе врача или кабинета. Запись через API сбрасывает после commit только
+# затронутых врачей и кабинеты (слушатели before_write / after_write собирают их в транзакции), справочник
+# услуг и импорт — все. Записи других процессов этот процесс не видит, поэтому структуры живут не дольше
+# AVAILABILITY_TTL_SECONDS; окончательная проверка пересечений — при самой записи (check_appointments).
+# Поиск пересечений с окном — бинарный поиск, то есть O(log n + k) на блок расписания,
+# независимо от числа записей в истории.
+#   AVAILABILITY_TTL_SECONDS   срок жизни структур врача и кабинета
+
+AVAILABILITY_TTL_SECONDS = float(os.getenv("AVAILABILITY_TTL_SECONDS", "5"))
+DEFAULT_APPOINTMENT_MINUTES = 30
+SLOT_ALIGN_MINUTES = 5
+# Таблицы, изменение которых меняет занятость
+AVAILABILITY_TABLES = {"appointments", "schedule", "medical_records", "services_rendered", "service_catalog"}
+_TOUCHED = "availability_touched"  # ключ session.info: затронутые транзакцией врачи и кабинеты до commit
+
+
+def appointment_duration_expr(appointments=Appointments, records=Medical_Records, services=Services_Rendered):
+    """Коррелированный подзапрос: длительность приема как сумма длительностей услуг его медкарты (или NULL).
+    Модели можно заменить архивными (см. archive.py)"""
+    return (
+        select(func.sum(Service_Catalog.duration_minutes * services.quantity))
+        .join(services, services.service_id == Service_Catalog.id)
+        .join(records, records.id == services.record_id)
+        .where(records.appointment_id == appointments.id)
+        .correlate(appointments)
+        .scalar_subquery()
+    )
+
+
+class FreeSlot(SQLModel):
+    doctor_id: int
+    cabinet_id: Optional[int] = None
+    start: datetime
+    end: datetime
+
+
+class Intervals:
+    """Интервалы [start, end), отсортированные по началу"""
+    def __init__(self, intervals):
+        intervals = sorted(intervals)
+        self.starts = [start for start, _ in intervals]
+        self.ends = [end for _, end in intervals]
+        self.max_length = max((end - start for start, end in intervals), default=timedelta(0))
+
+    def overlapping(self, start: datetime, end: datetime) -> list:
+        # Интервал длиной не больше max_length, пересекающий окно, начинается не раньше start - max_length
+        lo = bisect_left(self.starts, start - self.max_length)
+        hi = bisect_left(self.starts, end)
+        return [(s, e) for s, e in zip(self.starts[lo:hi], self.ends[lo:hi]) if e > start]
+
+
+# Блок недельного расписания (копия строки Schedule, не привязанная к сессии)
+_Block = namedtuple("_Block", "start_time end_time cabinet_id")
+
+class _DoctorEntry:
+    def __init__(self, blocks, busy: Intervals):
+        self.blocks = blocks  # день недели (1-7) -> [_Block], по времени начала
+        self.busy = busy
+
+    def cabinet_at(self, moment: datetime) -> Optional[int]:
+        for block in self.blocks.get(moment.isoweekday(), []):
+            if block.start_time <= moment.time() < block.end_time:
+                return block.cabinet_id
+        return None
+
+
+def _round_up(moment: datetime, minutes: int) -> datetime:
+    moment = moment.replace(second=0, microsecond=0) + (timedelta(minutes=1) if moment.second or moment.microsecond else timedelta(0))
+    return moment + timedelta(minutes=-moment.minute % minutes)
+
+def _free_in_block(start: datetime, end: datetime, busy: list, duration: timedelta):
+    """Слоты длины duration внутри [start, end), не пересекающие busy (отсортирован по началу)"""
+    moment = _round_up(start, SLOT_ALIGN_MINUTES)
+    for busy_start, busy_end in busy:
+        while moment + duration <= min(busy_start, end):
+            yield moment
+            moment += duration
+        if busy_end > moment:
+            moment = _round_up(busy_end, SLOT_ALIGN_MINUTES)
+    while moment + duration <= end:
+        yield moment
+        moment += duration
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._doctors = {}   # doctor_id -> (_DoctorEntry, время загрузки)
+        self._cabinets = {}  # cabinet_id -> (Intervals, время загрузки, id врачей кабинета)
+        # Счетчик сбросов: загрузка, начатая до сброса, не сохраняет прочитанное (оно могло устареть)
+        self._generation = 0
+
+    def invalidate(self, table: str = None, op: str = None, ids: list = None):
+        """Слушатель записей crud_router. Записи через API сбрасываются точечно после commit (см. before_write),
+        здесь — только записи с неизвестными строками (ids=None: импорт, ручной вызов)"""
+        if table is None or (table in AVAILABILITY_TABLES and ids is None):
+            self.forget(everything=True)
+
+    def forget(self, doctor_ids=(), cabinet_ids=(), everything: bool = False):
+        """Сбрасывает структуры врачей doctor_ids и кабинетов cabinet_ids (и кабинетов, где принимают эти врачи)"""
+        doctor_ids = set(doctor_ids)
+        with self._lock:
+            self._generation += 1
+            if everything:
+                self._doctors.clear()
+                self._cabinets.clear()
+                return
+            for doctor_id in doctor_ids:
+                self._doctors.pop(doctor_id, None)
+            for cabinet_id, (_, _, doctors) in list(self._cabinets.items()):
+                if cabinet_id in cabinet_ids or doctors & doctor_ids:
+                    del self._cabinets[cabinet_id]
+
+    # --- Слушатели транзакции записи (pre_write_listeners / post_write_listeners) ---
+
+    def before_write(self, session: Session, table: str, op: str, ids: list):
+        """Врачи и кабинеты строк в прежнем виде: запись может перенести их к другому врачу"""
+        if op != "create":
+            self._touch(session, table, ids)
+
+    def after_write(self, session: Session, table: str, op: str, ids: list):
+        if op != "delete":
+            self._touch(session, table, ids)
+
+    def _touch(self, session: Session, table: str, ids: list):
+        if table not in AVAILABILITY_TABLES or not ids:
+            return
+        touched = session.info.setdefault(_TOUCHED, [set(), set(), False])
+        if table == "service_catalog":
+            # Длительность услуги меняет длительность приемов всех врачей
+            touched[2] = True
+            return
+        returned = session.info.get(RETURNED_ROWS, {}).get(table)
+        if table == "schedule":
+            rows = ([(row["doctor_id"], row["cabinet_id"]) for row in returned.values()] if returned else
+                    session.exec(select(Schedule.doctor_id, Schedule.cabinet_id).where(Schedule.id.in_(ids))).all())
+            touched[0].update(doctor_id for doctor_id, _ in rows)
+            touched[1].update(cabinet_id for _, cabinet_id in rows if cabinet_id is not None)
+            return
+        if table == "appointments" and returned:
+            touched[0].update(row["doctor_id"] for row in returned.values())
+            return
+        statement = select(Appointments.doctor_id).distinct()
+        if table == "appointments":
+            statement = statement.where(Appointments.id.in_(ids))
+        elif table == "medical_records":
+            statement = (statement.join(Medical_Records, Medical_Records.appointment_id == Appointments.id)
+                         .where(Medical_Records.id.in_(ids)))
+        else:
+            statement = (statement.join(Medical_Records, Medical_Records.appointment_id == Appointments.id)
+                         .join(Services_Rendered, Services_Rendered.record_id == Medical_Records.id)
+                         .where(Services_Rendered.id.in_(ids)))
+        touched[0].update(session.exec(statement).all())
+
+    # --- Загрузка ---
+
+    def _load_doctor(self, session: Session, doctor_id: int) -> _DoctorEntry:
+        cached = self._doctors.get(doctor_id)
+        if cached is not None and monotonic() - cached[1] < AVAILABILITY_TTL_SECONDS:
+            return cached[0]
+        generation, loaded_at = self._generation, monotonic()
+        blocks = {}
+        statement = (select(Schedule.day_of_week, Schedule.start_time, Schedule.end_time, Schedule.cabinet_id)
+                     .where(Schedule.doctor_id == doctor_id).order_by(Schedule.start_time))
+        for day_of_week, *block in session.exec(statement):
+            blocks.setdefault(day_of_week, []).append(_Block(*block))
+        # Прошлые записи на свободные слоты не влияют; выборка идет по индексу (doctor_id, datetime)
+        since = datetime.combine(date.today() - timedelta(days=1), datetime.min.time())
+        rows = session.exec(
+            select(Appointments.datetime, appointment_duration_expr())
+            .where(Appointments.doctor_id == doctor_id, Appointments.datetime >= since)
+        ).all()
+        busy = Intervals((start, start + timedelta(minutes=minutes or DEFAULT_APPOINTMENT_MINUTES)) for start, minutes in rows)
+        entry = _DoctorEntry(blocks, busy)
+        with self._lock:
+            if self._generation == generation:
+                self._doctors[doctor_id] = (entry, loaded_at)
+        return entry
+
+    def _load_cabinet(self, session: Session, cabinet_id: int) -> Intervals:
+        cached = self._cabinets.get(cabinet_id)
+        if cached is not None and monotonic() - cached[1] < AVAILABILITY_TTL_SECONDS:
+            return cached[0]
+        generation, loaded_at = self._generation, monotonic()
+        doctor_ids = session.exec(select(Schedule.doctor_id).where(Schedule.cabinet_id == cabinet_id).distinct()).all()
+        busy = []
+        for doctor_id in doctor_ids:
+            entry = self._load_doctor(session, doctor_id)
+            # Запись занимает кабинет, в котором врач принимает по расписанию в это время
+            busy.extend((s, e) for s, e in zip(entry.busy.starts, entry.busy.ends) if entry.cabinet_at(s) == cabinet_id)
+        intervals = Intervals(busy)
+        with self._lock:
+            if self._generation == generation:
+                self._cabinets[cabinet_id] = (intervals, loaded_at, frozenset(doctor_ids))
+        return intervals
+
+    def doctor_slots(self, session: Session, doctor_id: int, start: datetime, end: datetime, minutes: int) -> list:
+        """Свободные слоты врача в окне [start, end) с учетом его записей и занятости кабинета"""
+        entry = self._load_doctor(session, doctor_id)
+        duration = timedelta(minutes=minutes)
+        slots = []
+        day = start.date()
+        while day <= end.date():
+            for block in entry.blocks.get(day.isoweekday(), []):
+                block_start = max(datetime.combine(day, block.start_time), start)
+                block_end = min(datetime.combine(day, block.end_time), end)
+                if block_end <= block_start:
+                    continue
+                busy = entry.busy.overlapping(block_start, block_end)
+                if block.cabinet_id is not None:
+                    busy += self._load_cabinet(session, block.cabinet_id).overlapping(block_start, block_end)
+                slots.extend(
+                    FreeSlot(doctor_id=doctor_id, cabinet_id=block.cabinet_id, start=moment, end=moment + duration)
+                    for moment in _free_in_block(block_start, block_end, sorted(busy), duration)
+                )
+            day += timedelta(days=1)
+        return slots
+
+availability = AvailabilityIndex()
+
+
+# Затронутые транзакцией врачи и кабинеты сбрасываются после commit; откат их отбрасывает.
+# Слушатели на классе Session: срабатывают и для сессий AsyncSession (их синхронной части)
+@event.listens_for(OrmSession, "after_commit")
+def _forget_committed(session):
+    touched = session.info.pop(_TOUCHED, None)
+    if touched:
+        doctor_ids, cabinet_ids, everything = touched
+        availability.forget(doctor_ids, cabinet_ids, everything)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_TOUCHED, None)
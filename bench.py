@@ -0,0 +1,460 @@
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from time import perf_counter, sleep
+
+from fastapi.testclient import TestClient
+from sqlalchemy import Integer, Time, and_, case, cast, event, extract, func, text, union
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, SQLModel, select
+
+import database
+from database import engine
+from models import (Doctors, Patients, Medical_Records, Specializations, Diagnoses, Appointments, Appointments_Archive,
+                    Schedule, create_missing_indexes)
+from availability import appointment_duration_expr, DEFAULT_APPOINTMENT_MINUTES
+import main
+
+# ===================================================================================
+# --- НАГРУЗОЧНЫЙ ТЕСТ ЭНДПОИНТОВ ---
+# ===================================================================================
+# Гоняет эндпоинты main.py в том же процессе (TestClient) против БД из DATABASE_URL,
+# обычно заранее наполненной generate.py. По каждому сценарию: p50/p95/p99 задержки,
+# пропускная способность, пик RSS процесса и число SQL-запросов на HTTP-запрос.
+# Результаты пишутся в bench_results/<label>.json; --compare сравнивает с прошлым прогоном:
+#   python generate.py --scale 0.01 --reset
+#   python bench.py --label before
+#   ... изменения ...
+#   python bench.py --label after --compare bench_results/before.json
+# Синхронный и асинхронный режимы CRUD сравниваются так же: DB_ASYNC=1 python bench.py --label async ...
+# Эффект индексов models.py — на тех же данных: --without-indexes удаляет их на время прогона (после старта
+# приложения, которое само строит недостающие) и строит заново с ANALYZE в конце:
+#   python bench.py --label indexes_off --without-indexes --only ...
+#   python bench.py --label indexes_on --only ... --compare bench_results/indexes_off.json
+# Опорные прогоны, на которые ссылаются описания изменений, хранятся в репозитории: bench_results/reference/
+# (JSON прогонов и текстовая сводка с командами запуска). Остальное в bench_results/ не коммитится.
+# Сценарии записи (book, booking_race, patient_*) удаляют созданные ими записи после замера.
+# Для сценариев из EXPECTED_SQL число SQL-запросов проверяется на каждом успешном запросе прогрева
+# (он идет последовательно): любое другое число — провал прогона, код выхода 1.
+
+RESULTS_DIR = "bench_results"
+WEEK = timedelta(days=7)
+
+
+class Context:
+    """Диапазоны id и образцы значений из БД для генерации запросов"""
+    def __init__(self, session: Session):
+        self.doctors = session.exec(select(func.max(Doctors.id))).one() or 0
+        self.patients = session.exec(select(func.max(Patients.id))).one() or 0
+        self.records = session.exec(select(func.max(Medical_Records.id))).one() or 0
+        self.specializations = session.exec(select(Specializations.id)).all()
+        self.last_names = list({name for name in session.exec(select(Patients.last_name).limit(1000))})
+        self.codes = [code for code in session.exec(select(Diagnoses.mkb_code).limit(1000))]
+        # Период — по рабочей таблице и архиву вместе: сценарии с include_archive читают и прошлые годы
+        bounds = [session.exec(select(func.min(model.datetime), func.max(model.datetime))).one()
+                  for model in (Appointments, Appointments_Archive)]
+        firsts = [first for first, _ in bounds if first]
+        lasts = [last for _, last in bounds if last]
+        self.first_day = min(firsts).date() if firsts else date.today()
+        self.last_day = max(lasts).date() if lasts else date.today()
+        self.tables = {model.__tablename__: session.exec(select(func.count()).select_from(model)).one()
+                       for model in (Doctors, Patients, Appointments, Medical_Records)}
+
+    def day(self, rng: random.Random) -> date:
+        return self.first_day + timedelta(days=rng.randint(0, max((self.last_day - self.first_day).days, 0)))
+
+
+# --- Сценарии: функция (client, rng, ctx) -> (метод, url, параметры, тело[, заголовки]) ---
+
+def _doctor(rng, ctx):
+    return rng.randint(1, max(ctx.doctors, 1))
+
+def _week(rng, ctx):
+    start = ctx.day(rng)
+    return start, start + WEEK
+
+def _month(rng, ctx):
+    start = ctx.day(rng).replace(day=1)
+    return start, start + timedelta(days=30)
+
+SCENARIOS = {
+    "doctor_by_id": lambda c, rng, ctx: ("GET", f"/doctors/{_doctor(rng, ctx)}", None, None),
+    "patients_page": lambda c, rng, ctx: ("GET", "/patients/", {"after_id": rng.randint(0, ctx.patients), "limit": 100}, None),
+    "appointments_by_doctor": lambda c, rng, ctx: (
+        "GET", "/appointments/", dict(zip(("datetime_from", "datetime_to"), map(date.isoformat, _week(rng, ctx))),
+                                      doctor_id=_doctor(rng, ctx)), None),
+    "calendar_week": lambda c, rng, ctx: (
+        "GET", "/appointments/calendar", dict(zip(("start", "end"), (f"{day}T00:00:00" for day in _week(rng, ctx))),
+                                              doctor_id=_doctor(rng, ctx)), None),
+    "stats_month": lambda c, rng, ctx: (
+        "GET", "/stats/", dict(zip(("date_from", "date_to"), map(date.isoformat, _month(rng, ctx)))), None),
+    "patient_search": lambda c, rng, ctx: (
+        "GET", "/patients/search", {"q": rng.choice(ctx.last_names)[:rng.randint(3, 6)] if ctx.last_names else "ив"}, None),
+    "diagnosis_suggest": lambda c, rng, ctx: (
+        "GET", "/diagnoses/suggest", {"prefix": rng.choice(ctx.codes)[:rng.randint(1, 4)] if ctx.codes else "J"}, None),
+    "free_slots_doctor": lambda c, rng, ctx: (
+        "GET", f"/doctors/{_doctor(rng, ctx)}/free-slots",
+        {"from": datetime.now().isoformat(timespec="minutes"), "to": (datetime.now() + WEEK).isoformat(timespec="minutes")}, None),
+    "free_slots_specialization": lambda c, rng, ctx: (
+        "GET", f"/specializations/{rng.choice(ctx.specializations or [1])}/free-slots",
+        {"from": datetime.now().isoformat(timespec="minutes"), "to": (datetime.now() + WEEK).isoformat(timespec="minutes")}, None),
+    "record_details": lambda c, rng, ctx: ("GET", f"/medical_records/{rng.randint(1, max(ctx.records, 1))}/details", None, None),
+    "billing_departments": lambda c, rng, ctx: (
+        "GET", "/billing/departments", dict(zip(("from", "to"), map(date.isoformat, _month(rng, ctx)))), None),
+}
+
+# Чтение с архивом (archive.py): история пациента и календарь прошлых периодов
+SCENARIOS["patient_history_archive"] = lambda c, rng, ctx: (
+    "GET", "/appointments/", {"patient_id": rng.randint(1, max(ctx.patients, 1)), "include_archive": "true"}, None)
+SCENARIOS["calendar_week_archive"] = lambda c, rng, ctx: (
+    "GET", "/appointments/calendar", dict(zip(("start", "end"), (f"{day}T00:00:00" for day in _week(rng, ctx))),
+                                          doctor_id=_doctor(rng, ctx), include_archive="true"), None)
+
+# Сценарий -> точное число SQL-запросов на успешный ответ, не зависящее от данных
+EXPECTED_SQL = {"record_details": 3}
+
+# Большие страницы в разных форматах ответа (formats.py): строки/с и байты на ответ
+PAGE_ROWS = 1000
+FORMATS = {"json": "application/json", "columnar": "application/vnd.polyclinic.columnar+json",
+           "msgpack": "application/msgpack", "arrow": "application/vnd.apache.arrow.stream"}
+for _name, _accept in FORMATS.items():
+    SCENARIOS[f"appointments_page_{_name}"] = lambda c, rng, ctx, accept=_accept: (
+        "GET", "/appointments/", {"after_id": rng.randint(0, max(ctx.tables["appointments"] - PAGE_ROWS, 0)),
+                                  "limit": PAGE_ROWS}, None, {"Accept": accept})
+    SCENARIOS[f"patients_page_{_name}"] = lambda c, rng, ctx, accept=_accept: (
+        "GET", "/patients/", {"after_id": rng.randint(0, max(ctx.patients - PAGE_ROWS, 0)), "limit": PAGE_ROWS},
+        None, {"Accept": accept})
+
+def _free_slot(client, rng, ctx, doctor_id=None):
+    """Свободный слот ближайших недель (запрос не входит в замер)"""
+    for _ in range(20):
+        doctor = doctor_id or _doctor(rng, ctx)
+        start = datetime.now() + timedelta(days=rng.randint(1, 21))
+        slots = client.get(f"/doctors/{doctor}/free-slots",
+                           params={"from": start.isoformat(timespec="minutes"),
+                                   "to": (start + WEEK).isoformat(timespec="minutes")}).json()
+        if slots:
+            slot = rng.choice(slots)
+            return {"doctor_id": doctor, "datetime": slot["start"], "patient_id": rng.randint(1, max(ctx.patients, 1))}
+    return None
+
+def _book(client, rng, ctx):
+    return "POST", "/appointments/", None, _free_slot(client, rng, ctx)
+
+def _new_patient(rng):
+    return {"last_name": rng.choice(["Бенчев", "Нагрузкин", "Замеров"]), "first_name": "Тест",
+            "birth_date": date(1950 + rng.randint(0, 60), rng.randint(1, 12), rng.randint(1, 28)).isoformat()}
+
+def _delete_patient(client, rng, ctx):
+    # Удаляется пациент, созданный здесь же (вне замера): удаление не задевает сгенерированные данные
+    return "DELETE", f"/patients/{client.post('/patients/', json=_new_patient(rng)).json()['id']}", None, None
+
+# CRUD-запись одной строки: INSERT / UPDATE / DELETE без проверок расписания, как у справочников и пациентов
+WRITE_SCENARIOS = {
+    "book": _book,
+    "patient_create": lambda c, rng, ctx: ("POST", "/patients/", None, _new_patient(rng)),
+    "patient_update": lambda c, rng, ctx: (
+        "PATCH", f"/patients/{rng.randint(1, max(ctx.patients, 1))}", None, {"phone": f"+7{rng.randint(10**9, 10**10 - 1)}"}),
+    "patient_delete": _delete_patient,
+}
+
+
+# --- Замеры ---
+
+class StatementCounter:
+    """Число SQL-запросов, выполненных всеми движками приложения"""
+    def __init__(self, *engines):
+        self.count = 0
+        self._lock = threading.Lock()
+        for target in engines:
+            event.listen(target, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+class RssSampler:
+    """Пик RSS процесса за время замера (на Linux — из /proc, иначе ru_maxrss за все время)"""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def rss() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+def _percentile(values: list, q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+def run_scenario(client, make_request, ctx, statements: StatementCounter, requests: int, concurrency: int,
+                 warmup: int, seed: int) -> tuple:
+    """Прогоняет сценарий; возвращает (метрики, созданные записи — пары (путь списка, id))"""
+    rng = random.Random(seed)
+    prepared = [make_request(client, rng, ctx) for _ in range(warmup + requests)]
+    created = []
+
+    def call(request):
+        method, url, params, body, *headers = request
+        started = perf_counter()
+        response = client.request(method, url, params=params, json=body, headers=headers[0] if headers else None)
+        elapsed = perf_counter() - started
+        if method == "POST" and response.status_code == 200:
+            created.append((url, response.json()["id"]))
+        return elapsed, response.status_code, len(response.content)
+
+    # Прогрев последовательный: запросы SQL каждого ответа 200 считаются отдельно
+    sql_counts = Counter()
+    for request in prepared[:warmup]:
+        before = statements.count
+        _, code, _ = call(request)
+        if code == 200:
+            sql_counts[statements.count - before] += 1
+    statements_before = statements.count
+    with RssSampler() as rss:
+        started = perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(call, prepared[warmup:]))
+        wall = perf_counter() - started
+    latencies = [elapsed * 1000 for elapsed, _, _ in results]
+    codes = Counter(code for _, code, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(n for code, n in codes.items() if code >= 500),
+        "status": {str(code): n for code, n in sorted(codes.items())},
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "throughput_rps": round(len(results) / wall, 1) if wall else 0.0,
+        "bytes_per_response": round(statistics.fmean(size for _, _, size in results)) if results else 0,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "sql_per_request": round((statements.count - statements_before) / max(len(results), 1), 2),
+        "sql_per_ok_warmup": {str(count): n for count, n in sorted(sql_counts.items())},
+    }, created
+
+def count_double_bookings(session: Session, ids: list) -> int:
+    """Число пар пересекающихся записей одного врача или одного кабинета, в которых есть запись из ids.
+    Считается одним запросом SQL (самосоединение Appointments), независимо от проверки booking.py"""
+    if not ids:
+        return 0
+    postgres = session.get_bind().dialect.name == "postgresql"
+    a, b = aliased(Appointments), aliased(Appointments)
+    schedule_a, schedule_b = aliased(Schedule), aliased(Schedule)
+
+    # SQLite хранит время строкой: datetime() / time() приводят его к одному формату для сравнения
+    def start(appointment):
+        return appointment.datetime if postgres else func.datetime(appointment.datetime)
+    def end(appointment):
+        minutes = func.coalesce(appointment_duration_expr(appointment), DEFAULT_APPOINTMENT_MINUTES)
+        if postgres:
+            return appointment.datetime + func.make_interval(0, 0, 0, 0, 0, cast(minutes, Integer))
+        return func.datetime(appointment.datetime, func.printf("+%d minutes", minutes))
+    def clock(value):
+        return value if postgres else func.time(value)
+    def in_block(block, appointment):
+        """Запись попадает в блок расписания своего врача — значит, занимает его кабинет"""
+        weekday = (cast(extract("isodow", appointment.datetime), Integer) if postgres
+                   else (cast(func.strftime("%w", appointment.datetime), Integer) + 6) % 7 + 1)
+        moment = cast(appointment.datetime, Time) if postgres else func.time(appointment.datetime)
+        return and_(block.doctor_id == appointment.doctor_id, block.day_of_week == weekday,
+                    clock(block.start_time) <= moment, moment < clock(block.end_time))
+
+    # Вторая запись пары ищется только в пределах суток от проверяемых: прием дольше суток не бывает
+    first, last = session.execute(select(func.min(Appointments.datetime), func.max(Appointments.datetime))
+                                  .where(Appointments.id.in_(ids))).one()
+    pair = (case((a.id < b.id, a.id), else_=b.id), case((a.id < b.id, b.id), else_=a.id))
+    near = [a.id.in_(ids), b.id != a.id, b.datetime >= first - timedelta(days=1), b.datetime < last + timedelta(days=1),
+            start(a) < end(b), start(b) < end(a)]
+    same_doctor = select(*pair).select_from(a).join(b, b.doctor_id == a.doctor_id).where(*near)
+    same_cabinet = (select(*pair).select_from(a)
+                    .join(schedule_a, in_block(schedule_a, a))
+                    .join(schedule_b, schedule_b.cabinet_id == schedule_a.cabinet_id)
+                    .join(b, in_block(schedule_b, b)).where(*near))
+    return session.execute(select(func.count()).select_from(union(same_doctor, same_cabinet).subquery())).scalar()
+
+def booking_race(client, ctx, concurrency: int, seed: int) -> tuple:
+    """Все потоки одновременно записывают к одному врачу на его свободные слоты и на соседние
+    со сдвигом: должна пройти ровно одна запись на слот, пар пересекающихся записей в БД — ноль"""
+    rng = random.Random(seed)
+    requests = []
+    while len(requests) < concurrency * 4:
+        slot = _free_slot(client, rng, ctx, doctor_id=_doctor(rng, ctx))
+        if slot is None:
+            break
+        start = datetime.fromisoformat(slot["datetime"])
+        for shift in (0, 0, 5, 10):
+            requests.append(dict(slot, datetime=(start + timedelta(minutes=shift)).isoformat()))
+    rng.shuffle(requests)
+    created = []
+    def call(body):
+        response = client.post("/appointments/", json=body)
+        if response.status_code == 200:
+            created.append(("/appointments/", response.json()["id"]))
+        return response.status_code
+    started = perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        codes = Counter(pool.map(call, requests))
+    wall = perf_counter() - started
+    # Пересечения в БД после гонки — отдельным запросом, не кодом проверки записи
+    with Session(engine) as session:
+        conflicts = count_double_bookings(session, [id for _, id in created])
+    return {
+        "requests": len(requests), "booked": codes.get(200, 0), "rejected": codes.get(409, 0),
+        "errors": sum(n for code, n in codes.items() if code >= 500),
+        "bookings_per_s": round(codes.get(200, 0) / wall, 1) if wall else 0.0,
+        "requests_per_s": round(len(requests) / wall, 1) if wall else 0.0,
+        "double_bookings": conflicts,
+    }, created
+
+
+# --- Индексы ---
+
+def drop_model_indexes(engine) -> list:
+    """Удаляет индексы, объявленные в models.py (первичные ключи остаются). Возвращает их имена"""
+    dropped = []
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=engine, checkfirst=True)
+            dropped.append(index.name)
+    return dropped
+
+def restore_model_indexes(engine):
+    """Строит удаленные индексы заново и обновляет статистику планировщика"""
+    create_missing_indexes(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+# --- Отчет и сравнение ---
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def print_results(results: dict, baseline: dict = None):
+    print(f"{'сценарий':28} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>9} {'rss MB':>8} {'sql/req':>8} {'байт':>9}"
+          f"  изменение p95")
+    for name, metrics in results["endpoints"].items():
+        if "p95_ms" not in metrics:
+            print(f"{name:28} {json.dumps(metrics, ensure_ascii=False)}")
+            continue
+        line = (f"{name:28} {metrics['p50_ms']:9.2f} {metrics['p95_ms']:9.2f} {metrics['p99_ms']:9.2f} "
+                f"{metrics['throughput_rps']:9.1f} {metrics['peak_rss_mb']:8.1f} {metrics['sql_per_request']:8.2f} "
+                f"{metrics.get('bytes_per_response', 0):9}")
+        old = (baseline or {}).get("endpoints", {}).get(name)
+        if old and old.get("p95_ms"):
+            line += f"  {(metrics['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}% (было {old['p95_ms']:.2f})"
+        print(line)
+        if metrics.get("sql_mismatch"):
+            print(f"{'':28} ОШИБКА: ожидалось {metrics['sql_expected']} SQL на ответ, "
+                  f"на прогреве {metrics['sql_per_ok_warmup'] or 'ни одного ответа 200'}")
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест эндпоинтов поликлиники")
+    parser.add_argument("--label", default=datetime.now().strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на сценарий")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1, help="Параллельных клиентов")
+    parser.add_argument("--only", default=None, help="Сценарии через запятую")
+    parser.add_argument("--no-writes", action="store_true", help="Пропустить сценарии записи")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", default=None, help="Файл прошлого прогона для сравнения")
+    parser.add_argument("--without-indexes", action="store_true",
+                        help="Прогон без индексов models.py: удаляются на время прогона и строятся заново")
+    args = parser.parse_args(argv)
+
+    scenarios = dict(SCENARIOS)
+    if not args.no_writes:
+        scenarios.update(WRITE_SCENARIOS)
+        scenarios["booking_race"] = None
+    if args.only:
+        scenarios = {name: scenarios[name] for name in args.only.split(",")}
+
+    engines = [engine] + ([database.async_engine.sync_engine] if database.async_engine is not None else [])
+    statements = StatementCounter(*engines)
+    results = {
+        "label": args.label, "created": datetime.now().isoformat(timespec="seconds"), "git_commit": _git_commit(),
+        "config": {"dialect": engine.dialect.name, "db_async": database.DB_ASYNC, "pool_size": database.POOL_SIZE,
+                   "max_overflow": database.MAX_OVERFLOW, "concurrency": args.concurrency,
+                   "requests": args.requests, "warmup": args.warmup, "python": sys.version.split()[0],
+                   "model_indexes": not args.without_indexes},
+        "endpoints": {},
+    }
+    with TestClient(main.app) as client:
+        with Session(engine) as session:
+            ctx = Context(session)
+        results["tables"] = ctx.tables
+        if args.without_indexes:
+            print(f"удалено индексов: {len(drop_model_indexes(engine))}", file=sys.stderr)
+        try:
+            created = []
+            for index, (name, make_request) in enumerate(scenarios.items()):
+                if make_request is None:
+                    metrics, ids = booking_race(client, ctx, max(args.concurrency, 8), args.seed + index)
+                else:
+                    metrics, ids = run_scenario(client, make_request, ctx, statements, args.requests,
+                                                args.concurrency, args.warmup, args.seed + index)
+                created.extend(ids)
+                if name in EXPECTED_SQL:
+                    metrics["sql_expected"] = EXPECTED_SQL[name]
+                    metrics["sql_mismatch"] = set(metrics["sql_per_ok_warmup"]) != {str(EXPECTED_SQL[name])}
+                if "_page_" in name:
+                    metrics["rows_per_s"] = round(metrics["throughput_rps"] * PAGE_ROWS)
+                results["endpoints"][name] = metrics
+                print(f"{name}: готово", file=sys.stderr)
+            for path in dict.fromkeys(path for path, _ in created):
+                client.request("DELETE", f"{path}bulk", json=[id for p, id in created if p == path])
+        finally:
+            if args.without_indexes:
+                print("строим индексы заново", file=sys.stderr)
+                restore_model_indexes(engine)
+
+    path = os.path.join(RESULTS_DIR, f"{args.label}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"Результаты: {path}")
+    failed = any(m.get("errors") or m.get("double_bookings") or m.get("sql_mismatch") for m in results["endpoints"].values())
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,299 @@
+import argparse
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import func, insert, delete, update, union_all, Date, Numeric
+from sqlmodel import SQLModel, Session, select
+
+from models import (
+    Departments, Doctors, Patients, Appointments, Medical_Records, Services_Rendered, Service_Catalog, Billing_Daily,
+    Appointments_Archive, Medical_Records_Archive, Services_Rendered_Archive
+)
+from database import engine
+from versions import table_versions
+from crud import RETURNED_ROWS
+
+# ===================================================================================
+# --- ВЗАИМОРАСЧЕТЫ: ДНЕВНЫЕ СВОДКИ ---
+# ===================================================================================
+# Сумма услуги = Services_Rendered.quantity * Service_Catalog.price; день, пациент и врач берутся
+# из приема (Services_Rendered -> Medical_Records -> Appointments), отделение — у врача.
+# Billing_Daily хранит эти суммы по дням и ведется приращениями в транзакции каждой записи через API:
+# перед UPDATE/DELETE вклад затронутых строк вычитается, после INSERT/UPDATE — прибавляется заново.
+# Поэтому сводка учитывает и перенос приема, и смену цены в прайсе, и перевод врача в другое отделение.
+# Запись услуги или медкарты до подсчета вклада блокирует их прием (FOR NO KEY UPDATE), врача и строку прайса
+# (FOR SHARE): параллельный перенос приема, смена цены или отделения ждет commit и уже видит новую услугу,
+# а не зачисляет ее сумму в прежний ключ.
+# От строки врача сводка зависит только через отделение: UPDATE врача сравнивает его до и после записи
+# и пересчитывает вклад (один раз, с заменой отделения в ключе), только если оно изменилось.
+# Отчеты за период читают только сводку и не зависят от объема истории.
+# Перенос в архив (archive.py) сводку не меняет: суммы архивных приемов в ней остаются, а пересборка
+# читает и рабочие, и архивные таблицы. Архивные услуги уже не пересчитываются при смене цены в прайсе.
+# Записи мимо API (импорт, ручной SQL) в сводку не попадают — после них нужна пересборка:
+#   python billing.py rebuild [--from 2024-01-01] [--to 2024-12-31]
+
+LOOKUP_CHUNK = 1000
+DEFAULT_REPORT_LIMIT = 100
+MAX_REPORT_LIMIT = 1000
+
+# Таблица -> колонка, по id которой отбираются зависящие от строки услуги
+BILLING_SOURCES = {
+    "services_rendered": Services_Rendered.id,
+    "medical_records": Medical_Records.id,
+    "appointments": Appointments.id,
+    "service_catalog": Service_Catalog.id,
+    "doctors": Doctors.id,
+}
+_KEY = ("day", "patient_id", "doctor_id", "department_id")
+_PENDING = "billing_pending"  # ключ session.info: вычтенный вклад до записи
+_DEPARTMENTS = "billing_departments"  # ключ session.info: отделения врачей до UPDATE
+
+
+def _service_rows(services=Services_Rendered, records=Medical_Records, appointments=Appointments):
+    """Оказанные услуги с ключом Billing_Daily и суммой — из рабочих таблиц или из архива"""
+    return (
+        select(func.date(appointments.datetime, type_=Date).label("day"),
+               func.coalesce(appointments.patient_id, 0).label("patient_id"),
+               func.coalesce(appointments.doctor_id, 0).label("doctor_id"),
+               func.coalesce(Doctors.department_id, 0).label("department_id"),
+               services.quantity.label("quantity"),
+               (services.quantity * Service_Catalog.price).label("amount"))
+        .select_from(services)
+        .join(Service_Catalog, Service_Catalog.id == services.service_id)
+        .join(records, records.id == services.record_id)
+        .join(appointments, appointments.id == records.appointment_id)
+        .outerjoin(Doctors, Doctors.id == appointments.doctor_id)
+    )
+
+def _contributions_statement(rows):
+    """Суммы услуг из выборки _service_rows (или их объединения), сгруппированные по ключу Billing_Daily"""
+    rows = rows.subquery()
+    key = [rows.c[name] for name in _KEY]
+    return (
+        select(*key, func.sum(rows.c.quantity).label("services_count"),
+               func.sum(rows.c.amount, type_=Numeric(12, 2)).label("amount"))
+        .group_by(*key)
+    )
+
+def _contributions(session: Session, column, ids: list, lock: bool = False) -> dict:
+    """Вклад строк таблицы column.table с данными id: ключ -> [услуг, сумма]"""
+    result = defaultdict(lambda: [0, Decimal(0)])
+    for start in range(0, len(ids), LOOKUP_CHUNK):
+        chunk = ids[start:start + LOOKUP_CHUNK]
+        if lock:
+            # Строки, которые сейчас изменятся, блокируются: их вклад не поменяется до нашего UPDATE.
+            # Отдельным запросом — FOR UPDATE несовместим с GROUP BY
+            session.exec(select(column).where(column.in_(chunk)).order_by(column).with_for_update()).all()
+        statement = _contributions_statement(_service_rows().where(column.in_(chunk)))
+        for day, patient_id, doctor_id, department_id, count, amount in session.exec(statement):
+            entry = result[(day, patient_id, doctor_id, department_id)]
+            entry[0] += count
+            entry[1] += amount or 0
+    return result
+
+def _apply(session: Session, deltas: dict):
+    """Прибавляет приращения к Billing_Daily (upsert по первичному ключу), пустые строки удаляет"""
+    rows = [dict(zip(_KEY, key), services_count=count, amount=amount)
+            for key, (count, amount) in sorted(deltas.items()) if count or amount]
+    if not rows:
+        return
+    table = Billing_Daily.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        statement = upsert(table)
+        statement = statement.on_conflict_do_update(index_elements=list(_KEY), set_={
+            "services_count": table.c.services_count + statement.excluded.services_count,
+            "amount": table.c.amount + statement.excluded.amount,
+        })
+        session.execute(statement, rows)
+    else:
+        for row in rows:
+            where = [table.c[name] == row[name] for name in _KEY]
+            changed = session.execute(update(table).where(*where).values(
+                services_count=table.c.services_count + row["services_count"], amount=table.c.amount + row["amount"]))
+            if not changed.rowcount:
+                session.execute(insert(table).values(**row))
+    session.execute(delete(table).where(table.c.day.in_({row["day"] for row in rows}),
+                                        table.c.services_count == 0, table.c.amount == 0))
+
+
+def _lock_dependencies(session: Session, column, ids: list):
+    """Блокирует строки, от которых зависят ключ и сумма услуг column.table с данными id: приемы — как
+    booking.py врачей, FOR NO KEY UPDATE; врачей и прайс — FOR SHARE. Всегда по возрастанию id"""
+    appointments, doctors, services = set(), set(), set()
+    for start in range(0, len(ids), LOOKUP_CHUNK):
+        statement = (
+            select(Appointments.id, Appointments.doctor_id, Services_Rendered.service_id)
+            .select_from(Medical_Records)
+            .join(Appointments, Appointments.id == Medical_Records.appointment_id)
+            .outerjoin(Services_Rendered, Services_Rendered.record_id == Medical_Records.id)
+            .where(column.in_(ids[start:start + LOOKUP_CHUNK]))
+        )
+        for appointment_id, doctor_id, service_id in session.exec(statement):
+            appointments.add(appointment_id)
+            doctors.add(doctor_id)
+            services.add(service_id)
+    for model, ids, share in ((Appointments, appointments, False), (Doctors, doctors, True),
+                              (Service_Catalog, services, True)):
+        ids = sorted(ids - {None})
+        if ids:
+            session.exec(select(model.id).where(model.id.in_(ids)).order_by(model.id)
+                         .with_for_update(read=share, key_share=not share)).all()
+
+
+# --- Слушатели записей crud_router ---
+
+# Услуги и медкарты: их запись не блокирует прием, от которого зависит ключ сводки
+_DEPENDENT = {"services_rendered", "medical_records"}
+
+def before_write(session: Session, table: str, op: str, ids: list):
+    column = BILLING_SOURCES.get(table)
+    if column is None or not ids:
+        return
+    if table in _DEPENDENT:
+        _lock_dependencies(session, column, ids)
+    if table == Doctors.__tablename__ and op == "update":
+        session.info[_DEPARTMENTS] = dict(session.exec(
+            select(Doctors.id, Doctors.department_id).where(Doctors.id.in_(ids)).order_by(Doctors.id).with_for_update()).all())
+        return
+    pending = session.info.setdefault(_PENDING, defaultdict(lambda: [0, Decimal(0)]))
+    for key, (count, amount) in _contributions(session, column, ids, lock=True).items():
+        pending[key][0] -= count
+        pending[key][1] -= amount
+
+def after_write(session: Session, table: str, op: str, ids: list):
+    column = BILLING_SOURCES.get(table)
+    if column is None:
+        return
+    deltas = session.info.pop(_PENDING, None) or defaultdict(lambda: [0, Decimal(0)])
+    departments = session.info.pop(_DEPARTMENTS, None)
+    if departments is not None:
+        _move_departments(session, departments, ids, deltas)
+    elif ids and op != "delete":
+        if table in _DEPENDENT:
+            _lock_dependencies(session, column, ids)
+        for key, (count, amount) in _contributions(session, column, ids).items():
+            deltas[key][0] += count
+            deltas[key][1] += amount
+    _apply(session, deltas)
+
+
+def _move_departments(session: Session, before: dict, ids: list, deltas: dict):
+    """Вклад врачей, сменивших отделение, переносится из ключей со старым отделением в ключи с новым"""
+    returned = session.info.get(RETURNED_ROWS, {}).get(Doctors.__tablename__)
+    after = ({id: row["department_id"] for id, row in returned.items()} if returned else
+             dict(session.exec(select(Doctors.id, Doctors.department_id).where(Doctors.id.in_(ids))).all()))
+    moved = [id for id in ids if id in before and after.get(id) != before[id]]
+    if not moved:
+        return
+    for key, (count, amount) in _contributions(session, Doctors.id, moved).items():
+        day, patient_id, doctor_id, _ = key
+        old = (day, patient_id, doctor_id, before[doctor_id] or 0)
+        deltas[old][0] -= count
+        deltas[old][1] -= amount
+        deltas[key][0] += count
+        deltas[key][1] += amount
+
+
+# --- Пересборка ---
+
+def rebuild(session: Session, date_from: Optional[date] = None, date_to: Optional[date] = None) -> int:
+    """Пересчитывает сводку за период (по умолчанию — целиком) из рабочих и архивных таблиц. Без commit"""
+    table = Billing_Daily.__table__
+    sources = [(_service_rows(), Appointments),
+               (_service_rows(Services_Rendered_Archive, Medical_Records_Archive, Appointments_Archive), Appointments_Archive)]
+    purge = delete(table)
+    if date_from:
+        sources = [(rows.where(model.datetime >= datetime.combine(date_from, datetime.min.time())), model)
+                   for rows, model in sources]
+        purge = purge.where(table.c.day >= date_from)
+    if date_to:
+        sources = [(rows.where(model.datetime < datetime.combine(date_to + timedelta(days=1), datetime.min.time())), model)
+                   for rows, model in sources]
+        purge = purge.where(table.c.day <= date_to)
+    source = _contributions_statement(union_all(*(rows for rows, _ in sources)))
+    session.execute(purge)
+    result = session.execute(insert(table).from_select(list(_KEY) + ["services_count", "amount"], source))
+    return result.rowcount
+
+def ensure_rollup(engine):
+    """При первом запуске сводка пуста, хотя услуги уже есть — собираем ее целиком"""
+    with Session(engine) as session:
+        if session.exec(select(Billing_Daily.day).limit(1)).first() is None \
+                and session.exec(select(Services_Rendered.id).limit(1)).first() is not None:
+            rebuild(session)
+            session.commit()
+
+
+# --- Отчеты ---
+
+class BillingTotal(SQLModel):
+    id: Optional[int] = None        # пациент / врач / отделение (0 — не указан)
+    period: Optional[date] = None   # день или первое число месяца
+    label: Optional[str] = None
+    services_count: int
+    amount: Decimal
+
+BILLING_GROUPS = ("patients", "doctors", "departments", "days", "months")
+
+def billing_report(session: Session, group: str, date_from: date, date_to: date,
+                   patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                   department_id: Optional[int] = None, limit: int = DEFAULT_REPORT_LIMIT) -> list:
+    """Итоги за [date_from, date_to] по group; по людям и отделениям — крупнейшие суммы первыми"""
+    count = func.sum(Billing_Daily.services_count).label("services_count")
+    amount = func.sum(Billing_Daily.amount, type_=Numeric(12, 2)).label("amount")
+    filters = [Billing_Daily.day >= date_from, Billing_Daily.day <= date_to]
+    for column, value in ((Billing_Daily.patient_id, patient_id), (Billing_Daily.doctor_id, doctor_id),
+                          (Billing_Daily.department_id, department_id)):
+        if value is not None:
+            filters.append(column == value)
+
+    if group in ("days", "months"):
+        rows = session.exec(select(Billing_Daily.day, count, amount).where(*filters)
+                            .group_by(Billing_Daily.day).order_by(Billing_Daily.day)).all()
+        totals = {}
+        for day, services_count, total in rows:
+            period = day.replace(day=1) if group == "months" else day
+            entry = totals.setdefault(period, BillingTotal(period=period, services_count=0, amount=Decimal(0)))
+            entry.services_count += services_count
+            entry.amount += total or 0
+        return list(totals.values())[:limit]
+
+    key, model, label = {
+        "patients": (Billing_Daily.patient_id, Patients, Patients.last_name + " " + Patients.first_name),
+        "doctors": (Billing_Daily.doctor_id, Doctors, Doctors.last_name + " " + Doctors.first_name),
+        "departments": (Billing_Daily.department_id, Departments, Departments.name),
+    }[group]
+    statement = (
+        select(key, label, count, amount).where(*filters)
+        .outerjoin(model, model.id == key)
+        .group_by(key, label).order_by(amount.desc(), key).limit(limit)
+    )
+    return [BillingTotal(id=id, label=name, services_count=services_count, amount=total or 0)
+            for id, name, services_count, total in session.exec(statement)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пересборка дневных сводок взаиморасчетов")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, default=None)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, default=None)
+    args = parser.parse_args(argv)
+
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        rows = rebuild(session, args.date_from, args.date_to)
+        session.commit()
+    table_versions.bump(Billing_Daily.__tablename__)
+    print(f"Готово: {rows} строк сводки")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_
+from sqlmodel import Session, select
+
+from models import Appointments, Doctors, Cabinets, Schedule
+from availability import appointment_duration_expr, DEFAULT_APPOINTMENT_MINUTES
+
+# ===================================================================================
+# --- ЗАПИСЬ НА ПРИЕМ БЕЗ ПЕРЕСЕЧЕНИЙ ---
+# ===================================================================================
+# Проверка выполняется после INSERT/UPDATE записей на прием в той же транзакции, до commit:
+#   1. блокируются строки врачей затронутых записей, затем строки их кабинетов — всегда по
+#      возрастанию id, поэтому параллельные транзакции не попадают во взаимоблокировку;
+#   2. под блокировкой каждая запись сверяется с расписанием врача и с записями врача и кабинета.
+# Вторая транзакция, пишущая тому же врачу, ждет commit первой, а ее следующий запрос
+# (READ COMMITTED) уже видит зафиксированную запись — двойная запись получает 409.
+# FOR NO KEY UPDATE не конфликтует с FOR KEY SHARE, который PostgreSQL берет на строку врача
+# при вставке записи с внешним ключом на нее. SQLite FOR UPDATE не поддерживает,
+# но там запись в БД и так сериализуется блокировкой файла.
+
+_Booking = namedtuple("_Booking", "id doctor_id start end")
+_BEFORE = "booking_before"  # ключ session.info: врач и время записей до UPDATE
+
+
+def _bookings(session: Session, statement) -> list:
+    """Записи из выборки (id, doctor_id, datetime, длительность) как интервалы [start, end)"""
+    return [_Booking(id, doctor_id, start, start + timedelta(minutes=minutes or DEFAULT_APPOINTMENT_MINUTES))
+            for id, doctor_id, start, minutes in session.exec(statement)]
+
+def _lock(session: Session, model, ids):
+    session.exec(select(model.id).where(model.id.in_(ids)).order_by(model.id).with_for_update(key_share=True)).all()
+
+def _find_overlap(bookings: list, checked: set) -> Optional[tuple]:
+    """Пара пересекающихся записей, из которых хотя бы одна проверяется сейчас"""
+    latest = None  # запись с самым поздним концом среди уже просмотренных
+    for booking in sorted(bookings, key=lambda b: b.start):
+        if latest is not None and booking.start < latest.end and (booking.id in checked or latest.id in checked):
+            return latest, booking
+        if latest is None or booking.end > latest.end:
+            latest = booking
+    return None
+
+def _schedule_block(blocks: dict, booking: _Booking):
+    """Блок расписания, в который целиком попадает запись, или None"""
+    for start_time, end_time, cabinet_id in blocks.get((booking.doctor_id, booking.start.isoweekday()), []):
+        if (start_time <= booking.start.time()
+                and booking.end <= datetime.combine(booking.start.date(), end_time)):
+            return cabinet_id
+    return False
+
+def _conflict(first: _Booking, second: _Booking, where: str):
+    raise HTTPException(status_code=409, detail=(
+        f"Appointment {second.start:%Y-%m-%d %H:%M} overlaps appointment {first.id} "
+        f"({first.start:%Y-%m-%d %H:%M}-{first.end:%H:%M}) {where}"))
+
+def remember_appointments(session: Session, table: str, op: str, ids: list):
+    """pre_write_listener: прежние врач и время записей. Смена статуса или пациента у записи,
+    которая уже не укладывается в изменившееся расписание, не должна давать 409"""
+    if table == Appointments.__tablename__ and op == "update":
+        statement = select(Appointments.id, Appointments.doctor_id, Appointments.datetime).where(Appointments.id.in_(ids))
+        session.info[_BEFORE] = {id: (doctor_id, start) for id, doctor_id, start in session.exec(statement)}
+
+def check_appointments(session: Session, ids: list):
+    """Проверка write_check для crud_router: расписание врача и отсутствие пересечений по врачу и кабинету.
+    Проверяются новые записи и записи, у которых изменились врач или время"""
+    before = session.info.pop(_BEFORE, {})
+    duration = appointment_duration_expr()
+    columns = (Appointments.id, Appointments.doctor_id, Appointments.datetime, duration)
+    booked = [b for b in _bookings(session, select(*columns).where(Appointments.id.in_(ids)))
+              if b.doctor_id is not None and before.get(b.id) != (b.doctor_id, b.start)]
+    if not booked:
+        return
+    checked = {b.id for b in booked}
+    doctor_ids = sorted({b.doctor_id for b in booked})
+    _lock(session, Doctors, doctor_ids)
+
+    blocks = {}  # (doctor_id, день недели) -> [(начало, конец, кабинет)]
+    statement = (select(Schedule.doctor_id, Schedule.day_of_week, Schedule.start_time, Schedule.end_time, Schedule.cabinet_id)
+                 .where(Schedule.doctor_id.in_(doctor_ids)))
+    for doctor_id, day_of_week, *block in session.exec(statement):
+        blocks.setdefault((doctor_id, day_of_week), []).append(tuple(block))
+    cabinets = {}  # кабинет -> проверяемые записи в нем
+    for booking in booked:
+        cabinet_id = _schedule_block(blocks, booking)
+        if cabinet_id is False:
+            raise HTTPException(status_code=409, detail=(
+                f"Appointment {booking.start:%Y-%m-%d %H:%M}-{booking.end:%H:%M} "
+                f"is outside doctor {booking.doctor_id} schedule"))
+        if cabinet_id is not None:
+            cabinets.setdefault(cabinet_id, []).append(booking)
+    if cabinets:
+        _lock(session, Cabinets, sorted(cabinets))
+
+    # Один запрос на врача: все его записи от начала дня первой проверяемой до конца последней
+    for doctor_id in doctor_ids:
+        mine = [b for b in booked if b.doctor_id == doctor_id]
+        since = datetime.combine(min(b.start for b in mine).date(), datetime.min.time())
+        statement = select(*columns).where(Appointments.doctor_id == doctor_id, Appointments.datetime >= since,
+                                           Appointments.datetime < max(b.end for b in mine))
+        overlap = _find_overlap(_bookings(session, statement), checked)
+        if overlap:
+            _conflict(*overlap, f"of doctor {doctor_id}")
+
+    # Кабинет занимают записи всех врачей, принимающих в нем по расписанию в это время
+    for cabinet_id, mine in cabinets.items():
+        since = datetime.combine(min(b.start for b in mine).date(), datetime.min.time())
+        statement = (
+            select(*columns, Schedule.day_of_week, Schedule.start_time, Schedule.end_time)
+            .join(Schedule, and_(Schedule.doctor_id == Appointments.doctor_id, Schedule.cabinet_id == cabinet_id))
+            .where(Appointments.datetime >= since, Appointments.datetime < max(b.end for b in mine))
+        )
+        in_cabinet = [
+            _Booking(id, doctor_id, start, start + timedelta(minutes=minutes or DEFAULT_APPOINTMENT_MINUTES))
+            for id, doctor_id, start, minutes, day_of_week, start_time, end_time in session.exec(statement)
+            if day_of_week == start.isoweekday() and start_time <= start.time() < end_time
+        ]
+        overlap = _find_overlap(in_cabinet, checked)
+        if overlap:
+            _conflict(*overlap, f"in cabinet {cabinet_id}")
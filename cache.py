@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+from uuid import uuid4
+
+# ===================================================================================
+# --- READ-THROUGH КЭШ ОТВЕТОВ ---
+# ===================================================================================
+# Хранит уже сериализованные (JSON) ответы: списки справочников и отдельные записи.
+# Ключ включает "поколение" таблицы; любая запись в таблицу меняет поколение, и все ее
+# закэшированные ответы перестают находиться (а затем вытесняются по LRU/TTL).
+# Настройки:
+#   CACHE_BACKEND      memory (по умолчанию) | redis | none
+#   CACHE_URL          адрес Redis-совместимого сервера, например redis://localhost:6379/0
+#   CACHE_TTL_SECONDS  время жизни ответа
+#   CACHE_MAX_ENTRIES  размер LRU для memory
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+
+class MemoryCacheBackend:
+    """LRU с TTL в памяти процесса. Ключи без TTL (поколения таблиц) не вытесняются"""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()  # ключ -> (момент истечения, значение)
+        self._persistent = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._persistent:
+                return self._persistent[key]
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < monotonic():
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value, ttl=None):
+        with self._lock:
+            if ttl is None:
+                self._persistent[key] = value
+                return
+            self._data[key] = (monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def size(self) -> int:
+        return len(self._data)
+
+    def eviction_count(self) -> int:
+        return self.evictions
+
+
+class RedisCacheBackend:
+    """Redis-совместимый сервер: общий кэш для всех воркеров"""
+    def __init__(self, url: str):
+        import redis  # нужен только при CACHE_BACKEND=redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        value = self._client.get(key)
+        return value.decode() if value is not None and key.endswith(":gen") else value
+
+    def set(self, key: str, value, ttl=None):
+        self._client.set(key, value, ex=ttl)
+
+    def size(self) -> int:
+        return self._client.dbsize()
+
+    def eviction_count(self) -> int:
+        info = self._client.info("stats")
+        return info.get("evicted_keys", 0) + info.get("expired_keys", 0)
+
+
+class ReadThroughCache:
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def generation(self, table: str) -> str:
+        generation = self.backend.get(f"{table}:gen")
+        # Новое поколение — случайное, поэтому потерянный счетчик не оживит старые ответы
+        return generation if generation is not None else self.invalidate(table)
+
+    def invalidate(self, table: str) -> str:
+        generation = uuid4().hex
+        self.backend.set(f"{table}:gen", generation)
+        return generation
+
+    def lookup(self, table: str, key: str) -> tuple:
+        """(полный ключ, значение или None) — для загрузки и store() отдельно от обращений к бэкенду"""
+        full_key = f"{table}:{self.generation(table)}:{key}"
+        value = self.backend.get(full_key)
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return full_key, value
+
+    def store(self, full_key: str, value):
+        self.backend.set(full_key, value, self.ttl)
+
+    def get_or_load(self, table: str, key: str, loader) -> bytes:
+        """Значение из кэша либо результат loader(), сохраненный на ttl секунд"""
+        full_key, value = self.lookup(table, key)
+        if value is None:
+            value = loader()
+            self.store(full_key, value)
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.backend.eviction_count(),
+            "ttl_seconds": self.ttl,
+        }
+
+
+def build_cache():
+    if CACHE_BACKEND == "none":
+        return None
+    if CACHE_BACKEND == "redis":
+        return ReadThroughCache(RedisCacheBackend(CACHE_URL), CACHE_TTL_SECONDS)
+    return ReadThroughCache(MemoryCacheBackend(CACHE_MAX_ENTRIES), CACHE_TTL_SECONDS)
+
+cache = build_cache()
@@ -0,0 +1,103 @@
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+
+# ===================================================================================
+# --- СЖАТИЕ ОТВЕТОВ ---
+# ===================================================================================
+# Ответы от COMPRESS_MIN_BYTES сжимаются: brotli, если клиент его принимает и установлен пакет brotli
+# (или brotlicffi), иначе gzip. Потоковые ответы (экспорт) сжимаются по частям, text/event-stream — нет.
+# Уровни подобраны под динамические ответы: максимальные дают на JSON единицы процентов, а CPU — в разы больше.
+#   COMPRESS_MIN_BYTES  минимальный размер ответа для сжатия
+#   GZIP_LEVEL          1..9
+#   BROTLI_QUALITY      0..11
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+
+def _accepts(header: str, coding: str) -> bool:
+    """Есть ли coding в Accept-Encoding с ненулевым q"""
+    for part in header.split(","):
+        name, *options = [piece.strip() for piece in part.split(";")]
+        if name.lower() == coding:
+            return not any(option.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for option in options)
+    return False
+
+class BrotliResponder:
+    """Сжатие одного ответа brotli. Собственный ASGI-обработчик, а не наследник внутренних классов
+    starlette.middleware.gzip: их интерфейс меняется между версиями Starlette"""
+    def __init__(self, app, minimum_size: int, quality: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.quality = quality
+        self.send = None
+        self.start_message = None  # http.response.start, задержанный до первого тела
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def compress(self, body: bytes, more_body: bool) -> bytes:
+        data = self.compressor.process(body)
+        return data + (self.compressor.flush() if more_body else self.compressor.finish())
+
+    async def send_compressed(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+            # Уже сжатые, частичные (206) и потоки событий отдаются как есть
+            self.passthrough = ("content-encoding" in headers or message["status"] == 206
+                                or media_type == "text/event-stream")
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if more_body or len(body) >= self.minimum_size:
+                self.compressor = brotli.Compressor(quality=self.quality)
+                body = self.compress(body, more_body)
+                headers["Content-Encoding"] = "br"
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+            await self.send(start)
+        elif self.compressor is not None:
+            body = self.compress(body, more_body)
+        await self.send({**message, "body": body})
+
+class CompressionMiddleware(GZipMiddleware):
+    def __init__(self, app):
+        super().__init__(app, minimum_size=COMPRESS_MIN_BYTES, compresslevel=GZIP_LEVEL)
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] == "http" and brotli is not None
+                and _accepts(Headers(scope=scope).get("accept-encoding", ""), "br")):
+            return await BrotliResponder(self.app, self.minimum_size, BROTLI_QUALITY)(scope, receive, send)
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,480 @@
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, Body
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import SQLModel, Session, select
+from sqlalchemy import insert, update, delete, literal, tuple_, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.util import await_only
+from pydantic import TypeAdapter, ValidationError, create_model
+from pydantic_core import to_json
+from typing import List, Optional
+from collections import Counter
+from contextlib import contextmanager
+import base64
+import inspect
+import json
+
+from formats import negotiate, encode_rows, LIST_RESPONSES
+from models import SERVER_FIELDS
+from cache import CACHE_BACKEND
+
+
+# ===================================================================================
+# --- ПАГИНАЦИЯ, ФИЛЬТРЫ И СОРТИРОВКА СПИСКОВ ---
+# ===================================================================================
+# Списки отдаются страницами (keyset-пагинация по id): клиент передает ?after_id=<id последней
+# записи> и получает следующую страницу, курсор на нее приходит в заголовке X-Next-Cursor.
+# При ?order_by=<колонка> X-Next-Cursor — непрозрачный токен (значение колонки и id последней записи),
+# он передается как ?cursor=. Значение хранится в самом токене: удаление строки-курсора между
+# страницами не обрывает список.
+# Фильтры задаются именами колонок: ?doctor_id=3, а диапазоны — суффиксами _from/_to:
+# ?datetime_from=2024-01-01T00:00&datetime_to=2024-01-08T00:00
+# ?updated_since=<токен> вместо страницы отдает изменения и удаления после токена (см. sync.py)
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+SYNC_TOKEN_HEADER = "X-Sync-Token"
+
+class ListParams:
+    """Параметры запроса списка: курсор, размер страницы, сортировка и фильтры по колонкам"""
+    def __init__(
+        self,
+        request: Request,
+        response: Response,
+        after_id: Optional[int] = Query(None, description="id последней записи предыдущей страницы"),
+        cursor: Optional[str] = Query(None, description="X-Next-Cursor предыдущей страницы при order_by не id"),
+        limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+        order_by: str = Query("id", description="Колонка сортировки (NOT NULL)"),
+        desc: bool = Query(False, description="Сортировка по убыванию"),
+        updated_since: Optional[str] = Query(None, description="Токен синхронизации: только изменения после него"),
+    ):
+        self.after_id = after_id
+        self.cursor = cursor
+        self.limit = limit
+        self.order_by = order_by
+        self.desc = desc
+        self.updated_since = updated_since
+        self.filters = {k: v for k, v in request.query_params.items()
+                        if k not in ("after_id", "cursor", "limit", "order_by", "desc", "updated_since")}
+        self.query = str(request.url.query)
+        self.accept = request.headers.get("accept", "")
+        self.response = response
+
+def _parse_filter_value(model, column, raw: str):
+    try:
+        return TypeAdapter(model.model_fields[column.name].annotation).validate_python(raw)
+    except ValidationError:
+        raise HTTPException(status_code=422, detail=f"Invalid value for {column.name}: {raw}")
+
+def filter_names(model) -> set:
+    """Имена параметров запроса, которые apply_filters понимает для model"""
+    return {column.name + suffix for column in model.__table__.columns for suffix in ("", "_from", "_to")}
+
+def apply_filters(statement, model, filters: dict):
+    """Добавляет в запрос условия ?col=, ?col_from=, ?col_to= для колонок модели"""
+    for column in model.__table__.columns:
+        if column.name in filters:
+            statement = statement.where(column == _parse_filter_value(model, column, filters[column.name]))
+        if column.name + "_from" in filters:
+            statement = statement.where(column >= _parse_filter_value(model, column, filters[column.name + "_from"]))
+        if column.name + "_to" in filters:
+            statement = statement.where(column <= _parse_filter_value(model, column, filters[column.name + "_to"]))
+    return statement
+
+def _encode_cursor(params: ListParams, value, id: int) -> str:
+    raw = to_json([params.order_by, params.desc, value, id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(model, column, params: ListParams) -> tuple:
+    """(значение колонки сортировки, id) из ?cursor=; токен другой сортировки — 422"""
+    try:
+        order_by, desc, value, id = json.loads(base64.urlsafe_b64decode(params.cursor + "=" * (-len(params.cursor) % 4)))
+        if (order_by, desc) != (params.order_by, params.desc):
+            raise ValueError
+        return TypeAdapter(model.model_fields[column.name].annotation).validate_python(value), int(id)
+    except (ValueError, TypeError, ValidationError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+def paginate(session: Session, model, params: ListParams, columns: Optional[list] = None, archive=None):
+    """Одна страница списка. Курсор — id, при сортировке по другой колонке — токен с парой (колонка, id).
+    С columns возвращает строки-кортежи этих колонок вместо объектов модели.
+    archive — архивная модель с теми же колонками: страница строится по рабочей таблице и архиву вместе (нужны columns)"""
+    column = model.__table__.columns.get(params.order_by)
+    if column is None or column.nullable:
+        raise HTTPException(status_code=422, detail=f"Cannot order by {params.order_by}")
+    if params.after_id is not None and (params.cursor is not None or column.name != "id"):
+        raise HTTPException(status_code=422, detail="after_id works only with order_by=id, "
+                                                    "pass X-Next-Cursor as cursor")
+    after = _decode_cursor(model, column, params) if params.cursor is not None else None
+
+    if archive is None:
+        source = model.__table__
+        statement = apply_filters(select(*columns) if columns else select(model), model, params.filters)
+    else:
+        # Фильтры — в каждой ветви (там работают индексы таблиц), сортировка и курсор — по объединению
+        source = union_all(*(apply_filters(select(*m.__table__.columns), m, params.filters)
+                             for m in (model, archive))).subquery()
+        statement = select(*source.c)
+    column, id_column = source.c[column.name], source.c.id
+    if params.after_id is not None:
+        key, anchor = id_column, literal(params.after_id)
+        statement = statement.where(key < anchor if params.desc else key > anchor)
+    elif after is not None:
+        key, anchor = tuple_(column, id_column), tuple_(literal(after[0], column.type), literal(after[1]))
+        statement = statement.where(key < anchor if params.desc else key > anchor)
+    if params.desc:
+        statement = statement.order_by(column.desc(), id_column.desc())
+    else:
+        statement = statement.order_by(column, id_column)
+
+    # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+    items = session.exec(statement.limit(params.limit + 1)).all()
+    if len(items) > params.limit:
+        items = items[:params.limit]
+        last = items[-1]
+        params.response.headers[NEXT_CURSOR_HEADER] = (
+            str(last.id) if column is id_column else _encode_cursor(params, getattr(last, column.name), last.id))
+    return items
+
+
+# ===================================================================================
+# --- ОБЩИЙ CRUD-РОУТЕР ---
+# ===================================================================================
+# Один и тот же набор эндпоинтов для каждой таблицы:
+#   POST /, GET /, GET /{id}, PATCH /{id}, DELETE /{id}
+#   POST /bulk, PATCH /bulk, DELETE /bulk — массивы записей в одной транзакции
+# Запись одной строки — один запрос к БД: INSERT / UPDATE / DELETE ... RETURNING по таблице (Core, без объектов
+# ORM), 404 — по пустому RETURNING. Оптимистичная блокировка: PATCH /{id}?version=N и DELETE /{id}?version=N
+# (в PATCH /bulk — поле version записи) меняют строку, только если ее version все еще N, иначе 409.
+
+MAX_BULK_ITEMS = 10000
+
+# Слушатели изменений: после каждой успешной записи вызывается listener(table, op, ids),
+# op — "create" / "update" / "delete", ids — id затронутых строк
+write_listeners = []
+# Слушатели внутри транзакции записи, вызываются как listener(session, table, op, ids):
+# pre — перед UPDATE/DELETE (строки еще в прежнем виде), post — после INSERT/UPDATE/DELETE до commit.
+# Исключение из слушателя откатывает запись
+pre_write_listeners = []
+post_write_listeners = []
+# Строки, уже полученные RETURNING, для post_write_listeners: session.info[RETURNED_ROWS] = {table: {id: dict}}
+RETURNED_ROWS = "returned_rows"
+
+class BulkItemResult(SQLModel):
+    id: int
+    ok: bool
+    detail: Optional[str] = None
+
+def _check_bulk_size(items: list):
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+
+def _table_rows(model, items: list, exclude: set, bulk: bool) -> list:
+    """Записи тела через model_validate табличной модели: схема запроса не проверяет все ее ограничения.
+    Ошибки всех записей — одним 422 в формате FastAPI, loc: body[, номер записи], поле"""
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            rows.append(model.model_validate(item, from_attributes=True)
+                        .model_dump(exclude=exclude | ({"id"} if item.id is None else set())))
+        except ValidationError as e:
+            where = ["body", index] if bulk else ["body"]
+            errors.extend({"loc": where + list(error["loc"]), "msg": error["msg"], "type": error["type"]}
+                          for error in e.errors())
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    return rows
+
+@contextmanager
+def _transaction(session: Session):
+    """Фиксирует изменения блока; нарушение ограничений БД откатывает всю пачку и дает 409"""
+    try:
+        yield
+        session.commit()
+    except IntegrityError as e:
+        session.rollback()
+        raise HTTPException(status_code=409, detail=str(e.orig))
+    except Exception:
+        session.rollback()
+        raise
+
+def _archive_flag(enabled: bool):
+    """Зависимость ?include_archive; у таблиц без архива параметра нет"""
+    if not enabled:
+        return lambda: False
+    def include_archive(include_archive: bool = Query(False, description="Искать и в архиве (см. archive.py)")) -> bool:
+        return include_archive
+    return include_archive
+
+def crud_router(model, update_model, prefix: str, tag: str, one: str, many: str, get_session,
+                is_async: bool = False, cache=None, cache_lists: bool = False, write_check=None,
+                versions=None, archive=None, read_session=None, sync=None) -> APIRouter:
+    """Собирает роутер CRUD для таблицы model. one/many — имена записи и списка для имен эндпоинтов.
+    При is_async get_session отдает AsyncSession, а обработчики становятся корутинами.
+    cache — ReadThroughCache для GET /{id} (и для GET / при cache_lists), записи его инвалидируют.
+    write_check(session, ids) вызывается после INSERT/UPDATE до commit; HTTPException из нее откатывает запись.
+    versions — TableVersions: GET-запросы получают ETag и 304 по версии таблицы (см. versions.py).
+    archive — архивная модель таблицы (см. archive.py): GET / и GET /{id} читают ее при ?include_archive=true.
+    read_session(*tables) — фабрика зависимости сессии для GET / и GET /{id} (реплики, см. replicas.py),
+    по умолчанию они читают через get_session.
+    sync — DeltaSync: GET / с ?updated_since= отдает изменения и удаления после токена (см. sync.py).
+    Общие для всех таблиц действия в транзакции — pre_write_listeners / post_write_listeners"""
+    router = APIRouter(prefix=prefix, tags=[tag])
+    table = model.__tablename__
+    conditional = [Depends(versions.conditional(table))] if versions is not None else None
+    columns = list(model.__table__.columns)
+    filters = filter_names(model)
+    source = model.__table__
+    # created_at / updated_at / version ставит БД (см. models.py), из тела запроса они не принимаются
+    server_fields = SERVER_FIELDS & set(model.model_fields)
+    archive_flag = _archive_flag(archive is not None)
+    read_tables = (table,) if archive is None else (table, archive.__tablename__)
+    get_read_session = read_session(*read_tables) if read_session is not None else get_session
+
+    def before(session: Session, op: str, ids: list):
+        for listener in pre_write_listeners:
+            listener(session, table, op, ids)
+
+    def check(session: Session, op: str, ids: list, rows: Optional[list] = None):
+        if write_check is not None and ids and op != "delete":
+            write_check(session, ids)
+        if rows is not None:
+            session.info[RETURNED_ROWS] = {table: {row["id"]: row for row in rows}}
+        try:
+            for listener in post_write_listeners:
+                listener(session, table, op, ids)
+        finally:
+            session.info.pop(RETURNED_ROWS, None)
+
+    def missing(session: Session, item_id: int, version: Optional[int]) -> HTTPException:
+        """Почему запись не изменилась: строки нет (404) или ее версия уже другая (409)"""
+        current = None
+        if version is not None:
+            current = session.execute(select(source.c.version).where(source.c.id == item_id)).scalar()
+        if current is None:
+            return HTTPException(status_code=404, detail="Not found")
+        return HTTPException(status_code=409, detail=f"Version conflict: current version is {current}")
+
+    blocking_io = is_async and CACHE_BACKEND == "redis"
+
+    def off_loop(function, *args):
+        """Вызов кэша, версий таблиц и слушателей записей — при CACHE_BACKEND=redis они ходят в Redis синхронным
+        клиентом. В асинхронном режиме тело обработчика выполняется в цикле событий, поэтому такой вызов уходит
+        в пул потоков, а тело ждет его через await_only, как асинхронный драйвер БД ждет свои запросы.
+        Memory-бэкенды работают только с памятью процесса: переход в пул стоил бы дороже самого вызова"""
+        if not blocking_io:
+            return function(*args)
+        return await_only(run_in_threadpool(function, *args))
+
+    def notify(op: str, ids: list):
+        if cache is not None:
+            cache.invalidate(table)
+        for listener in write_listeners:
+            listener(table, op, ids)
+
+    def changed(op: str, ids: list):
+        off_loop(notify, op, ids)
+
+    def cached(key: str, loader) -> bytes:
+        """cache.get_or_load, но loader (запросы к БД) — в теле обработчика, а обращения к кэшу — через off_loop"""
+        full_key, value = off_loop(cache.lookup, table, key)
+        if value is None:
+            value = loader()
+            off_loop(cache.store, full_key, value)
+        return value
+
+    def endpoint(route):
+        # Тело обработчика одно на оба режима: в асинхронном оно выполняется через AsyncSession.run_sync,
+        # запросы к БД идут через асинхронный драйвер и не занимают поток из пула FastAPI.
+        # Обращения к кэшу и слушатели записей — только через cached() / changed() (см. off_loop)
+        def register(handler):
+            if not is_async:
+                return route(handler)
+            async def async_handler(**kwargs):
+                session = kwargs.pop("session")
+                return await session.run_sync(lambda sync_session: handler(session=sync_session, **kwargs))
+            async_handler.__signature__ = inspect.signature(handler)
+            async_handler.__name__ = handler.__name__
+            return route(async_handler)
+        return register
+    # Для PATCH /bulk каждая запись несет свой id и, для оптимистичной блокировки, ожидаемую версию
+    bulk_update_model = create_model(f"{update_model.__name__}Bulk", __base__=update_model, id=(int, ...),
+                                     version=(Optional[int], None))
+    expected_version = Query(None, description="Ожидаемая версия строки: если она уже другая — 409")
+
+    # Пути /bulk объявлены раньше /{item_id}, иначе "bulk" попадет в item_id
+    @endpoint(router.post("/bulk", response_model=List[model], name=f"create_{many}_bulk"))
+    def create_items(items: List[model], session: Session = Depends(get_session)):
+        _check_bulk_size(items)
+        if not items:
+            return []
+        # Табличные модели SQLModel не приводят типы при разборе тела (datetime остается строкой),
+        # поэтому каждая запись проходит model_validate — все до INSERT
+        rows = _table_rows(model, items, server_fields, bulk=True)
+        # Многострочный INSERT ... RETURNING, записи возвращаются в порядке запроса
+        with _transaction(session):
+            created = [row._asdict() for row in
+                       session.execute(insert(source).returning(*columns, sort_by_parameter_order=True), rows)]
+            check(session, "create", [item["id"] for item in created], created)
+        changed("create", [item["id"] for item in created])
+        return created
+
+    @endpoint(router.patch("/bulk", response_model=List[BulkItemResult], name=f"update_{many}_bulk"))
+    def update_items(items: List[bulk_update_model], session: Session = Depends(get_session)):
+        _check_bulk_size(items)
+        ids = [item.id for item in items]
+        # Повтор id в одной пачке применился бы дважды при одной ожидаемой версии
+        duplicates = sorted(i for i, count in Counter(ids).items() if count > 1)
+        if duplicates:
+            raise HTTPException(status_code=422, detail=f"Duplicate ids: {duplicates}")
+        data = {item.id: item.model_dump(exclude_unset=True, exclude={"id", "version"}) for item in items}
+        versions = {item.id: item.version for item in items if item.version is not None}
+        updated, lost = set(), {}
+        with _transaction(session):
+            existing = dict(session.execute(select(source.c.id, source.c.version).where(source.c.id.in_(ids))
+                                            .with_for_update()).all())
+            targets = [i for i in ids if i in existing and data[i] and versions.get(i, existing[i]) == existing[i]]
+            if targets:
+                before(session, "update", targets)
+                # Без version — ORM bulk UPDATE по первичному ключу: executemany, сгруппированный по набору полей
+                plain = [dict(data[i], id=i) for i in targets if i not in versions]
+                if plain:
+                    session.execute(update(model), plain)
+                    updated.update(row["id"] for row in plain)
+                # С version — UPDATE на строку с версией в WHERE, как PATCH /{id}: проверка выше только предварительная
+                # (SQLite не блокирует строки), изменилась ли строка — по RETURNING
+                for i in targets:
+                    if i not in versions:
+                        continue
+                    condition = (source.c.id == i) & (source.c.version == versions[i])
+                    if session.execute(update(source).where(condition).values(data[i]).returning(source.c.id)).first():
+                        updated.add(i)
+                    else:
+                        lost[i] = missing(session, i, versions[i]).detail
+                # Слушатели до и после записи получают одни и те же id: вычтенное до UPDATE возвращается и для
+                # строк, которые UPDATE не тронул
+                check(session, "update", targets)
+        if updated:
+            changed("update", sorted(updated))
+        def result(i):
+            if i not in existing:
+                return BulkItemResult(id=i, ok=False, detail="Not found")
+            if versions.get(i, existing[i]) != existing[i]:
+                return BulkItemResult(id=i, ok=False, detail=f"Version conflict: current version is {existing[i]}")
+            if i in lost:
+                return BulkItemResult(id=i, ok=False, detail=lost[i])
+            if not data[i]:
+                # Менять нечего: строка не тронута, версия не растет — как PATCH /{id} с пустым телом
+                return BulkItemResult(id=i, ok=True, detail="No changes")
+            return BulkItemResult(id=i, ok=True)
+        return [result(i) for i in ids]
+
+    @endpoint(router.delete("/bulk", response_model=List[BulkItemResult], name=f"delete_{many}_bulk"))
+    def delete_items(ids: List[int] = Body(...), session: Session = Depends(get_session)):
+        _check_bulk_size(ids)
+        deleted = set()
+        with _transaction(session):
+            if ids:
+                before(session, "delete", ids)
+                deleted = set(session.scalars(delete(model).where(model.id.in_(ids)).returning(model.id)).all())
+                check(session, "delete", sorted(deleted))
+        changed("delete", sorted(deleted))
+        return [BulkItemResult(id=i, ok=i in deleted, detail=None if i in deleted else "Not found") for i in ids]
+
+    @endpoint(router.post("/", response_model=model, name=f"create_{one}"))
+    def create_item(item: model, session: Session = Depends(get_session)):
+        row, = _table_rows(model, [item], server_fields, bulk=False)
+        with _transaction(session):
+            created = session.execute(insert(source).returning(*columns), row).one()._asdict()
+            check(session, "create", [created["id"]], [created])
+        changed("create", [created["id"]])
+        return created
+
+    @endpoint(router.get("/", response_model=List[model], responses=LIST_RESPONSES, name=f"read_{many}",
+                         dependencies=conditional))
+    def read_items(params: ListParams = Depends(), include_archive: bool = Depends(archive_flag),
+                   session: Session = Depends(get_read_session)):
+        # Строки страницы кодируются сразу в формат из Accept (formats.py), минуя объекты ORM и response_model
+        if params.updated_since is not None:
+            if sync is None:
+                raise HTTPException(status_code=422, detail="updated_since is not supported")
+            if (params.after_id is not None or params.cursor is not None or params.order_by != "id" or params.desc
+                    or include_archive or filters & params.filters.keys()):
+                raise HTTPException(status_code=422, detail="updated_since cannot be combined with "
+                                                            "after_id, cursor, order_by, desc, filters or include_archive")
+            # Изменения — всегда JSON и мимо кэша: ответ зависит от токена, а не только от таблицы
+            return Response(content=sync.changes(session, model, columns, params.updated_since, params.limit),
+                            media_type="application/json")
+        fmt = negotiate(params.accept)
+        def load():
+            # Токен синхронизации — на момент до чтения страницы, и в кэше хранится вместе с ней
+            token = sync.token() if sync is not None and params.after_id is None and params.cursor is None else ""
+            rows = paginate(session, model, params, columns, archive if include_archive else None)
+            return params.response.headers.get(NEXT_CURSOR_HEADER, ""), token, encode_rows(fmt, columns, rows)
+        if cache is None or not cache_lists:
+            cursor, token, body = load()
+        else:
+            # В кэше лежит готовая страница, первой строкой — курсор следующей страницы и токен синхронизации
+            def load_page():
+                cursor, token, body = load()
+                return f"{cursor} {token}".encode() + b"\n" + body
+            head, body = cached(f"page:{fmt}:{params.query}", load_page).split(b"\n", 1)
+            cursor, token = head.decode().split(" ")
+        headers = {"Vary": "Accept"}
+        if cursor:
+            headers[NEXT_CURSOR_HEADER] = cursor
+        if token:
+            headers[SYNC_TOKEN_HEADER] = token
+        return Response(content=body, media_type=fmt, headers=headers)
+
+    @endpoint(router.get("/{item_id}", response_model=model, name=f"read_{one}", dependencies=conditional))
+    def read_item(item_id: int, include_archive: bool = Depends(archive_flag),
+                  session: Session = Depends(get_read_session)):
+        def load():
+            item = session.get(model, item_id)
+            if not item and include_archive:
+                row = session.exec(select(*archive.__table__.columns).where(archive.id == item_id)).first()
+                item = model.model_validate(row._mapping) if row else None
+            if not item: raise HTTPException(status_code=404, detail="Not found")
+            return item
+        if cache is None:
+            return load()
+        key = f"item:{item_id}:archive" if include_archive else f"item:{item_id}"
+        body = cached(key, lambda: load().model_dump_json().encode())
+        return Response(content=body, media_type="application/json")
+
+    @endpoint(router.patch("/{item_id}", response_model=model, name=f"update_{one}"))
+    def update_item(item_id: int, update_data: update_model, version: Optional[int] = expected_version,
+                    session: Session = Depends(get_session)):
+        data = update_data.model_dump(exclude_unset=True)
+        condition = source.c.id == item_id
+        if version is not None:
+            condition &= source.c.version == version
+        if not data:
+            # Менять нечего: строка отдается как есть, версия не растет
+            item = session.execute(select(*columns).where(condition)).first()
+            if item is None: raise missing(session, item_id, version)
+            return item._asdict()
+        with _transaction(session):
+            before(session, "update", [item_id])
+            item = session.execute(update(source).where(condition).values(data).returning(*columns)).first()
+            if item is None: raise missing(session, item_id, version)
+            item = item._asdict()
+            check(session, "update", [item_id], [item])
+        changed("update", [item_id])
+        return item
+
+    @endpoint(router.delete("/{item_id}", name=f"delete_{one}"))
+    def delete_item(item_id: int, version: Optional[int] = expected_version, session: Session = Depends(get_session)):
+        condition = source.c.id == item_id
+        if version is not None:
+            condition &= source.c.version == version
+        with _transaction(session):
+            before(session, "delete", [item_id])
+            if session.execute(delete(source).where(condition).returning(source.c.id)).first() is None:
+                raise missing(session, item_id, version)
+            check(session, "delete", [item_id])
+        changed("delete", [item_id])
+        return {"ok": True}
+
+    return router
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+import os
+import select as selectors
+import threading
+from collections import deque
+from time import sleep
+from typing import Optional
+from uuid import uuid4
+
+from pydantic_core import to_json
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, SQLModel
+
+from models import Doctors
+from crud import RETURNED_ROWS
+
+# ===================================================================================
+# --- ЛЕНТА ИЗМЕНЕНИЙ (SERVER-SENT EVENTS) ---
+# ===================================================================================
+# Каждая запись через crud_router становится событием ленты: таблица, операция, id и строки после записи
+# (для delete — только id). GET /changes отдает ленту потоком text/event-stream (EventSource в браузере):
+#   id: <номер>            номер события, браузер пришлет его в Last-Event-ID при переподключении
+#   event: change          data: {"table": "appointments", "op": "update", "ids": [...], "rows": [...]}
+#   event: resync          data: {"table": ...} — события пропущены (очередь клиента переполнена,
+#                          запись слишком большая, разрыв связи с БД): перечитать таблицу (без table — все)
+# Фильтры: ?tables=appointments,schedules, ?doctor_id=, ?department_id= — для таблиц с врачом (записи,
+# расписание, сами врачи); перенос записи к другому врачу виден подписчикам и прежнего, и нового врача.
+# Строки читаются внутри транзакции записи (post_write_listeners), а публикуются только после commit:
+#   FEED_BACKEND=memory    рассылка подписчикам этого процесса (после commit сессии)
+#   FEED_BACKEND=postgres  NOTIFY в той же транзакции, каждый воркер слушает канал (LISTEN) и рассылает своим
+#                          подписчикам — события видны во всех воркерах. Нужен драйвер psycopg2
+# Настройки:
+#   CHANGE_FEED=0            не собирать события (запись без дополнительного SELECT)
+#   FEED_MAX_ROWS            записи большего числа строк публикуются как resync
+#   FEED_QUEUE_SIZE          очередь событий на подписчика
+#   FEED_HISTORY             сколько последних событий хранится для повтора по Last-Event-ID
+#   FEED_HEARTBEAT_SECONDS   период комментария-пинга в пустом потоке (не дает прокси закрыть соединение)
+
+CHANGE_FEED = os.getenv("CHANGE_FEED", "1").lower() in ("1", "true", "yes")
+FEED_BACKEND = os.getenv("FEED_BACKEND", "memory").lower()
+FEED_CHANNEL = "polyclinic_changes"
+FEED_MAX_ROWS = int(os.getenv("FEED_MAX_ROWS", "500"))
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", "1000"))
+FEED_HISTORY = int(os.getenv("FEED_HISTORY", "1000"))
+FEED_HEARTBEAT_SECONDS = float(os.getenv("FEED_HEARTBEAT_SECONDS", "15"))
+FEED_RETRY_MS = 3000
+# Предел полезной нагрузки NOTIFY — 8000 байт; строки делятся на события меньше этого
+NOTIFY_MAX_BYTES = 7500
+
+_EVENTS = "feed_events"    # ключ session.info: события транзакции до commit (memory)
+_OLD_SCOPE = "feed_scope"  # ключ session.info: врачи и отделения строк до UPDATE/DELETE
+
+feed_log = logging.getLogger("polyclinic.feed")
+
+
+# --- События ---
+
+def _scoped(table) -> bool:
+    return "doctor_id" in table.c or table.name == Doctors.__tablename__
+
+def _scope_statement(table, *columns):
+    """Строки таблицы с (врач, отделение) в конце. Метки нужны: повтор той же колонки select схлопывает"""
+    if table.name == Doctors.__tablename__:
+        return select(*columns, table.c.id.label("scope_doctor"), table.c.department_id.label("scope_department"))
+    return (select(*columns, table.c.doctor_id.label("scope_doctor"), Doctors.department_id.label("scope_department"))
+            .outerjoin(Doctors, Doctors.id == table.c.doctor_id))
+
+def _part(event: dict, indices: list, with_rows: bool = True) -> dict:
+    part = {"table": event["table"], "op": event["op"], "ids": [event["ids"][i] for i in indices],
+            "scope": [event["scope"][i] for i in indices] if event["scope"] is not None else None}
+    if with_rows and "rows" in event:
+        part["rows"] = [event["rows"][i] for i in indices]
+    return part
+
+def _chunks(event: dict) -> list:
+    """Делит событие по строкам так, чтобы каждое уместилось в NOTIFY; строку больше предела — без данных"""
+    if len(to_json(event)) <= NOTIFY_MAX_BYTES:
+        return [event]
+    parts, current = [], []
+    for index in range(len(event["ids"])):
+        if len(to_json(_part(event, current + [index]))) <= NOTIFY_MAX_BYTES:
+            current.append(index)
+            continue
+        if current:
+            parts.append(_part(event, current))
+        current = [index]
+        if len(to_json(_part(event, current))) > NOTIFY_MAX_BYTES:
+            parts.append(_part(event, current, with_rows=False))  # клиент дочитает запись по id
+            current = []
+    if current:
+        parts.append(_part(event, current))
+    return parts
+
+
+class ChangeFeed:
+    def __init__(self, backend: str = FEED_BACKEND):
+        self.backend = backend
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=FEED_HISTORY)
+        self._last_id = 0
+        # Номера событий у каждого процесса свои: Last-Event-ID другого процесса (после переподключения
+        # к соседнему воркеру) распознается по эпохе и дает resync
+        self._epoch = uuid4().hex[:8]
+        self._listener = None
+        self._stop = threading.Event()
+        self.engine = None
+
+    # --- Сбор событий в транзакции записи ---
+
+    def before_write(self, session: Session, table: str, op: str, ids: list):
+        """pre_write_listener: врачи и отделения строк до изменения"""
+        source = SQLModel.metadata.tables.get(table)
+        if not CHANGE_FEED or not ids or source is None or not _scoped(source) or len(ids) > FEED_MAX_ROWS:
+            return
+        rows = session.execute(_scope_statement(source, source.c.id).where(source.c.id.in_(ids))).all()
+        session.info.setdefault(_OLD_SCOPE, {})[table] = {id: (doctor, department) for id, doctor, department in rows}
+
+    def after_write(self, session: Session, table: str, op: str, ids: list):
+        """post_write_listener: строки после записи -> событие, публикуется после commit"""
+        source = SQLModel.metadata.tables.get(table)
+        old = session.info.get(_OLD_SCOPE, {}).pop(table, {})
+        if not CHANGE_FEED or not ids or source is None:
+            return
+        if len(ids) > FEED_MAX_ROWS:
+            events = [{"resync": True, "table": table}]
+        else:
+            scoped = _scoped(source)
+            rows, scope = [], []
+            returned = session.info.get(RETURNED_ROWS, {}).get(table, {})
+            if op == "delete":
+                rows = None
+                scope = [[[doctor], [department]] for doctor, department in (old.get(id, (None, None)) for id in ids)]
+            elif not scoped and all(id in returned for id in ids):
+                # Строки уже вернул INSERT / UPDATE ... RETURNING, а отделение врача не нужно — без повторного SELECT
+                rows = [returned[id] for id in ids]
+            else:
+                statement = _scope_statement(source, *source.c) if scoped else select(*source.c)
+                loaded = {row.id: row for row in session.execute(statement.where(source.c.id.in_(ids)))}
+                ids = [id for id in ids if id in loaded]
+                width = len(source.c)
+                for id in ids:
+                    row = loaded[id]
+                    rows.append(dict(zip(source.c.keys(), row[:width])))
+                    if scoped:
+                        doctor, department = row[width:]
+                        previous_doctor, previous_department = old.get(id, (doctor, department))
+                        scope.append([list(dict.fromkeys((doctor, previous_doctor))),
+                                      list(dict.fromkeys((department, previous_department)))])
+            event = {"table": table, "op": op, "ids": ids, "scope": scope if scoped else None}
+            if rows is not None:
+                event["rows"] = rows
+            events = [event]
+        if self.backend == "postgres":
+            # NOTIFY доставляется слушателям только при commit, откат транзакции его отменяет
+            for item in (part for whole in events for part in _chunks(whole)):
+                session.execute(select(func.pg_notify(FEED_CHANNEL, to_json(item).decode())))
+        else:
+            session.info.setdefault(_EVENTS, []).extend(events)
+
+    def resync(self, engine, *tables: str):
+        """Запись мимо crud_router (импорт): подписчики перечитывают tables. На postgres — NOTIFY всем воркерам"""
+        if not CHANGE_FEED or not tables:
+            return
+        events = [{"resync": True, "table": table} for table in tables]
+        if self.backend == "postgres":
+            with engine.begin() as conn:
+                for item in events:
+                    conn.execute(select(func.pg_notify(FEED_CHANNEL, to_json(item).decode())))
+        else:
+            self.publish(events)
+
+    # --- Рассылка ---
+
+    def publish(self, events: list):
+        """События -> история и очереди подписчиков этого процесса (из любого потока)"""
+        with self._lock:
+            numbered = []
+            for item in events:
+                self._last_id += 1
+                numbered.append((self._last_id, item))
+            self._history.extend(numbered)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(numbered)
+
+    def subscribe(self, loop, last_event_id: Optional[str] = None) -> "Subscriber":
+        """Подписчик с очередью в цикле событий loop; события после last_event_id повторяются из истории"""
+        subscriber = Subscriber(loop)
+        with self._lock:
+            if last_event_id is not None:
+                epoch, _, number = last_event_id.partition(":")
+                after = int(number) if epoch == self._epoch and number.isdigit() else None
+                if after is None or after > self._last_id or (
+                        after < self._last_id and (not self._history or self._history[0][0] > after + 1)):
+                    subscriber.lost = True
+                else:
+                    subscriber.queue.extend(item for item in self._history if item[0] > after)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def event_id(self, number: int) -> str:
+        return f"{self._epoch}:{number}"
+
+    def unsubscribe(self, subscriber: "Subscriber"):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    # --- PostgreSQL LISTEN ---
+
+    def start(self, engine):
+        """Для FEED_BACKEND=postgres — поток, слушающий канал"""
+        self.engine = engine
+        if self.backend != "postgres" or self._listener is not None:
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen, name="change-feed-listener", daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        if self._listener is not None:
+            self._stop.set()
+            self._listener.join()
+            self._listener = None
+
+    def _listen(self):
+        first = True
+        while not self._stop.is_set():
+            try:
+                # Отдельное соединение вне пула: оно занято LISTEN все время работы процесса
+                raw = self.engine.raw_connection()
+                raw.detach()
+                connection = raw.driver_connection
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {FEED_CHANNEL}")
+                if not first:
+                    # Пока соединения не было, события могли пройти мимо
+                    self.publish([{"resync": True, "table": None}])
+                first = False
+                while not self._stop.is_set():
+                    if selectors.select([connection], [], [], 1.0)[0]:
+                        connection.poll()
+                        events = []
+                        while connection.notifies:
+                            events.append(json.loads(connection.notifies.pop(0).payload))
+                        if events:
+                            self.publish(events)
+                connection.close()
+            except Exception:
+                feed_log.exception("change feed listener failed, reconnecting")
+                first = False
+                sleep(1.0)
+
+    # --- Поток SSE ---
+
+    async def stream(self, tables: Optional[set], doctor_id: Optional[int], department_id: Optional[int],
+                     last_event_id: Optional[str] = None):
+        """Тело ответа text/event-stream для одного клиента"""
+        subscriber = self.subscribe(asyncio.get_running_loop(), last_event_id)
+        try:
+            yield f"retry: {FEED_RETRY_MS}\n\n"
+            while True:
+                if subscriber.lost:
+                    subscriber.lost = False
+                    subscriber.queue.clear()
+                    yield f"id: {self.event_id(self._last_id)}\nevent: resync\ndata: {{\"table\": null}}\n\n"
+                    continue
+                if not subscriber.queue:
+                    subscriber.ready.clear()
+                    try:
+                        await asyncio.wait_for(subscriber.ready.wait(), FEED_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ": ping\n\n"
+                    continue
+                number, item = subscriber.queue.popleft()
+                message = _visible(item, tables, doctor_id, department_id)
+                if message is not None:
+                    kind = "resync" if item.get("resync") else "change"
+                    yield f"id: {self.event_id(number)}\nevent: {kind}\ndata: {to_json(message).decode()}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+class Subscriber:
+    """Очередь событий одного клиента; наполняется из потоков записи через loop.call_soon_threadsafe"""
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.lost = False
+
+    def offer(self, numbered: list):
+        try:
+            self.loop.call_soon_threadsafe(self._put, numbered)
+        except RuntimeError:
+            pass  # цикл событий уже закрыт — подписчик уйдет при отключении
+
+    def _put(self, numbered: list):
+        if len(self.queue) + len(numbered) > FEED_QUEUE_SIZE:
+            self.lost = True
+        else:
+            self.queue.extend(numbered)
+        self.ready.set()
+
+
+def _visible(item: dict, tables: Optional[set], doctor_id: Optional[int], department_id: Optional[int]):
+    """Событие в том виде, в каком его видит подписчик с фильтрами, или None"""
+    if tables is not None and item.get("table") is not None and item["table"] not in tables:
+        return None
+    if item.get("resync"):
+        return {"table": item.get("table")}
+    if doctor_id is None and department_id is None:
+        indices = range(len(item["ids"]))
+    elif item.get("scope") is None:
+        return None
+    else:
+        indices = [index for index, (doctors, departments) in enumerate(item["scope"])
+                   if (doctor_id is None or doctor_id in doctors) and (department_id is None or department_id in departments)]
+        if not indices:
+            return None
+    message = {"table": item["table"], "op": item["op"], "ids": [item["ids"][index] for index in indices]}
+    if "rows" in item:
+        message["rows"] = [item["rows"][index] for index in indices]
+    return message
+
+
+change_feed = ChangeFeed()
+
+
+# События из session.info публикуются после commit (FEED_BACKEND=memory); откат их отбрасывает.
+# Слушатели на классе Session: срабатывают и для сессий AsyncSession (их синхронной части)
+@event.listens_for(OrmSession, "after_commit")
+def _publish_committed(session):
+    events = session.info.pop(_EVENTS, None)
+    if events:
+        change_feed.publish(events)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_EVENTS, None)
+    session.info.pop(_OLD_SCOPE, None)
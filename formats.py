@@ -0,0 +1,109 @@
+from datetime import date, time
+from decimal import Decimal
+
+from pydantic_core import to_json
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, Time
+
+# ===================================================================================
+# --- ФОРМАТЫ ОТВЕТОВ СО СПИСКАМИ ---
+# ===================================================================================
+# Строки списков читаются из БД кортежами колонок (без объектов ORM) и кодируются сразу в байты:
+# повторная валидация через response_model для строк из своей же БД не нужна.
+# Формат выбирается по заголовку Accept, по умолчанию — обычный JSON (массив объектов):
+#   application/json                              [{"id": 1, ...}, ...]
+#   application/vnd.polyclinic.columnar+json      {"id": [1, 2, ...], "last_name": [...], ...}
+#   application/msgpack                           то же поколоночно в MessagePack (нужен пакет msgpack)
+#   application/vnd.apache.arrow.stream           Arrow IPC stream, одна пачка (нужен пакет pyarrow)
+# Даты, время и Decimal в JSON и MessagePack — строки, как и в обычных ответах API.
+# Если библиотеки для запрошенного формата нет, Accept разбирается дальше, в итоге — JSON.
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.polyclinic.columnar+json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+# Псевдонимы из Accept -> формат
+_ALIASES = {JSON: JSON, COLUMNAR_JSON: COLUMNAR_JSON, MSGPACK: MSGPACK, "application/x-msgpack": MSGPACK, ARROW: ARROW}
+
+def _available(fmt: str) -> bool:
+    module = {MSGPACK: "msgpack", ARROW: "pyarrow"}.get(fmt)
+    if module is None:
+        return True
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+_AVAILABLE = {fmt: _available(fmt) for fmt in set(_ALIASES.values())}
+
+def negotiate(accept: str) -> str:
+    """Формат ответа по заголовку Accept (с учетом q); неизвестные и недоступные типы пропускаются"""
+    if not accept or accept == JSON:
+        return JSON
+    choices = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *options = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for option in options:
+            if option.startswith("q="):
+                try:
+                    quality = float(option[2:])
+                except ValueError:
+                    quality = 0.0
+        fmt = _ALIASES.get(media_type.lower())
+        if fmt and quality > 0 and _AVAILABLE[fmt]:
+            choices.append((-quality, position, fmt))
+    return min(choices)[2] if choices else JSON
+
+def _plain(value):
+    # Для MessagePack: то же текстовое представление, что и в JSON
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _arrow_type(pa, column):
+    # Схема Arrow — из типов колонок таблицы, а не из данных: у всех страниц она одинакова
+    kind = column.type
+    if isinstance(kind, Boolean):
+        return pa.bool_()
+    if isinstance(kind, Integer):
+        return pa.int64()
+    if isinstance(kind, Float):
+        return pa.float64()
+    if isinstance(kind, Numeric):
+        return pa.decimal128(kind.precision or 38, kind.scale if kind.scale is not None else 10)
+    if isinstance(kind, DateTime):
+        return pa.timestamp("us")
+    if isinstance(kind, Date):
+        return pa.date32()
+    if isinstance(kind, Time):
+        return pa.time64("us")
+    return pa.string()
+
+def encode_rows(fmt: str, columns: list, rows: list) -> bytes:
+    """Кодирует строки (кортежи в порядке columns — колонок таблицы) в формат fmt"""
+    names = [column.name for column in columns]
+    if fmt == JSON:
+        return to_json([dict(zip(names, row)) for row in rows])
+    values = dict(zip(names, map(list, zip(*rows)))) if rows else {name: [] for name in names}
+    if fmt == COLUMNAR_JSON:
+        return to_json(values)
+    if fmt == MSGPACK:
+        import msgpack
+        return msgpack.packb(values, default=_plain, use_bin_type=True)
+    if fmt == ARROW:
+        import pyarrow as pa
+        schema = pa.schema([(column.name, _arrow_type(pa, column)) for column in columns])
+        table = pa.Table.from_pydict(values, schema=schema)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    raise ValueError(f"Unknown format {fmt}")
+
+# Описание альтернативных типов ответа для OpenAPI
+LIST_RESPONSES = {200: {"content": {COLUMNAR_JSON: {}, MSGPACK: {}, ARROW: {}},
+                        "description": "Список; формат выбирается заголовком Accept"}}
@@ -0,0 +1,297 @@
+import argparse
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from time import perf_counter
+
+from sqlalchemy import text, func
+from sqlmodel import SQLModel, Session, select
+
+from models import (
+    Departments, Specializations, Cabinets, Service_Catalog, Diagnoses, Appointment_Statuses, Doctors,
+    Insurance_Policies, Patients, Schedule, Appointments, Medical_Records, Prescriptions, Services_Rendered,
+    create_missing_indexes
+)
+from database import engine
+from importer import write_batch, supports_copy, DEFAULT_BATCH_SIZE
+from search import create_search_indexes
+import billing
+from versions import table_versions
+
+# ===================================================================================
+# --- ГЕНЕРАТОР СИНТЕТИЧЕСКИХ ДАННЫХ ---
+# ===================================================================================
+# Наполняет пустую БД данными «как в проде» для нагрузочных тестов (см. bench.py).
+# Масштаб 1.0 — 10 тыс. врачей, 1 млн пациентов, 10 млн записей на прием; остальное пропорционально:
+#   - врачи работают сменами 08-14 / 14-20 по 3 или 5 дней в неделю, двое врачей делят кабинет;
+#   - записи — 30-минутные слоты внутри расписания без пересечений, за 2 года назад и месяц вперед;
+#     к популярным врачам записей больше, часть пациентов ходит намного чаще остальных;
+#   - прошедший прием обычно завершен и имеет медкарту с 1-2 услугами и 0-3 назначениями.
+# id назначаются генератором, строки пишутся пачками через COPY (PostgreSQL) или executemany.
+#
+# Запуск:  python generate.py --scale 0.01 --seed 1 --reset
+
+SCALE_1 = {"doctors": 10_000, "patients": 1_000_000, "appointments": 10_000_000}
+HISTORY_DAYS = 730
+FUTURE_DAYS = 30
+SLOT_MINUTES = 30
+SHIFTS = [(time(8), time(14)), (time(14), time(20))]
+WEEKDAY_PATTERNS = [(1, 2, 3, 4, 5)] * 4 + [(1, 3, 5), (2, 4, 6)]
+
+SPECIALIZATIONS = ["Терапевт"] * 6 + ["Хирург", "Невролог", "Кардиолог", "Офтальмолог", "Оториноларинголог",
+                   "Эндокринолог", "Гастроэнтеролог", "Дерматолог", "Уролог", "Гинеколог", "Травматолог",
+                   "Педиатр", "Психиатр", "Ревматолог", "Пульмонолог", "Аллерголог"]
+STATUSES = ["Запланирован", "Завершен", "Отменен", "Неявка"]
+CATEGORIES = ["высшая", "первая", "вторая", None]
+LAST_NAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов", "Новиков",
+              "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов", "Егоров", "Павлов", "Козлов",
+              "Степанов", "Николаев", "Орлов", "Андреев", "Макаров", "Никитин", "Захаров", "Зайцев", "Соловьев",
+              "Борисов", "Яковлев", "Григорьев", "Романов", "Воробьев", "Сергеев", "Кузьмин", "Фролов"]
+MALE_NAMES = ["Александр", "Дмитрий", "Максим", "Сергей", "Андрей", "Алексей", "Иван", "Михаил", "Никита", "Егор"]
+FEMALE_NAMES = ["Анна", "Мария", "Елена", "Ольга", "Наталья", "Татьяна", "Ирина", "Екатерина", "Светлана", "Юлия"]
+MALE_PATRONYMICS = ["Александрович", "Дмитриевич", "Сергеевич", "Андреевич", "Иванович", "Михайлович"]
+FEMALE_PATRONYMICS = ["Александровна", "Дмитриевна", "Сергеевна", "Андреевна", "Ивановна", "Михайловна"]
+STREETS = ["Ленина", "Мира", "Советская", "Садовая", "Лесная", "Школьная", "Набережная", "Молодежная"]
+COMPANIES = ["СОГАЗ-Мед", "Ингосстрах-М", "Капитал МС", "РЕСО-Мед", "АльфаСтрахование-ОМС"]
+DRUGS = [("Парацетамол", "500 мг 3 раза в день"), ("Ибупрофен", "200 мг 2 раза в день"),
+         ("Амоксициллин", "500 мг 3 раза в день"), ("Омепразол", "20 мг утром"), ("Лоратадин", "10 мг 1 раз в день"),
+         ("Эналаприл", "10 мг 2 раза в день"), ("Метформин", "850 мг 2 раза в день"), ("Аторвастатин", "20 мг вечером")]
+DIAGNOSIS_WORDS = ["острый", "хронический", "вирусный", "бактериальный", "неуточненный", "инфекция", "бронхит",
+                   "гастрит", "гипертензия", "диабет", "артрит", "дерматит", "синусит", "мигрень", "остеохондроз",
+                   "тонзиллит", "пиелонефрит", "аллергия", "анемия", "астма", "ринит", "отит", "конъюнктивит"]
+SERVICE_KINDS = [("Прием", 30, 1500), ("Повторный прием", 20, 1000), ("Консультация", 30, 2000),
+                 ("Процедура", 15, 800), ("Анализ", 10, 500)]
+
+# Родители раньше детей: при сбросе буферов внешние ключи всегда указывают на уже записанные строки
+LOAD_ORDER = [Departments, Specializations, Appointment_Statuses, Diagnoses, Service_Catalog, Cabinets, Doctors,
+              Schedule, Insurance_Policies, Patients, Appointments, Medical_Records, Prescriptions, Services_Rendered]
+
+
+class Loader:
+    """Буферы строк по таблицам; при заполнении любого сбрасываются все, в порядке LOAD_ORDER"""
+    def __init__(self, engine, batch_size: int, use_copy: bool, log=print):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.log = log
+        self.buffers = {model: [] for model in LOAD_ORDER}
+        self.counts = {model: 0 for model in LOAD_ORDER}
+        self.started = perf_counter()
+
+    def add(self, model, row: dict):
+        buffer = self.buffers[model]
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.engine.begin() as conn:
+            use_copy = self.use_copy and supports_copy(conn)
+            for model in LOAD_ORDER:
+                rows = self.buffers[model]
+                if rows:
+                    write_batch(conn, model, rows, use_copy)
+                    self.counts[model] += len(rows)
+                    self.buffers[model] = []
+        total = sum(self.counts.values())
+        self.log(f"записано {total} строк, {total / (perf_counter() - self.started):.0f} строк/с")
+
+
+class Generator:
+    def __init__(self, scale: float, seed: int, today: date = None):
+        self.random = random.Random(seed)
+        self.today = today or date.today()
+        self.doctors = max(2, round(SCALE_1["doctors"] * scale))
+        self.patients = max(10, round(SCALE_1["patients"] * scale))
+        self.appointments = max(10, round(SCALE_1["appointments"] * scale))
+        self.departments = max(3, self.doctors // 500)
+
+    def person(self):
+        female = self.random.random() < 0.55
+        last_name = self.random.choice(LAST_NAMES) + ("а" if female else "")
+        first_name = self.random.choice(FEMALE_NAMES if female else MALE_NAMES)
+        middle_name = self.random.choice(FEMALE_PATRONYMICS if female else MALE_PATRONYMICS)
+        return last_name, first_name, middle_name
+
+    def references(self, loader: Loader):
+        for i in range(1, self.departments + 1):
+            loader.add(Departments, {"id": i, "name": f"Отделение {i}"})
+        for i, name in enumerate(dict.fromkeys(SPECIALIZATIONS), 1):
+            loader.add(Specializations, {"id": i, "name": name})
+        for i, name in enumerate(STATUSES, 1):
+            loader.add(Appointment_Statuses, {"id": i, "name": name})
+        # Коды вида J10.1: буква, две цифры и уточнение
+        self.diagnoses = 0
+        for letter in "ABCDEFGHIJKLMNOPQRST":
+            for number in range(0, 100, 3):
+                for sub in range(self.random.randint(1, 4)):
+                    self.diagnoses += 1
+                    words = self.random.sample(DIAGNOSIS_WORDS, 3)
+                    loader.add(Diagnoses, {"id": self.diagnoses, "mkb_code": f"{letter}{number:02d}.{sub}",
+                                           "description": " ".join(words).capitalize()})
+        self.services = []  # (id, длительность)
+        for spec in dict.fromkeys(SPECIALIZATIONS):
+            for kind, minutes, price in SERVICE_KINDS:
+                service_id = len(self.services) + 1
+                self.services.append((service_id, minutes))
+                loader.add(Service_Catalog, {"id": service_id, "name": f"{kind} ({spec.lower()})", "duration_minutes": minutes,
+                                             "price": Decimal(price + self.random.randrange(0, 500, 50))})
+        self.short_services = [s for s in self.services if s[1] <= SLOT_MINUTES // 2]
+
+    def doctors_and_schedule(self, loader: Loader):
+        specializations = list(dict.fromkeys(SPECIALIZATIONS))
+        self.schedule = {}  # врач -> (смена, дни недели)
+        schedule_id = 0
+        for doctor_id in range(1, self.doctors + 1):
+            cabinet_id = (doctor_id + 1) // 2
+            department_id = (cabinet_id - 1) % self.departments + 1
+            if doctor_id % 2:
+                loader.add(Cabinets, {"id": cabinet_id, "number": f"{100 + cabinet_id}",
+                                      "floor": 1 + cabinet_id % 5, "department_id": department_id})
+            last_name, first_name, middle_name = self.person()
+            loader.add(Doctors, {"id": doctor_id, "last_name": last_name, "first_name": first_name,
+                                 "middle_name": middle_name, "department_id": department_id,
+                                 "specialization_id": specializations.index(self.random.choice(SPECIALIZATIONS)) + 1,
+                                 "category": self.random.choice(CATEGORIES)})
+            # Соседи по кабинету работают в разные смены
+            shift = SHIFTS[doctor_id % 2]
+            weekdays = self.random.choice(WEEKDAY_PATTERNS)
+            self.schedule[doctor_id] = (shift, weekdays)
+            for day_of_week in weekdays:
+                schedule_id += 1
+                loader.add(Schedule, {"id": schedule_id, "doctor_id": doctor_id, "cabinet_id": cabinet_id,
+                                      "day_of_week": day_of_week, "start_time": shift[0], "end_time": shift[1]})
+
+    def patients_and_policies(self, loader: Loader):
+        for patient_id in range(1, self.patients + 1):
+            last_name, first_name, middle_name = self.person()
+            loader.add(Insurance_Policies, {"id": patient_id, "policy_number": f"{7700000000000000 + patient_id:016d}",
+                                            "company_name": self.random.choice(COMPANIES),
+                                            "expiration_date": self.today + timedelta(days=self.random.randint(30, 3650))})
+            loader.add(Patients, {"id": patient_id, "last_name": last_name, "first_name": first_name,
+                                  "middle_name": middle_name,
+                                  "birth_date": date(1940, 1, 1) + timedelta(days=self.random.randint(0, 29000)),
+                                  "phone": f"+7 9{self.random.randint(0, 99):02d} {self.random.randint(0, 9999999):07d}",
+                                  "address": f"ул. {self.random.choice(STREETS)}, д. {self.random.randint(1, 150)}",
+                                  "policy_id": patient_id})
+
+    def visits(self, loader: Loader):
+        """Записи, медкарты, назначения и услуги — врач за врачом, чтобы не держать их в памяти"""
+        first_day = self.today - timedelta(days=HISTORY_DAYS)
+        days = [first_day + timedelta(days=i) for i in range(HISTORY_DAYS + FUTURE_DAYS)]
+        now = datetime.combine(self.today, time(12))
+        ids = {model: 0 for model in (Appointments, Medical_Records, Prescriptions, Services_Rendered)}
+        def next_id(model):
+            ids[model] += 1
+            return ids[model]
+
+        remaining = self.appointments
+        for doctor_id in range(1, self.doctors + 1):
+            (shift_start, shift_end), weekdays = self.schedule[doctor_id]
+            work_days = [day for day in days if day.isoweekday() in weekdays]
+            slots_per_day = (shift_end.hour - shift_start.hour) * 60 // SLOT_MINUTES
+            # Популярность врача: от половины до полутора средних
+            share = remaining / (self.doctors - doctor_id + 1) * self.random.uniform(0.5, 1.5)
+            count = min(remaining, round(share), len(work_days) * slots_per_day)
+            if doctor_id == self.doctors:
+                count = min(remaining, len(work_days) * slots_per_day)
+            remaining -= count
+            for slot in sorted(self.random.sample(range(len(work_days) * slots_per_day), count)):
+                day, index = divmod(slot, slots_per_day)
+                start = datetime.combine(work_days[day], shift_start) + timedelta(minutes=index * SLOT_MINUTES)
+                if start >= now:
+                    status = 1
+                else:
+                    status = self.random.choices((2, 3, 4), weights=(85, 10, 5))[0]
+                appointment_id = next_id(Appointments)
+                # Квадрат равномерного распределения: пациенты с малыми id ходят заметно чаще
+                loader.add(Appointments, {"id": appointment_id, "doctor_id": doctor_id, "datetime": start,
+                                          "patient_id": int(self.patients * self.random.random() ** 2) + 1,
+                                          "status_id": status})
+                if status != 2:
+                    continue
+                record_id = next_id(Medical_Records)
+                loader.add(Medical_Records, {
+                    "id": record_id, "appointment_id": appointment_id,
+                    "diagnosis_id": int(self.diagnoses * self.random.random() ** 3) + 1,
+                    "complaints": "Жалобы на самочувствие", "anamnesis": None, "recommendations": "Контроль через месяц",
+                })
+                # Услуги укладываются в слот: одна любая до 30 минут или две коротких
+                services = ([self.random.choice(self.services)] if self.random.random() < 0.8
+                            else self.random.sample(self.short_services, 2))
+                for service_id, _ in services:
+                    loader.add(Services_Rendered, {"id": next_id(Services_Rendered), "record_id": record_id,
+                                                   "service_id": service_id, "quantity": 1})
+                for _ in range(self.random.choices((0, 1, 2, 3), weights=(40, 30, 20, 10))[0]):
+                    drug, dosage = self.random.choice(DRUGS)
+                    loader.add(Prescriptions, {"id": next_id(Prescriptions), "record_id": record_id, "drug_name": drug,
+                                               "dosage": dosage, "duration_days": self.random.choice((5, 7, 10, 14, 30))})
+
+    def run(self, loader: Loader):
+        self.references(loader)
+        self.doctors_and_schedule(loader)
+        self.patients_and_policies(loader)
+        self.visits(loader)
+        loader.flush()
+
+
+def _finish(engine, log=print):
+    """Последовательности id, поисковые индексы, сводки взаиморасчетов и статистика планировщика"""
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            for model in LOAD_ORDER:
+                table = model.__tablename__
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                  f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)"))
+    log("строим поисковые индексы")
+    create_search_indexes(engine)
+    log("собираем сводки взаиморасчетов")
+    with Session(engine) as session:
+        billing.rebuild(session)
+        session.commit()
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    # Данные записаны мимо API: прежние ETag ответов больше не действительны
+    for table in SQLModel.metadata.tables:
+        table_versions.bump(table)
+
+def reset(engine):
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("DROP TABLE IF EXISTS patient_search"))
+    SQLModel.metadata.drop_all(engine)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация синтетических данных поликлиники для нагрузочных тестов")
+    parser.add_argument("--scale", type=float, default=0.01,
+                        help="1.0 — 10 тыс. врачей, 1 млн пациентов, 10 млн записей (по умолчанию 0.01)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true", help="Удалить все таблицы перед генерацией")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--no-copy", action="store_true", help="Не использовать COPY даже на PostgreSQL")
+    args = parser.parse_args(argv)
+
+    if args.reset:
+        reset(engine)
+    SQLModel.metadata.create_all(engine)
+    create_missing_indexes(engine)
+    with Session(engine) as session:
+        if session.exec(select(func.count(Doctors.id))).one():
+            print("БД не пуста: запустите с --reset")
+            return 1
+
+    generator = Generator(args.scale, args.seed)
+    print(f"Масштаб {args.scale}: врачей {generator.doctors}, пациентов {generator.patients}, "
+          f"записей {generator.appointments}")
+    started = perf_counter()
+    loader = Loader(engine, args.batch_size, use_copy=not args.no_copy)
+    generator.run(loader)
+    _finish(engine)
+    for model, count in loader.counts.items():
+        print(f"  {model.__tablename__}: {count}")
+    print(f"Готово за {perf_counter() - started:.1f} с")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import islice
+from time import perf_counter
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select, func
+from sqlmodel import SQLModel
+
+from models import (
+    Departments, Specializations, Diagnoses, Appointment_Statuses, Doctors, Insurance_Policies,
+    Patients, Appointments, Medical_Records, SERVER_FIELDS, utc_now
+)
+from database import engine
+from versions import table_versions
+from cache import cache
+from crud import write_listeners
+from feed import change_feed
+
+# ===================================================================================
+# --- ПОТОКОВЫЙ ИМПОРТ ДАННЫХ (CSV / NDJSON) ---
+# ===================================================================================
+# Файл читается построчно и пишется пачками по batch_size строк, каждая пачка — своя транзакция,
+# поэтому память не зависит от размера файла. Внешние ключи задаются естественными ключами:
+#   diagnoses:    mkb_code, description (справочник МКБ; коды, которые уже есть, отбраковываются)
+#   policies:     policy_number, company_name, expiration_date (номера, которые уже есть, отбраковываются)
+#   patients:     last_name, first_name, middle_name, birth_date, phone, address, policy_number
+#   doctors:      last_name, first_name, middle_name, specialization, department, category
+#   appointments: patient_policy_number, doctor_last_name, doctor_first_name, doctor_middle_name,
+#                 datetime, status, [mkb_code, complaints, anamnesis, recommendations -> медкарта]
+# На PostgreSQL (psycopg2 / psycopg) строки грузятся через COPY, на остальных БД — executemany.
+# После импорта — то же, что после записи через API: версии таблиц (ETag), кэш ответов, слушатели записей
+# (индексы слотов и диагнозов) и resync ленты изменений. Процессы API видят импорт через общие версии и кэш
+# (CACHE_BACKEND=redis) и ленту (FEED_BACKEND=postgres); без них кэши воркеров устаревают до своего TTL.
+#
+# Запуск:  python importer.py patients patients.csv --batch-size 10000
+
+DEFAULT_BATCH_SIZE = 10000
+LOOKUP_CHUNK = 1000  # размер IN-списка при поиске ключей (лимит параметров SQLite)
+RECORD_FIELDS = ("mkb_code", "complaints", "anamnesis", "recommendations")
+
+
+# --- Чтение файлов ---
+
+def read_rows(path: str, fmt: str = None):
+    """Построчно отдает записи файла в виде dict. Пустые строки CSV становятся None"""
+    fmt = fmt or ("csv" if path.endswith(".csv") else "ndjson")
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                yield {k: (v.strip() or None) if isinstance(v, str) else v for k, v in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def batched(rows, size: int):
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# --- Разрешение естественных ключей ---
+
+def _doctor_key(last_name, first_name, middle_name):
+    return f"{last_name} {first_name} {middle_name or ''}"
+
+_doctor_key_column = Doctors.last_name + " " + Doctors.first_name + " " + func.coalesce(Doctors.middle_name, "")
+
+def lookup(conn, key_column, id_column, keys, *joins) -> dict:
+    """Словарь ключ -> id только для ключей текущей пачки"""
+    keys = list({k for k in keys if k is not None})
+    found = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        statement = select(key_column, id_column)
+        for target, on in joins:
+            statement = statement.join(target, on)
+        statement = statement.where(key_column.in_(keys[start:start + LOOKUP_CHUNK]))
+        found.update(conn.execute(statement).all())
+    return found
+
+def _resolve(row: dict, field: str, key, mapping: dict, errors: list):
+    """Подставляет id по ключу; отсутствующий в справочнике ключ отбраковывает строку"""
+    if key is None:
+        row[field] = None
+    elif key in mapping:
+        row[field] = mapping[key]
+    else:
+        errors.append(f"{field}: не найден ключ {key!r}")
+
+def _reject_existing(conn, rows, field: str, key_column, id_column) -> list:
+    """Отбраковывает строки, чей уникальный ключ field уже есть в БД (в том числе из прошлых пачек) или выше в пачке"""
+    existing = lookup(conn, key_column, id_column, (r.get(field) for r in rows))
+    result, seen = [], set()
+    for row in rows:
+        key = row.get(field)
+        errors = [f"{field}: ключ {key!r} уже есть"] if key is not None and (key in existing or key in seen) else []
+        seen.add(key)
+        result.append((row, errors))
+    return result
+
+def prepare_diagnoses(conn, rows):
+    # Повторная загрузка каталога не должна плодить дубли кодов
+    return _reject_existing(conn, rows, "mkb_code", Diagnoses.mkb_code, Diagnoses.id)
+
+def prepare_policies(conn, rows):
+    # Номер полиса уникален (индекс в models.py): дубль отбраковывается, а не обрывает импорт
+    return _reject_existing(conn, rows, "policy_number", Insurance_Policies.policy_number, Insurance_Policies.id)
+
+def prepare_patients(conn, rows):
+    policies = lookup(conn, Insurance_Policies.policy_number, Insurance_Policies.id, (r.get("policy_number") for r in rows))
+    result = []
+    for row in rows:
+        errors = []
+        _resolve(row, "policy_id", row.pop("policy_number", None), policies, errors)
+        result.append((row, errors))
+    return result
+
+def prepare_doctors(conn, rows):
+    specs = lookup(conn, Specializations.name, Specializations.id, (r.get("specialization") for r in rows))
+    depts = lookup(conn, Departments.name, Departments.id, (r.get("department") for r in rows))
+    result = []
+    for row in rows:
+        errors = []
+        _resolve(row, "specialization_id", row.pop("specialization", None), specs, errors)
+        _resolve(row, "department_id", row.pop("department", None), depts, errors)
+        result.append((row, errors))
+    return result
+
+def prepare_appointments(conn, rows):
+    patients = lookup(conn, Insurance_Policies.policy_number, Patients.id,
+                      (r.get("patient_policy_number") for r in rows),
+                      (Patients, Patients.policy_id == Insurance_Policies.id))
+    doctors = lookup(conn, _doctor_key_column, Doctors.id,
+                     (_doctor_key(r.get("doctor_last_name"), r.get("doctor_first_name"), r.get("doctor_middle_name"))
+                      for r in rows if r.get("doctor_last_name")))
+    statuses = lookup(conn, Appointment_Statuses.name, Appointment_Statuses.id, (r.get("status") for r in rows))
+    diagnoses = lookup(conn, Diagnoses.mkb_code, Diagnoses.id, (r.get("mkb_code") for r in rows))
+    result = []
+    for row in rows:
+        errors = []
+        _resolve(row, "patient_id", row.pop("patient_policy_number", None), patients, errors)
+        doctor = (row.pop("doctor_last_name", None), row.pop("doctor_first_name", None), row.pop("doctor_middle_name", None))
+        _resolve(row, "doctor_id", _doctor_key(*doctor) if doctor[0] else None, doctors, errors)
+        _resolve(row, "status_id", row.pop("status", None), statuses, errors)
+        # Поля медкарты уходят в отдельную таблицу после вставки записи на прием
+        record = {field: row.pop(field, None) for field in RECORD_FIELDS}
+        if any(record.values()):
+            _resolve(record, "diagnosis_id", record.pop("mkb_code"), diagnoses, errors)
+            row["_record"] = record
+        result.append((row, errors))
+    return result
+
+IMPORTERS = {
+    "diagnoses": (Diagnoses, prepare_diagnoses),
+    "policies": (Insurance_Policies, prepare_policies),
+    "patients": (Patients, prepare_patients),
+    "doctors": (Doctors, prepare_doctors),
+    "appointments": (Appointments, prepare_appointments),
+}
+
+
+# --- Запись пачек ---
+
+def _copy_rows(conn, table, columns, rows):
+    """COPY FROM STDIN для драйверов psycopg2 и psycopg (3)"""
+    quote = conn.dialect.identifier_preparer.quote
+    sql = f"COPY {quote(table.name)} ({', '.join(quote(c) for c in columns)}) FROM STDIN"
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if conn.dialect.driver == "psycopg2":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(["\\N" if row[c] is None else row[c] for c in columns])
+            buffer.seek(0)
+            cursor.copy_expert(sql + " WITH (FORMAT csv, NULL '\\N')", buffer)
+        else:
+            with cursor.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row([row[c] for c in columns])
+    finally:
+        cursor.close()
+
+def supports_copy(conn) -> bool:
+    return conn.dialect.name == "postgresql" and conn.dialect.driver in ("psycopg2", "psycopg")
+
+def write_batch(conn, model, rows, use_copy: bool):
+    """Вставляет пачку; записи с данными медкарты вставляются с RETURNING, чтобы получить их id"""
+    table = model.__table__
+    plain = [row for row in rows if "_record" not in row]
+    with_records = [row for row in rows if "_record" in row]
+    if plain:
+        if use_copy:
+            # COPY минует значения по умолчанию SQLAlchemy: время изменения (см. models.py) ставим сами,
+            # иначе загруженные строки не попадут в ?updated_since=
+            stamp = utc_now()
+            plain = [{**row, "created_at": stamp, "updated_at": stamp} for row in plain]
+            _copy_rows(conn, table, list(plain[0]), plain)
+        else:
+            conn.execute(insert(table), plain)
+    if with_records:
+        records = [row.pop("_record") for row in with_records]
+        ids = conn.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), with_records).scalars().all()
+        for record, appointment_id in zip(records, ids):
+            record["appointment_id"] = appointment_id
+        conn.execute(insert(Medical_Records.__table__), records)
+
+def import_rows(kind: str, rows, engine=engine, batch_size: int = DEFAULT_BATCH_SIZE, use_copy: bool = True, log=print):
+    """Импортирует поток записей вида kind. Возвращает (загружено, отбраковано, секунд)"""
+    model, prepare = IMPORTERS[kind]
+    loaded = rejected = 0
+    started = perf_counter()
+    try:
+        for batch in batched(rows, batch_size):
+            with engine.begin() as conn:
+                good = []
+                for row, errors in prepare(conn, batch):
+                    record = row.pop("_record", None)
+                    try:
+                        # Приводим типы (даты, числа) по модели; id, время изменения и версию назначает БД
+                        clean = model.model_validate(row).model_dump(exclude={"id"} | SERVER_FIELDS)
+                    except ValidationError as e:
+                        errors.append(str(e))
+                    if errors:
+                        rejected += 1
+                        if rejected <= 20:
+                            log(f"Строка отбракована: {'; '.join(errors)}")
+                        continue
+                    if record is not None:
+                        clean["_record"] = record
+                    good.append(clean)
+                if good:
+                    write_batch(conn, model, good, use_copy and supports_copy(conn))
+            # Только после commit пачки
+            loaded += len(good)
+            elapsed = perf_counter() - started
+            log(f"{kind}: загружено {loaded}, отбраковано {rejected}, {loaded / elapsed:.0f} строк/с")
+    finally:
+        # Уже зафиксированные пачки остаются в БД и при ошибке в следующей — о них тоже нужно сообщить
+        if loaded:
+            # Импорт идет мимо crud_router: версии, кэш и слушатели — сами. ids=None — какие строки загружены, неизвестно
+            tables = [model.__tablename__] + ([Medical_Records.__tablename__] if model is Appointments else [])
+            for table in tables:
+                table_versions.bump(table)
+                if cache is not None:
+                    cache.invalidate(table)
+                for listener in write_listeners:
+                    listener(table, "create", None)
+            change_feed.resync(engine, *tables)
+    return loaded, rejected, perf_counter() - started
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Потоковый импорт CSV/NDJSON в БД поликлиники")
+    parser.add_argument("kind", choices=sorted(IMPORTERS))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default=None)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--no-copy", action="store_true", help="Не использовать COPY даже на PostgreSQL")
+    args = parser.parse_args(argv)
+
+    SQLModel.metadata.create_all(engine)
+    loaded, rejected, elapsed = import_rows(args.kind, read_rows(args.path, args.format),
+                                            batch_size=args.batch_size, use_copy=not args.no_copy)
+    print(f"Готово: {loaded} строк за {elapsed:.1f} с ({loaded / max(elapsed, 1e-9):.0f} строк/с), отбраковано {rejected}")
+    return 0 if not rejected else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
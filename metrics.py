@@ -0,0 +1,225 @@
+import logging
+import os
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+from sqlalchemy import event
+
+# ===================================================================================
+# --- МЕТРИКИ ЗАПРОСОВ И SQL ---
+# ===================================================================================
+# MetricsMiddleware замеряет каждый HTTP-запрос, а слушатели движка SQLAlchemy — каждый SQL-запрос,
+# выполненный во время HTTP-запроса (счетчики лежат в contextvar: он доходит и до потоков пула
+# FastAPI для синхронных эндпоинтов, и до greenlet асинхронного движка).
+# По маршруту (шаблону пути, а не конкретному URL) копятся гистограммы задержки и числа SQL-запросов,
+# суммарное время в БД. GET /metrics отдает все в текстовом формате Prometheus.
+# Медленные SQL-запросы пишутся в лог "polyclinic.sql" — только текст с плейсхолдерами, значения параметров не попадают.
+# Настройки:
+#   METRICS_ENABLED=0   выключить сбор
+#   SLOW_QUERY_MS       порог медленного SQL-запроса, мс (0 — не логировать)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_MAX_CHARS = 2000
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_query_log = logging.getLogger("polyclinic.sql")
+
+
+class _RequestStats:
+    __slots__ = ("statements", "db_seconds")
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+
+_current: ContextVar = ContextVar("request_stats", default=None)
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+    def __init__(self, buckets: tuple):
+        self.counts = [0] * (len(buckets) + 1)  # последняя ячейка — +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, buckets: tuple, value: float):
+        self.counts[bisect_left(buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class _RouteStats:
+    __slots__ = ("statuses", "latency", "statements", "db_seconds")
+    def __init__(self):
+        self.statuses = {}  # код ответа -> число запросов
+        self.latency = _Histogram(LATENCY_BUCKETS)
+        self.statements = _Histogram(STATEMENT_BUCKETS)
+        self.db_seconds = 0.0
+
+
+class Metrics:
+    """Накопленные метрики процесса"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}  # (метод, маршрут) -> _RouteStats
+        self.slow_queries = 0
+        self.statements_outside_requests = 0
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: _RequestStats):
+        with self._lock:
+            entry = self.routes.get((method, route))
+            if entry is None:
+                entry = self.routes[(method, route)] = _RouteStats()
+            entry.statuses[status] = entry.statuses.get(status, 0) + 1
+            entry.latency.observe(LATENCY_BUCKETS, seconds)
+            entry.statements.observe(STATEMENT_BUCKETS, stats.statements)
+            entry.db_seconds += stats.db_seconds
+
+    def record_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def record_untracked_statement(self):
+        with self._lock:
+            self.statements_outside_requests += 1
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            routes = {key: (dict(s.statuses), _copy(s.latency), _copy(s.statements), s.db_seconds)
+                      for key, s in self.routes.items()}
+            return routes, self.slow_queries, self.statements_outside_requests
+
+def _copy(histogram: _Histogram) -> _Histogram:
+    clone = _Histogram(())
+    clone.counts, clone.total, clone.count = list(histogram.counts), histogram.total, histogram.count
+    return clone
+
+metrics = Metrics()
+
+
+# --- HTTP ---
+
+class MetricsMiddleware:
+    """ASGI-middleware: время запроса до отправки последнего байта ответа (включая потоковый экспорт)"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        stats = _RequestStats()
+        token = _current.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            # Маршрут FastAPI кладет в scope при сопоставлении; несопоставленные URL сводим в один ряд,
+            # иначе случайные пути раздували бы число рядов метрик
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "<unmatched>"
+            metrics.record_request(scope["method"], path, status, perf_counter() - started, stats)
+
+
+# --- SQL ---
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(perf_counter())
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+    else:
+        metrics.record_untracked_statement()
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.record_slow_query()
+        rows = len(parameters) if executemany else 1
+        slow_query_log.warning("slow query %.1f ms (%d param set%s redacted): %s", elapsed * 1000, rows,
+                               "" if rows == 1 else "s", " ".join(statement.split())[:SLOW_QUERY_MAX_CHARS])
+
+def _on_error(context):
+    # after_cursor_execute не вызывается для упавшего запроса — убираем его отметку времени
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+def instrument_engine(engine):
+    """Подключает счетчики SQL к синхронному движку (для асинхронного — к его sync_engine)"""
+    if not METRICS_ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+    event.listen(engine, "handle_error", _on_error)
+
+
+# --- Экспозиция ---
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _histogram_lines(name: str, labels: str, buckets: tuple, histogram: _Histogram) -> list:
+    lines, cumulative = [], 0
+    for bound, count in zip(buckets + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+def render_metrics(pools: dict = None) -> str:
+    """Текстовый формат Prometheus (version 0.0.4). pools: имя движка -> pool_status()"""
+    routes, slow_queries, untracked = metrics.snapshot()
+    lines = [
+        "# HELP http_requests_total HTTP requests by route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    ordered = sorted(routes.items())
+    for (method, route), (statuses, *_rest) in ordered:
+        for status, count in sorted(statuses.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{_label(route)}",status="{status}"}} {count}')
+    lines += ["# HELP http_request_duration_seconds Request latency until the last response byte.",
+              "# TYPE http_request_duration_seconds histogram"]
+    for (method, route), (_, latency, _, _) in ordered:
+        lines += _histogram_lines("http_request_duration_seconds", f'method="{method}",route="{_label(route)}"',
+                                  LATENCY_BUCKETS, latency)
+    lines += ["# HELP http_request_sql_statements SQL statements issued per request.",
+              "# TYPE http_request_sql_statements histogram"]
+    for (method, route), (_, _, statements, _) in ordered:
+        lines += _histogram_lines("http_request_sql_statements", f'method="{method}",route="{_label(route)}"',
+                                  STATEMENT_BUCKETS, statements)
+    lines += ["# HELP http_request_db_seconds_total Time spent executing SQL per route.",
+              "# TYPE http_request_db_seconds_total counter"]
+    for (method, route), (_, _, _, db_seconds) in ordered:
+        lines.append(f'http_request_db_seconds_total{{method="{method}",route="{_label(route)}"}} {db_seconds:.6f}')
+    lines += [
+        "# HELP sql_slow_queries_total SQL statements slower than SLOW_QUERY_MS.",
+        "# TYPE sql_slow_queries_total counter",
+        f"sql_slow_queries_total {slow_queries}",
+        "# HELP sql_statements_outside_requests_total SQL statements outside HTTP requests (startup, listeners).",
+        "# TYPE sql_statements_outside_requests_total counter",
+        f"sql_statements_outside_requests_total {untracked}",
+    ]
+    gauges = {"checked_out": "gauge", "idle": "gauge", "overflow": "gauge",
+              "checkouts": "counter", "timeouts": "counter", "wait_seconds_total": "counter"}
+    for field, kind in gauges.items():
+        name = f"db_pool_{field}" if kind == "gauge" or field.endswith("_total") else f"db_pool_{field}_total"
+        values = [(engine_name, status[field]) for engine_name, status in (pools or {}).items() if field in status]
+        if values:
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f'{name}{{engine="{engine_name}"}} {value}' for engine_name, value in values]
+    return "\n".join(lines) + "\n"
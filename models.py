@@ -1,7 +1,37 @@
+import logging
 from typing import Optional, List
-from datetime import date, time, datetime
+from datetime import date, time, datetime, timezone
 from decimal import Decimal
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, PrimaryKeyConstraint, inspect, literal_column
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.exc import SQLAlchemyError
+
+schema_log = logging.getLogger("polyclinic.schema")
+
+# --- Время изменения и версия строк ---
+# created_at / updated_at есть у всех таблиц API и ставятся самой SQLAlchemy (default / onupdate) при любой
+# записи через ORM или Core. Время — UTC без часового пояса. NULL — строка не менялась с тех пор, как колонки
+# появились в БД (create_missing_columns). По updated_at и надгробиям удаленных строк работает ?updated_since= (см. sync.py)
+# version — номер версии строки: 1 при вставке (DEFAULT в БД), +1 в каждом UPDATE (SET version = version + 1).
+# PATCH / DELETE с ?version= меняют строку, только если ее версия не изменилась (см. crud.py)
+
+SERVER_FIELDS = {"created_at", "updated_at", "version"}  # ставит БД, из тела запроса не принимаются
+Timestamp = Optional[datetime]  # псевдоним: в Appointments имя datetime занято полем
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def created_at_field():
+    return Field(default=None, sa_column_kwargs={"default": utc_now})
+
+def updated_at_field():
+    return Field(default=None, index=True, sa_column_kwargs={"default": utc_now, "onupdate": utc_now})
+
+def version_field():
+    return Field(default=None, nullable=False,
+                 sa_column_kwargs={"server_default": "1", "onupdate": literal_column("version") + 1})
+
 
 # --- Справочники ---
 
@@ -9,6 +39,9 @@ class Departments(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     head_doctor_id: Optional[int] = None
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     doctors: List["Doctors"] = Relationship(back_populates="department")
     cabinets: List["Cabinets"] = Relationship(back_populates="department")
@@ -16,6 +49,9 @@ class Departments(SQLModel, table=True):
 class Specializations(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     doctors: List["Doctors"] = Relationship(back_populates="specialization")
 
@@ -24,15 +60,24 @@ class Service_Catalog(SQLModel, table=True):
     name: str
     price: Decimal = Field(default=0, decimal_places=2)
     duration_minutes: int
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
 
 class Diagnoses(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    mkb_code: str
+    mkb_code: str = Field(index=True)
     description: Optional[str] = None
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
 
 class Appointment_Statuses(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
 
 # --- Структура и Люди ---
 
@@ -40,7 +85,10 @@ class Cabinets(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     number: str
     floor: int
-    department_id: Optional[int] = Field(default=None, foreign_key="departments.id")
+    department_id: Optional[int] = Field(default=None, foreign_key="departments.id", index=True)
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     department: Optional[Departments] = Relationship(back_populates="cabinets")
 
@@ -49,9 +97,12 @@ class Doctors(SQLModel, table=True):
     last_name: str
     first_name: str
     middle_name: Optional[str] = None
-    specialization_id: Optional[int] = Field(default=None, foreign_key="specializations.id")
-    department_id: Optional[int] = Field(default=None, foreign_key="departments.id")
+    specialization_id: Optional[int] = Field(default=None, foreign_key="specializations.id", index=True)
+    department_id: Optional[int] = Field(default=None, foreign_key="departments.id", index=True)
     category: Optional[str] = None
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     specialization: Optional[Specializations] = Relationship(back_populates="doctors")
     department: Optional[Departments] = Relationship(back_populates="doctors")
@@ -59,9 +110,12 @@ class Doctors(SQLModel, table=True):
 
 class Insurance_Policies(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    policy_number: str
+    policy_number: str = Field(index=True, unique=True)
     company_name: str
     expiration_date: date
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     patient: Optional["Patients"] = Relationship(back_populates="policy")
 
@@ -73,7 +127,10 @@ class Patients(SQLModel, table=True):
     birth_date: date
     phone: Optional[str] = None
     address: Optional[str] = None
-    policy_id: Optional[int] = Field(default=None, foreign_key="insurance_policies.id")
+    policy_id: Optional[int] = Field(default=None, foreign_key="insurance_policies.id", index=True)
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     policy: Optional[Insurance_Policies] = Relationship(back_populates="patient")
     appointments: List["Appointments"] = Relationship(back_populates="patient")
@@ -82,49 +139,186 @@ class Patients(SQLModel, table=True):
 
 class Schedule(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    doctor_id: Optional[int] = Field(default=None, foreign_key="doctors.id")
-    cabinet_id: Optional[int] = Field(default=None, foreign_key="cabinets.id")
+    doctor_id: Optional[int] = Field(default=None, foreign_key="doctors.id", index=True)
+    cabinet_id: Optional[int] = Field(default=None, foreign_key="cabinets.id", index=True)
     day_of_week: int # 1 - Понедельник, 7 - Воскресенье
     start_time: time
     end_time: time
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     doctor: Optional[Doctors] = Relationship(back_populates="schedules")
 
 class Appointments(SQLModel, table=True):
+    # Составной индекс (врач, время) обслуживает и выборки по одному doctor_id.
+    # Индекс по datetime объявлен здесь: Field() у поля, совпадающего с именем типа, pydantic не принимает
+    __table_args__ = (
+        Index("ix_appointments_doctor_id_datetime", "doctor_id", "datetime"),
+        Index("ix_appointments_datetime", "datetime"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    patient_id: Optional[int] = Field(default=None, foreign_key="patients.id")
+    patient_id: Optional[int] = Field(default=None, foreign_key="patients.id", index=True)
     doctor_id: Optional[int] = Field(default=None, foreign_key="doctors.id")
     datetime: datetime
-    status_id: Optional[int] = Field(default=None, foreign_key="appointment_statuses.id")
+    status_id: Optional[int] = Field(default=None, foreign_key="appointment_statuses.id", index=True)
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     patient: Optional[Patients] = Relationship(back_populates="appointments")
+    doctor: Optional[Doctors] = Relationship()
     medical_record: Optional["Medical_Records"] = Relationship(back_populates="appointment")
 
 class Medical_Records(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    appointment_id: int = Field(foreign_key="appointments.id")
+    appointment_id: int = Field(foreign_key="appointments.id", index=True, unique=True)
     complaints: Optional[str] = None
     anamnesis: Optional[str] = None
-    diagnosis_id: Optional[int] = Field(default=None, foreign_key="diagnoses.id")
+    diagnosis_id: Optional[int] = Field(default=None, foreign_key="diagnoses.id", index=True)
     recommendations: Optional[str] = None
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     appointment: Optional[Appointments] = Relationship(back_populates="medical_record")
+    diagnosis: Optional[Diagnoses] = Relationship()
     prescriptions: List["Prescriptions"] = Relationship(back_populates="medical_record")
     services: List["Services_Rendered"] = Relationship(back_populates="medical_record")
 
 class Prescriptions(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    record_id: Optional[int] = Field(default=None, foreign_key="medical_records.id")
+    record_id: Optional[int] = Field(default=None, foreign_key="medical_records.id", index=True)
     drug_name: str
     dosage: str
     duration_days: int
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     medical_record: Optional[Medical_Records] = Relationship(back_populates="prescriptions")
 
 class Services_Rendered(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    record_id: Optional[int] = Field(default=None, foreign_key="medical_records.id")
-    service_id: Optional[int] = Field(default=None, foreign_key="service_catalog.id")
+    record_id: Optional[int] = Field(default=None, foreign_key="medical_records.id", index=True)
+    service_id: Optional[int] = Field(default=None, foreign_key="service_catalog.id", index=True)
     quantity: int = 1
+    created_at: Timestamp = created_at_field()
+    updated_at: Timestamp = updated_at_field()
+    version: Optional[int] = version_field()
     
     medical_record: Optional[Medical_Records] = Relationship(back_populates="services")
+    service: Optional[Service_Catalog] = Relationship()
+
+
+# --- Сводные таблицы ---
+
+class Billing_Daily(SQLModel, table=True):
+    # Суммы оказанных услуг за день в разрезе пациент / врач / отделение, ведет billing.py.
+    # 0 вместо NULL в ключе: ключ — первичный, по нему идет upsert
+    day: date = Field(primary_key=True)
+    patient_id: int = Field(default=0, primary_key=True, index=True)
+    doctor_id: int = Field(default=0, primary_key=True, index=True)
+    department_id: int = Field(default=0, primary_key=True, index=True)
+    services_count: int = 0
+    amount: Decimal = Field(default=0, decimal_places=2)
+
+
+# --- Архив приемов ---
+# Завершенные приемы старше горизонта вместе с медкартами, назначениями и услугами переносит archive.py.
+# Колонки и id те же, что в рабочих таблицах. Внешних ключей между архивными таблицами нет:
+# на PostgreSQL appointments_archive секционирована по месяцам, а ключ секционированной таблицы обязан включать datetime.
+# Записи через API в архив не попадают — он только для чтения.
+
+class Appointments_Archive(SQLModel, table=True):
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "datetime"),
+        Index("ix_appointments_archive_id", "id"),
+        Index("ix_appointments_archive_patient_id", "patient_id"),
+        Index("ix_appointments_archive_doctor_id_datetime", "doctor_id", "datetime"),
+        Index("ix_appointments_archive_datetime", "datetime"),
+        {"postgresql_partition_by": "RANGE (datetime)"},
+    )
+
+    id: int
+    patient_id: Optional[int] = Field(default=None, foreign_key="patients.id")
+    doctor_id: Optional[int] = Field(default=None, foreign_key="doctors.id")
+    datetime: datetime
+    status_id: Optional[int] = Field(default=None, foreign_key="appointment_statuses.id")
+    created_at: Timestamp = None
+    updated_at: Timestamp = None
+    version: Optional[int] = None
+
+class Medical_Records_Archive(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    appointment_id: int = Field(index=True, unique=True)
+    complaints: Optional[str] = None
+    anamnesis: Optional[str] = None
+    diagnosis_id: Optional[int] = Field(default=None, foreign_key="diagnoses.id", index=True)
+    recommendations: Optional[str] = None
+    created_at: Timestamp = None
+    updated_at: Timestamp = None
+    version: Optional[int] = None
+
+class Prescriptions_Archive(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    record_id: Optional[int] = Field(default=None, index=True)
+    drug_name: str
+    dosage: str
+    duration_days: int
+    created_at: Timestamp = None
+    updated_at: Timestamp = None
+    version: Optional[int] = None
+
+class Services_Rendered_Archive(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    record_id: Optional[int] = Field(default=None, index=True)
+    service_id: Optional[int] = Field(default=None, foreign_key="service_catalog.id", index=True)
+    quantity: int = 1
+    created_at: Timestamp = None
+    updated_at: Timestamp = None
+    version: Optional[int] = None
+
+
+# --- Надгробия ---
+
+class Tombstones(SQLModel, table=True):
+    # Строки, удаленные через API: их id отдаются в ?updated_since= (см. sync.py), старые чистит purge_tombstones
+    __table_args__ = (Index("ix_tombstones_table_name_deleted_at", "table_name", "deleted_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str
+    row_id: int
+    deleted_at: Timestamp = Field(default=None, index=True, sa_column_kwargs={"default": utc_now})
+
+
+# --- Миграция колонок и индексов ---
+
+def create_missing_columns(engine):
+    """Добавляет в существующие таблицы объявленные в моделях колонки, допускающие NULL или с DEFAULT
+    (created_at, updated_at, version). На PostgreSQL это мгновенно и без переписывания таблицы"""
+    inspector = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if (column.name in existing or column.primary_key
+                    or not (column.nullable or column.server_default is not None)):
+                continue
+            with engine.begin() as conn:
+                quote = conn.dialect.identifier_preparer.quote
+                conn.exec_driver_sql(f"ALTER TABLE {quote(table.name)} ADD COLUMN "
+                                     f"{CreateColumn(column).compile(dialect=conn.dialect)}")
+
+def create_missing_indexes(engine):
+    """Создает индексы, объявленные в моделях, в уже существующих таблицах.
+    create_all() строит индексы только вместе с новыми таблицами, поэтому для старых БД вызываем отдельно."""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                # Например, уникальный индекс не строится из-за дублей в данных
+                schema_log.warning("cannot create index %s: %s", index.name, e)
@@ -0,0 +1,103 @@
+from typing import List, Optional
+from decimal import Decimal
+
+from sqlalchemy.orm import joinedload, selectinload
+from sqlmodel import SQLModel, Session, select
+
+from models import (
+    Medical_Records, Appointments, Patients, Doctors, Diagnoses, Prescriptions, Services_Rendered, Service_Catalog,
+    Medical_Records_Archive, Appointments_Archive, Prescriptions_Archive, Services_Rendered_Archive
+)
+
+# ===================================================================================
+# --- МЕДКАРТА ЦЕЛИКОМ ---
+# ===================================================================================
+# Запись медкарты со всем, что к ней относится, за фиксированное число запросов:
+#   1. медкарта + прием + пациент + врач + диагноз (JOIN, joinedload)
+#   2. назначения (selectinload: WHERE record_id IN ...)
+#   3. оказанные услуги + позиции прайса (selectinload + joinedload)
+# Число запросов не зависит от количества назначений и услуг.
+# Медкарта из архива (archive.py) собирается так же за три запроса, но обычными JOIN: у архивных таблиц нет связей ORM.
+
+class RenderedServiceDetail(SQLModel):
+    id: int
+    service_id: Optional[int] = None
+    name: Optional[str] = None
+    price: Optional[Decimal] = None
+    quantity: int
+    amount: Optional[Decimal] = None
+
+class MedicalRecordDetail(SQLModel):
+    id: int
+    complaints: Optional[str] = None
+    anamnesis: Optional[str] = None
+    recommendations: Optional[str] = None
+    diagnosis: Optional[Diagnoses] = None
+    appointment: Optional[Appointments] = None
+    patient: Optional[Patients] = None
+    doctor: Optional[Doctors] = None
+    prescriptions: List[Prescriptions] = []
+    services: List[RenderedServiceDetail] = []
+    total: Decimal = Decimal(0)
+
+
+def load_medical_record(session: Session, record_id: int) -> Optional[MedicalRecordDetail]:
+    statement = (
+        select(Medical_Records)
+        .where(Medical_Records.id == record_id)
+        .options(
+            joinedload(Medical_Records.appointment).joinedload(Appointments.patient),
+            joinedload(Medical_Records.appointment).joinedload(Appointments.doctor),
+            joinedload(Medical_Records.diagnosis),
+            selectinload(Medical_Records.prescriptions),
+            selectinload(Medical_Records.services).joinedload(Services_Rendered.service),
+        )
+    )
+    record = session.exec(statement).unique().first()
+    if record is None:
+        return None
+    appointment = record.appointment
+    return _detail(record, record.diagnosis, appointment, appointment.patient if appointment else None,
+                   appointment.doctor if appointment else None, record.prescriptions,
+                   [(item, item.service) for item in record.services])
+
+def load_archived_medical_record(session: Session, record_id: int) -> Optional[MedicalRecordDetail]:
+    statement = (
+        select(Medical_Records_Archive, Diagnoses, Appointments_Archive, Patients, Doctors)
+        .outerjoin(Diagnoses, Diagnoses.id == Medical_Records_Archive.diagnosis_id)
+        .outerjoin(Appointments_Archive, Appointments_Archive.id == Medical_Records_Archive.appointment_id)
+        .outerjoin(Patients, Patients.id == Appointments_Archive.patient_id)
+        .outerjoin(Doctors, Doctors.id == Appointments_Archive.doctor_id)
+        .where(Medical_Records_Archive.id == record_id)
+    )
+    row = session.exec(statement).first()
+    if row is None:
+        return None
+    record, diagnosis, appointment, patient, doctor = row
+    prescriptions = session.exec(select(Prescriptions_Archive).where(Prescriptions_Archive.record_id == record_id)
+                                 .order_by(Prescriptions_Archive.id)).all()
+    services = session.exec(
+        select(Services_Rendered_Archive, Service_Catalog)
+        .outerjoin(Service_Catalog, Service_Catalog.id == Services_Rendered_Archive.service_id)
+        .where(Services_Rendered_Archive.record_id == record_id).order_by(Services_Rendered_Archive.id)
+    ).all()
+    return _detail(record, diagnosis, Appointments.model_validate(appointment.model_dump()) if appointment else None,
+                   patient, doctor, [Prescriptions.model_validate(item.model_dump()) for item in prescriptions], services)
+
+def _detail(record, diagnosis, appointment, patient, doctor, prescriptions, services) -> MedicalRecordDetail:
+    """services — пары (оказанная услуга, позиция прайса или None)"""
+    services = [
+        RenderedServiceDetail(
+            id=item.id, service_id=item.service_id, quantity=item.quantity,
+            name=service.name if service else None,
+            price=service.price if service else None,
+            amount=service.price * item.quantity if service else None,
+        )
+        for item, service in services
+    ]
+    return MedicalRecordDetail(
+        id=record.id, complaints=record.complaints, anamnesis=record.anamnesis,
+        recommendations=record.recommendations, diagnosis=diagnosis, appointment=appointment,
+        patient=patient, doctor=doctor, prescriptions=prescriptions, services=services,
+        total=sum((item.amount for item in services if item.amount is not None), Decimal(0)),
+    )
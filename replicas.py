@@ -0,0 +1,263 @@
+import logging
+import os
+import threading
+from itertools import count
+from time import time
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+import database
+from database import pool_status
+from versions import table_versions
+
+# ===================================================================================
+# --- РЕПЛИКИ ДЛЯ ЧТЕНИЯ ---
+# ===================================================================================
+# Эндпоинты чтения (списки и записи таблиц, поиск, медкарта, календарь, статистика, взаиморасчеты, экспорт)
+# берут сессию через replicas.read_session(*таблицы ответа) и читают с реплики, если она достаточно свежа,
+# иначе — с первичной БД. Записи, свободные слоты (по ним сразу записываются) и все остальное — на первичной.
+# Фоновый поток раз в REPLICA_CHECK_SECONDS проверяет каждую реплику и измеряет ее отставание (lag).
+# Из проверки известен горизонт реплики: момент, до которого она точно применила записи первичной БД
+# (время проверки минус отставание). Реплика годится для запроса, если она доступна, отставание не больше
+# REPLICA_MAX_LAG_SECONDS, проверка не устарела и горизонт позже:
+#   - последней записи в таблицы ответа (версии таблиц, см. versions.py) — иначе кэш ответов и ETag
+#     заполнились бы данными до этой записи;
+#   - последней записи этого клиента (кука db_last_write, ее ставит ReadYourWritesMiddleware) —
+#     клиент сразу видит свои изменения.
+# Подходящие реплики чередуются; если реплика не отдала соединение, чтение идет в первичную БД.
+# Без DATABASE_REPLICA_URLS (см. database.py) все читается с первичной БД, как раньше.
+#   REPLICA_MAX_LAG_SECONDS   допустимое отставание реплики
+#   REPLICA_CHECK_SECONDS     период проверки
+#   REPLICA_LAG_QUERY         свой SQL, возвращающий отставание в секундах (по умолчанию — по диалекту)
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "2"))
+REPLICA_LAG_QUERY = os.getenv("REPLICA_LAG_QUERY")
+# Проверка старше трех периодов — поток проверок не работает, реплике не доверяем
+STALE_CHECK_SECONDS = 3 * REPLICA_CHECK_SECONDS
+
+WRITE_COOKIE = "db_last_write"
+# Дольше кука не нужна: к этому времени любая пригодная реплика уже догнала запись
+READ_YOUR_WRITES_SECONDS = int(REPLICA_MAX_LAG_SECONDS + STALE_CHECK_SECONDS) + 1
+
+# PostgreSQL: реплика, применившая все полученное, не отстает, даже если записей давно не было
+LAG_QUERIES = {
+    "postgresql": "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+                  "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                  "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END",
+}
+DEFAULT_LAG_QUERY = "SELECT 0"
+
+replica_log = logging.getLogger("polyclinic.replicas")
+
+
+class Replica:
+    """Реплика: движки и результат последней проверки"""
+    def __init__(self, name: str, engine, async_engine=None):
+        self.name = name
+        self.engine = engine
+        self.async_engine = async_engine
+        # (доступна, отставание, время проверки, ошибка) — заменяется целиком, читается без блокировки
+        self.state = (False, None, 0.0, "not checked")
+        self.reads = 0
+
+    def check(self):
+        query = text(REPLICA_LAG_QUERY or LAG_QUERIES.get(self.engine.dialect.name, DEFAULT_LAG_QUERY))
+        started = time()
+        try:
+            with self.engine.connect() as conn:
+                lag = conn.execute(query).scalar()
+        except DBAPIError as e:
+            self.failed(e)
+            return
+        # NULL — реплика еще ничего не применила
+        self.state = (True, float(lag) if lag is not None else float("inf"), started, None)
+
+    def failed(self, error: Exception):
+        if self.state[0]:
+            replica_log.warning("replica %s is unavailable: %s", self.name, error)
+        self.state = (False, None, time(), str(error).splitlines()[0] if str(error) else type(error).__name__)
+
+    def horizon(self) -> float:
+        """До какого момента реплика точно применила записи первичной БД (0 — не годится для чтения)"""
+        healthy, lag, checked_at, _ = self.state
+        if not healthy or lag > REPLICA_MAX_LAG_SECONDS or time() - checked_at > STALE_CHECK_SECONDS:
+            return 0.0
+        return checked_at - lag
+
+    def status(self) -> dict:
+        healthy, lag, checked_at, error = self.state
+        return {"name": self.name, "url": self.engine.url.render_as_string(hide_password=True),
+                "healthy": healthy, "lag_seconds": None if lag in (None, float("inf")) else lag,
+                "checked_seconds_ago": round(time() - checked_at, 3) if checked_at else None,
+                "usable": self.horizon() > 0, "reads": self.reads, "error": error}
+
+
+class ReplicaSet:
+    def __init__(self, replicas: list):
+        self.replicas = replicas
+        self._turn = count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.primary_reads = {"no_usable_replica": 0, "recent_write": 0, "connect_failed": 0}
+
+    # --- Проверки ---
+
+    def check_all(self):
+        for replica in self.replicas:
+            replica.check()
+
+    def _loop(self):
+        while not self._stop.wait(REPLICA_CHECK_SECONDS):
+            try:
+                self.check_all()
+            except Exception:
+                replica_log.exception("replica check failed")
+
+    def start(self):
+        """Первая проверка сразу, дальше — в фоновом потоке"""
+        if not self.replicas or self._thread is not None:
+            return
+        self.check_all()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="replica-checks", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    # --- Выбор ---
+
+    def _count(self, reason: str):
+        with self._lock:
+            self.primary_reads[reason] += 1
+
+    def route(self, request: Request, tables: tuple) -> Optional[Replica]:
+        """Реплика для запроса или None — читать с первичной БД"""
+        if not self.replicas or request.method not in ("GET", "HEAD"):
+            return None
+        usable = [replica for replica in self.replicas if replica.horizon() > 0]
+        if not usable:
+            self._count("no_usable_replica")
+            return None
+        try:
+            not_before = float(request.cookies.get(WRITE_COOKIE, 0))
+        except ValueError:
+            not_before = 0.0
+        if tables:
+            not_before = max(not_before, table_versions.last_write(tables))
+        fresh = [replica for replica in usable if replica.horizon() > not_before]
+        if not fresh:
+            self._count("recent_write")
+            return None
+        with self._lock:
+            replica = fresh[next(self._turn) % len(fresh)]
+            replica.reads += 1
+        return replica
+
+    def engine_for(self, request: Request, tables: tuple):
+        """Синхронный движок для чтения вне сессии (потоковый экспорт)"""
+        replica = self.route(request, tables)
+        return replica.engine if replica is not None else database.engine
+
+    def read_session(self, *tables: str):
+        """Зависимость FastAPI: Session на реплике, свежей для tables, иначе на первичной БД"""
+        def get_read_session(request: Request):
+            replica = self.route(request, tables)
+            if replica is not None:
+                session = Session(replica.engine)
+                try:
+                    # Соединение берется сразу: пока обработчик не начал, еще можно перейти на первичную БД
+                    session.connection()
+                except DBAPIError as e:
+                    session.close()
+                    replica.failed(e)
+                    self._count("connect_failed")
+                else:
+                    with session:
+                        yield session
+                    return
+            with Session(database.engine) as session:
+                yield session
+        return get_read_session
+
+    def async_read_session(self, *tables: str):
+        """То же для DB_ASYNC: AsyncSession на асинхронном движке реплики"""
+        from sqlmodel.ext.asyncio.session import AsyncSession
+
+        async def get_async_read_session(request: Request):
+            # Версии таблиц могут лежать в Redis — выбор реплики не должен блокировать цикл событий
+            replica = await run_in_threadpool(self.route, request, tables)
+            if replica is not None:
+                session = AsyncSession(replica.async_engine, expire_on_commit=False)
+                try:
+                    await session.connection()
+                except DBAPIError as e:
+                    await session.close()
+                    replica.failed(e)
+                    self._count("connect_failed")
+                else:
+                    async with session:
+                        yield session
+                    return
+            async with AsyncSession(database.async_engine, expire_on_commit=False) as session:
+                yield session
+        return get_async_read_session
+
+    # --- Мониторинг ---
+
+    def status(self) -> dict:
+        with self._lock:
+            primary_reads = dict(self.primary_reads)
+        return {"max_lag_seconds": REPLICA_MAX_LAG_SECONDS, "replicas": [r.status() for r in self.replicas],
+                "primary_reads": primary_reads}
+
+    def pools(self) -> dict:
+        """Состояние пулов реплик для /db/pool и /metrics: имя -> pool_status()"""
+        pools = {}
+        for replica in self.replicas:
+            pools[replica.name] = pool_status(replica.engine)
+            if replica.async_engine is not None:
+                pools[f"{replica.name}_async"] = pool_status(replica.async_engine.sync_engine)
+        return pools
+
+
+class ReadYourWritesMiddleware:
+    """Ставит клиенту куку со временем его последней успешной записи (см. WRITE_COOKIE)"""
+    def __init__(self, app, replica_set: ReplicaSet):
+        self.app = app
+        self.replica_set = replica_set
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not self.replica_set.replicas
+                or scope["method"] in ("GET", "HEAD", "OPTIONS")):
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            # Начало ответа — после commit: записанное уже на первичной БД
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = (f"{WRITE_COOKIE}={time():.3f}; Max-Age={READ_YOUR_WRITES_SECONDS}; Path=/; "
+                          f"HttpOnly; SameSite=Lax")
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def build_replicas() -> ReplicaSet:
+    engines, async_engines = database.replica_engines, database.async_replica_engines
+    if database.DB_ASYNC and len(async_engines) != len(engines):
+        raise ValueError("ASYNC_DATABASE_REPLICA_URLS must list the same replicas as DATABASE_REPLICA_URLS")
+    return ReplicaSet([Replica(f"replica{number}", engine, async_engines[number] if database.DB_ASYNC else None)
+                       for number, engine in enumerate(engines)])
+
+replicas = build_replicas()
@@ -0,0 +1,135 @@
+import logging
+from typing import Optional
+from datetime import date
+
+from sqlalchemy import text, case, func, or_, and_, column, table
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import SQLModel, Session, select
+
+from models import Patients, Insurance_Policies
+
+# ===================================================================================
+# --- ПОИСК ПАЦИЕНТОВ ---
+# ===================================================================================
+# Запрос разбивается на слова; каждое слово должно встретиться хотя бы в одном из полей:
+# фамилия, имя, отчество, телефон, номер полиса. Отбор идет по индексу:
+#   PostgreSQL — GIN-индексы pg_trgm по lower(поле), они обслуживают LIKE '%слово%';
+#   SQLite     — FTS5-таблица patient_search с токенизатором trigram, ее ведут триггеры;
+#   остальные  — LIKE без индекса.
+# Ранг: совпадение с началом фамилии выше совпадения с началом полиса/телефона, затем имени,
+# затем совпадение в середине любого поля. Индексы создает create_search_indexes() при старте.
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_TOKENS = 5
+TRIGRAM = 3  # короче трех символов слово ищется только по началу полей
+
+PATIENT_COLUMNS = (Patients.last_name, Patients.first_name, Patients.middle_name, Patients.phone)
+
+# Текст строки FTS-таблицы для пациента (new — строка patients в триггере)
+_FTS_TEXT = """coalesce({row}.last_name, '') || ' ' || coalesce({row}.first_name, '') || ' ' ||
+    coalesce({row}.middle_name, '') || ' ' || coalesce({row}.phone, '') || ' ' ||
+    coalesce((SELECT policy_number FROM insurance_policies WHERE id = {row}.policy_id), '')"""
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patient_search USING fts5(text, tokenize = 'trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_search_insert AFTER INSERT ON patients BEGIN
+        INSERT INTO patient_search (rowid, text) VALUES (new.id, {_FTS_TEXT.format(row="new")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_search_update AFTER UPDATE ON patients BEGIN
+        DELETE FROM patient_search WHERE rowid = old.id;
+        INSERT INTO patient_search (rowid, text) VALUES (new.id, {_FTS_TEXT.format(row="new")});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patient_search_delete AFTER DELETE ON patients BEGIN
+        DELETE FROM patient_search WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_search_policy AFTER UPDATE OF policy_number ON insurance_policies BEGIN
+        DELETE FROM patient_search WHERE rowid IN (SELECT id FROM patients WHERE policy_id = new.id);
+        INSERT INTO patient_search (rowid, text)
+            SELECT p.id, {_FTS_TEXT.format(row="p")} FROM patients p WHERE p.policy_id = new.id;
+    END""",
+]
+
+_POSTGRES_DDL = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS ix_{table_name}_{name}_trgm ON {table_name} USING gin (lower({name}) gin_trgm_ops)"
+    for table_name, name in [("patients", "last_name"), ("patients", "first_name"), ("patients", "middle_name"),
+                             ("patients", "phone"), ("insurance_policies", "policy_number")]
+]
+
+search_log = logging.getLogger("polyclinic.search")
+
+_fts_engines = set()  # движки SQLite, где FTS-таблица создана
+
+def create_search_indexes(engine):
+    """Создает поисковые индексы (идемпотентно); без прав на расширение поиск работает без индекса"""
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == "postgresql":
+                for statement in _POSTGRES_DDL:
+                    conn.execute(text(statement))
+            elif engine.dialect.name == "sqlite":
+                exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'patient_search'")).first()
+                for statement in _SQLITE_DDL:
+                    conn.execute(text(statement))
+                if not exists:
+                    conn.execute(text(f"INSERT INTO patient_search (rowid, text) SELECT p.id, {_FTS_TEXT.format(row='p')} FROM patients p"))
+                _fts_engines.add(engine)
+    except SQLAlchemyError as e:
+        search_log.warning("cannot create search indexes: %s", e)
+
+
+class PatientSearchResult(SQLModel):
+    id: int
+    last_name: str
+    first_name: str
+    middle_name: Optional[str] = None
+    birth_date: date
+    phone: Optional[str] = None
+    policy_number: Optional[str] = None
+    score: int
+
+
+def _fields():
+    return [func.lower(c) for c in PATIENT_COLUMNS] + [func.lower(Insurance_Policies.policy_number)]
+
+def _matching_ids(token: str, use_fts: bool):
+    """id пациентов, у которых слово token встречается хотя бы в одном поле"""
+    if use_fts and len(token) >= TRIGRAM:
+        fts = table("patient_search", column("rowid"), column("patient_search"))
+        return select(fts.c.rowid).where(fts.c.patient_search.op("MATCH")('"' + token.replace('"', '""') + '"'))
+    def match(field):
+        if len(token) < TRIGRAM:
+            return field.startswith(token, autoescape=True)
+        return field.contains(token, autoescape=True)
+    # Поля пациента и полиса — отдельные ветки UNION, чтобы каждая шла по своим индексам
+    return (
+        select(Patients.id).where(or_(*(match(func.lower(c)) for c in PATIENT_COLUMNS)))
+        .union(select(Patients.id).join(Insurance_Policies, Insurance_Policies.id == Patients.policy_id)
+               .where(match(func.lower(Insurance_Policies.policy_number))))
+    )
+
+def _token_score(token: str):
+    last_name, first_name, middle_name, phone, policy_number = _fields()
+    return case(
+        (last_name.startswith(token, autoescape=True), 4),
+        (or_(policy_number.startswith(token, autoescape=True), phone.startswith(token, autoescape=True)), 3),
+        (or_(first_name.startswith(token, autoescape=True), middle_name.startswith(token, autoescape=True)), 2),
+        else_=1,
+    )
+
+def search_patients(session: Session, q: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list:
+    """Лучшие limit пациентов по запросу q"""
+    tokens = q.lower().split()[:MAX_SEARCH_TOKENS]
+    if not tokens:
+        return []
+    use_fts = session.get_bind() in _fts_engines
+    score = sum(_token_score(token) for token in tokens)
+    statement = (
+        select(Patients.id, Patients.last_name, Patients.first_name, Patients.middle_name, Patients.birth_date,
+               Patients.phone, Insurance_Policies.policy_number, score.label("score"))
+        .outerjoin(Insurance_Policies, Insurance_Policies.id == Patients.policy_id)
+        .where(and_(*(Patients.id.in_(_matching_ids(token, use_fts)) for token in tokens)))
+        .order_by(score.desc(), Patients.last_name, Patients.first_name, Patients.id)
+        .limit(limit)
+    )
+    return [PatientSearchResult(**row._mapping) for row in session.exec(statement)]
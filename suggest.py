@@ -0,0 +1,139 @@
+import re
+import heapq
+import threading
+from bisect import bisect_left
+from typing import Optional
+
+from sqlmodel import SQLModel, Session, select
+
+from models import Diagnoses
+from versions import table_versions
+
+# ===================================================================================
+# --- ПОДСКАЗКИ КОДОВ МКБ ---
+# ===================================================================================
+# Справочник диагнозов (полная МКБ-10 — около 16 тысяч кодов) целиком держится в памяти:
+# отсортированный список кодов и отсортированный список слов описаний. Префикс ищется
+# бинарным поиском, для коротких (1-2 символа) префиксов лучшие ответы посчитаны заранее,
+# поэтому подсказка не зависит от размера справочника.
+# Индекс строится при старте и перестраивается при следующем запросе после записи в diagnoses:
+# своей (слушатель invalidate) или чужой — другого воркера или importer.py, которые поднимают версию таблицы
+# (versions.py; между процессами — при CACHE_BACKEND=redis).
+
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+PRECOMPUTED_PREFIX = 2  # префиксы такой длины и короче отвечают готовыми списками
+
+_WORD = re.compile(r"\w+")
+
+
+class DiagnosisSuggestion(SQLModel):
+    id: int
+    mkb_code: str
+    description: Optional[str] = None
+
+
+def normalize_code(code: str) -> str:
+    """J10.1 / j101 / J10,1 -> J101: точку в коде пользователи ставят по-разному"""
+    return re.sub(r"[^0-9A-Z]", "", code.upper())
+
+def _prefix_range(keys: list, prefix: str):
+    return bisect_left(keys, prefix), bisect_left(keys, prefix + "\uffff")
+
+def _unique(positions):
+    """Убирает повторы из отсортированной последовательности"""
+    last = None
+    for position in positions:
+        if position != last:
+            last = position
+            yield position
+
+
+class _Snapshot:
+    """Неизменяемый снимок справочника; при перестройке заменяется целиком"""
+    def __init__(self, rows):
+        # Порядок выдачи — по коду, поэтому номер позиции в отсортированном списке и есть ранг
+        rows = sorted(rows, key=lambda row: (normalize_code(row[1]), row[0]))
+        self.items = [DiagnosisSuggestion(id=id, mkb_code=code, description=description) for id, code, description in rows]
+        self.codes = [normalize_code(item.mkb_code) for item in self.items]
+        self.words = []  # позиция -> слова описания (для проверки остальных слов запроса)
+        postings = {}    # слово -> позиции диагнозов с ним, по возрастанию
+        for position, item in enumerate(self.items):
+            words = tuple(sorted(set(_WORD.findall((item.description or "").lower()))))
+            self.words.append(words)
+            for word in words:
+                postings.setdefault(word, []).append(position)
+        self.word_keys = sorted(postings)
+        self.word_postings = [postings[word] for word in self.word_keys]
+        self.short = {}  # короткий префикс слова -> первые MAX_SUGGEST_LIMIT позиций
+        for word, positions in postings.items():
+            for length in range(1, min(len(word), PRECOMPUTED_PREFIX) + 1):
+                self.short.setdefault(word[:length], set()).update(positions[:MAX_SUGGEST_LIMIT])
+        self.short = {prefix: sorted(positions)[:MAX_SUGGEST_LIMIT] for prefix, positions in self.short.items()}
+
+    def code_matches(self, prefix: str, limit: int) -> list:
+        lo, hi = _prefix_range(self.codes, prefix)
+        return list(range(lo, min(hi, lo + limit)))
+
+    def word_matches(self, prefix: str, complete: bool = False):
+        """Позиции диагнозов со словом на prefix, по порядку выдачи. Без complete для коротких
+        префиксов — только первые MAX_SUGGEST_LIMIT"""
+        if len(prefix) <= PRECOMPUTED_PREFIX and not complete:
+            return iter(self.short.get(prefix, []))
+        # Списки позиций слов диапазона уже отсортированы: слияние ленивое и останавливается на limit
+        lo, hi = _prefix_range(self.word_keys, prefix)
+        return _unique(heapq.merge(*self.word_postings[lo:hi]))
+
+    def has_word(self, position: int, prefix: str) -> bool:
+        words = self.words[position]
+        i = bisect_left(words, prefix)
+        return i < len(words) and words[i].startswith(prefix)
+
+
+class DiagnosisIndex:
+    def __init__(self, versions=table_versions):
+        self._lock = threading.Lock()
+        self._versions = versions
+        self._snapshot = None
+        self._generation = 0  # число вызовов invalidate
+        self._built_for = None  # (поколение, версия таблицы), для которых построен снимок
+
+    def invalidate(self, table: str = None, *args):
+        """Слушатель записей crud_router: следующий запрос перестроит индекс"""
+        if table is None or table == Diagnoses.__tablename__:
+            with self._lock:
+                self._generation += 1
+
+    def build(self, session: Session) -> _Snapshot:
+        """Текущий снимок; перестраивается, если после прошлой сборки был invalidate или сменилась версия таблицы"""
+        version = self._versions.version(Diagnoses.__tablename__)
+        with self._lock:
+            key = (self._generation, version)
+            if self._snapshot is None or self._built_for != key:
+                self._snapshot = _Snapshot(session.exec(select(Diagnoses.id, Diagnoses.mkb_code, Diagnoses.description)).all())
+                self._built_for = key
+            return self._snapshot
+
+    def suggest(self, session: Session, prefix: str, limit: int = DEFAULT_SUGGEST_LIMIT) -> list:
+        """Сначала коды, начинающиеся с prefix, затем диагнозы, в описании которых есть слова,
+        начинающиеся с каждого слова prefix"""
+        snapshot = self.build(session)
+        tokens = _WORD.findall(prefix.lower())
+        if not tokens:
+            return []
+        positions = []
+        code = normalize_code(prefix)
+        if code and len(prefix.split()) == 1:
+            positions = snapshot.code_matches(code, limit)
+        if len(positions) < limit:
+            # Кандидаты — по самому длинному (обычно самому редкому) слову, остальные проверяются по словам описания
+            candidates = snapshot.word_matches(max(tokens, key=len), complete=len(tokens) > 1)
+            seen = set(positions)
+            for position in candidates:
+                if position not in seen and all(snapshot.has_word(position, token) for token in tokens):
+                    positions.append(position)
+                    if len(positions) >= limit:
+                        break
+        return [snapshot.items[position] for position in positions]
+
+diagnosis_index = DiagnosisIndex()
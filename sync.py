@@ -0,0 +1,142 @@
+import argparse
+import base64
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from pydantic_core import to_json
+from sqlalchemy import delete, insert, select, tuple_
+from sqlmodel import SQLModel
+
+from models import Tombstones, utc_now
+from formats import JSON, encode_rows
+from database import engine
+
+# ===================================================================================
+# --- ИНКРЕМЕНТАЛЬНАЯ СИНХРОНИЗАЦИЯ ---
+# ===================================================================================
+# Клиент (выгрузка в страховую отчетность, мобильные копии справочников) держит у себя копию таблицы
+# и забирает только изменения:
+#   1. Первая загрузка — обычный список по страницам (GET /patients/?after_id=...). Первая страница
+#      отдает заголовок X-Sync-Token — его нужно сохранить.
+#   2. Дальше — GET /patients/?updated_since=<токен>[&limit=1000]:
+#        {"changed": [строки, измененные после токена], "deleted": [id удаленных],
+#         "next_token": "...", "has_more": false}
+#      Сначала удалить deleted, затем записать changed поверх имеющихся (по id). Пока has_more — повторять
+#      с next_token, последний next_token сохранить до следующей синхронизации.
+# Изменения берутся по updated_at (индекс), удаления — из tombstones: надгробие пишется в той же транзакции,
+# что и DELETE через API. Токен непрозрачный: позиция (время, вид, id) в общем порядке изменений и удалений.
+# Токен «догнал» отстает от момента запроса на SYNC_OVERLAP_SECONDS: транзакция, начатая раньше, может
+# зафиксироваться позже и со старым updated_at, а реплика — отставать. Поэтому строки на стыке приходят
+# повторно, и применять их нужно идемпотентно (upsert по id).
+# Перенос приемов в архив (archive.py) — не удаление: архивированные строки из копии клиента не убираются.
+# generate.py и importer.py ставят updated_at и при COPY. Без него остаются только строки, созданные до появления
+# колонки (create_missing_columns добавляет ее пустой): их дает только первая загрузка.
+#   SYNC_OVERLAP_SECONDS     перекрытие соседних синхронизаций
+#   SYNC_TOMBSTONE_DAYS      срок хранения надгробий; токен старше — 410, нужна полная загрузка
+#   python sync.py purge     удалить устаревшие надгробия (выполняется и при запуске API)
+
+SYNC_OVERLAP_SECONDS = float(os.getenv("SYNC_OVERLAP_SECONDS", "60"))
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "90"))
+
+CHANGED, DELETED = 0, 1  # порядок при равном времени: изменения, затем удаления
+
+
+# --- Токен ---
+
+def _encode_token(moment: datetime, kind: int, id: int, started) -> str:
+    raw = json.dumps([moment.isoformat(), kind, id, started.isoformat() if started else None], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_token(token: str) -> tuple:
+    try:
+        moment, kind, id, started = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return (datetime.fromisoformat(moment), int(kind), int(id),
+                datetime.fromisoformat(started) if started else None)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Invalid updated_since token")
+
+def _caught_up(started: datetime) -> str:
+    # kind -1: все записи этого времени (и изменения, и удаления) попадут в следующую синхронизацию
+    return _encode_token(started - timedelta(seconds=SYNC_OVERLAP_SECONDS), -1, 0, None)
+
+
+def _after(moment_column, id_column, kind: int, cursor: tuple):
+    """Условие «после курсора» для источника вида kind, упорядоченного по (время, id)"""
+    moment, cursor_kind, cursor_id, _ = cursor
+    if cursor_kind < kind:
+        return moment_column >= moment
+    if cursor_kind == kind:
+        return tuple_(moment_column, id_column) > tuple_(moment, cursor_id)
+    return moment_column > moment
+
+
+class DeltaSync:
+    def token(self) -> str:
+        """Токен для X-Sync-Token первой страницы обычного списка"""
+        return _caught_up(utc_now())
+
+    def changes(self, session, model, columns: list, token: str, limit: int) -> bytes:
+        """Тело ответа ?updated_since=: изменения и удаления после token, не больше limit"""
+        cursor = _decode_token(token)
+        now = utc_now()
+        if cursor[0] < now - timedelta(days=SYNC_TOMBSTONE_DAYS):
+            raise HTTPException(status_code=410, detail="Sync token has expired, reload the table")
+        # Время начала синхронизации, продолжающейся по страницам: итоговый токен отсчитывается от него
+        started = cursor[3] or now
+        table = model.__tablename__
+
+        changed = session.execute(
+            select(*columns).where(_after(model.updated_at, model.id, CHANGED, cursor))
+            .order_by(model.updated_at, model.id).limit(limit + 1)).all()
+        deleted = session.execute(
+            select(Tombstones.deleted_at, Tombstones.row_id)
+            .where(Tombstones.table_name == table,
+                   _after(Tombstones.deleted_at, Tombstones.row_id, DELETED, cursor))
+            .order_by(Tombstones.deleted_at, Tombstones.row_id).limit(limit + 1)).all()
+
+        # Слияние двух упорядоченных выборок: из каждой взято limit + 1, первые limit общего порядка — точные
+        entries = sorted([(row.updated_at, CHANGED, row.id, row) for row in changed]
+                         + [(moment, DELETED, row_id, None) for moment, row_id in deleted], key=lambda e: e[:3])
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        if has_more:
+            moment, kind, id, _ = entries[-1]
+            next_token = _encode_token(moment, kind, id, started)
+        else:
+            next_token = _caught_up(started)
+
+        rows = [row for _, kind, _, row in entries if kind == CHANGED]
+        return (b'{"changed":' + encode_rows(JSON, columns, rows)
+                + b',"deleted":' + to_json([id for _, kind, id, _ in entries if kind == DELETED])
+                + b',"next_token":' + to_json(next_token) + b',"has_more":' + to_json(has_more) + b"}")
+
+    def after_write(self, session, table: str, op: str, ids: list):
+        """post_write_listener: надгробия удаленных строк в транзакции удаления"""
+        if op == "delete" and ids:
+            session.execute(insert(Tombstones), [{"table_name": table, "row_id": id} for id in ids])
+
+
+def purge_tombstones(engine, days: int = SYNC_TOMBSTONE_DAYS) -> int:
+    """Удаляет надгробия старше days. Возвращает их число"""
+    with engine.begin() as conn:
+        return conn.execute(delete(Tombstones).where(
+            Tombstones.deleted_at < utc_now() - timedelta(days=days))).rowcount
+
+delta_sync = DeltaSync()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание инкрементальной синхронизации")
+    parser.add_argument("command", choices=["purge"])
+    parser.add_argument("--days", type=int, default=SYNC_TOMBSTONE_DAYS)
+    args = parser.parse_args(argv)
+
+    SQLModel.metadata.create_all(engine)
+    print(f"Удалено надгробий: {purge_tombstones(engine, args.days)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
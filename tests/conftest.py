@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Тесты работают с отдельной БД: TEST_DATABASE_URL или временный файл SQLite. DATABASE_URL задается
+# до импорта модулей приложения — движок создается при импорте database.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+# Memory-бэкенд меняет ETag раз в CACHE_TTL_SECONDS (см. versions.py): тест не должен попасть на границу
+os.environ.setdefault("CACHE_TTL_SECONDS", "3600")
+
+TEST_SCALE = "0.001"  # 10 врачей, 1000 пациентов, 10 000 приемов (см. generate.py)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    import generate
+    from database import engine
+    generate.main(["--scale", TEST_SCALE, "--reset"])
+    return engine
+
+@pytest.fixture(scope="session")
+def client(engine):
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
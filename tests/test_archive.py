@@ -0,0 +1,86 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import delete, select
+from sqlmodel import Session
+
+import archive
+from models import (Appointment_Statuses, Appointments, Doctors, Medical_Records, Patients, Prescriptions,
+                    Service_Catalog, Services_Rendered)
+
+# Приемы теста — в 2001–2003 годах, раньше сгенерированной истории; горизонт отсекает по 2002-01-01
+CUTOFF = date(2002, 1, 1)
+HORIZON_DAYS = (date.today() - CUTOFF).days
+
+
+def add_appointment(session, moment: datetime, status: str, ids: dict) -> dict:
+    """Прием с медкартой, назначением и услугой. Возвращает их id"""
+    status_id = session.exec(select(Appointment_Statuses.id).where(Appointment_Statuses.name == status)).scalars().one()
+    appointment = Appointments(patient_id=ids["patient"], doctor_id=ids["doctor"], datetime=moment, status_id=status_id)
+    session.add(appointment)
+    session.flush()
+    record = Medical_Records(appointment_id=appointment.id, complaints="Архив")
+    session.add(record)
+    session.flush()
+    prescription = Prescriptions(record_id=record.id, drug_name="Тест", dosage="1", duration_days=1)
+    service = Services_Rendered(record_id=record.id, service_id=ids["service"])
+    session.add_all([prescription, service])
+    session.flush()
+    return {Appointments: appointment.id, Medical_Records: record.id,
+            Prescriptions: prescription.id, Services_Rendered: service.id}
+
+def table_with(engine, model, id: int):
+    """Где строка: "working", "archive" или None"""
+    with Session(engine) as session:
+        for place, table in (("working", model.__table__), ("archive", archive.ARCHIVES[model].__table__)):
+            if session.execute(select(table.c.id).where(table.c.id == id)).first():
+                return place
+    return None
+
+
+@pytest.fixture
+def appointments(client, engine):
+    with Session(engine) as session:
+        ids = {"patient": session.exec(select(Patients.id)).scalars().first(),
+               "doctor": session.exec(select(Doctors.id)).scalars().first(),
+               "service": session.exec(select(Service_Catalog.id)).scalars().first()}
+        rows = {"old_done": add_appointment(session, datetime(2001, 2, 3, 10), "Завершен", ids),
+                "old_planned": add_appointment(session, datetime(2001, 2, 3, 11), "Запланирован", ids),
+                "new_done": add_appointment(session, datetime(2003, 2, 3, 10), "Завершен", ids)}
+        session.commit()
+    yield rows
+    with Session(engine) as session:
+        for model in reversed(archive.ARCHIVES):
+            ids = [row[model] for row in rows.values()]
+            for table in (archive.ARCHIVES[model].__table__, model.__table__):
+                session.execute(delete(table).where(table.c.id.in_(ids)))
+        session.commit()
+
+
+def test_memory_backends_refuse_archive_without_flag(engine, monkeypatch):
+    monkeypatch.setattr(archive, "CACHE_BACKEND", "memory")
+    with pytest.raises(RuntimeError):
+        archive.run_archive(engine, HORIZON_DAYS, log=lambda message: None)
+
+def test_old_completed_appointments_move_with_their_rows(client, engine, appointments):
+    moved_id = appointments["old_done"][Appointments]
+    assert client.get(f"/appointments/{moved_id}").status_code == 200
+
+    moved = archive.run_archive(engine, HORIZON_DAYS, batch_size=1, log=lambda message: None, allow_stale_servers=True)
+    assert moved == 1
+    for name, rows in appointments.items():
+        expected = "archive" if name == "old_done" else "working"
+        for model, id in rows.items():
+            assert table_with(engine, model, id) == expected, (name, model.__tablename__)
+
+    # Перенесенный прием и медкарта видны только с ?include_archive=true
+    record_id = appointments["old_done"][Medical_Records]
+    assert client.get(f"/appointments/{moved_id}").status_code == 404
+    assert client.get(f"/medical_records/{record_id}").status_code == 404
+    moved_row = client.get(f"/appointments/{moved_id}", params={"include_archive": "true"}).json()
+    assert moved_row["id"] == moved_id
+    assert client.get(f"/medical_records/{record_id}", params={"include_archive": "true"}).status_code == 200
+    params = {"patient_id": moved_row["patient_id"], "limit": 1000}
+    assert moved_id not in {row["id"] for row in client.get("/appointments/", params=params).json()}
+    archived = client.get("/appointments/", params={**params, "include_archive": "true"}).json()
+    assert moved_id in {row["id"] for row in archived}
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+from sqlalchemy import select
+from sqlmodel import Session
+
+import bench
+import billing
+from models import Billing_Daily, Doctors, Service_Catalog
+
+
+def assert_rollup_matches_rebuild(engine):
+    """Сводка, которую вели приращениями, совпадает с пересобранной с нуля"""
+    columns = Billing_Daily.__table__.columns
+    with Session(engine) as session:
+        kept = session.execute(select(*columns).order_by(*columns)).all()
+        billing.rebuild(session)
+        rebuilt = session.execute(select(*columns).order_by(*columns)).all()
+        session.rollback()
+    assert kept == rebuilt
+
+
+def test_incremental_rollup_matches_rebuild_after_mixed_writes(client, engine):
+    with Session(engine) as session:
+        ctx = bench.Context(session)
+        service_ids = session.exec(select(Service_Catalog.id).order_by(Service_Catalog.duration_minutes, Service_Catalog.id).limit(2)).scalars().all()
+        department_ids = session.exec(select(Doctors.department_id).distinct()).scalars().all()
+    rng = random.Random(4)
+    slot = bench._free_slot(client, rng, ctx)
+    other = next((s for s in (bench._free_slot(client, rng, ctx) for _ in range(20))
+                  if s and s["doctor_id"] != slot["doctor_id"]), None)
+    if slot is None or other is None:
+        pytest.skip("no free slots for two doctors")
+    assert_rollup_matches_rebuild(engine)
+
+    appointment = client.post("/appointments/", json=slot).json()
+    record = client.post("/medical_records/", json={"appointment_id": appointment["id"], "complaints": "Тест"}).json()
+    services = client.post("/services_rendered/bulk", json=[
+        {"record_id": record["id"], "service_id": service_ids[0], "quantity": 1},
+        {"record_id": record["id"], "service_id": service_ids[-1], "quantity": 1}]).json()
+    price = client.get(f"/services/{service_ids[0]}").json()["price"]
+    department = client.get(f"/doctors/{other['doctor_id']}").json()["department_id"]
+    try:
+        assert_rollup_matches_rebuild(engine)
+        # Перенос к другому врачу на другой день, смена пациента и количества услуги
+        moved = client.patch(f"/appointments/{appointment['id']}",
+                             json={"doctor_id": other["doctor_id"], "datetime": other["datetime"]})
+        assert moved.status_code == 200, moved.text
+        assert client.patch(f"/appointments/{appointment['id']}", json={"patient_id": other["patient_id"]}).status_code == 200
+        assert client.patch(f"/services_rendered/{services[0]['id']}", json={"quantity": 5}).status_code == 200
+        assert_rollup_matches_rebuild(engine)
+
+        assert client.patch(f"/services/{service_ids[0]}", json={"price": "1234.50"}).status_code == 200
+        new_department = next((d for d in department_ids if d != department), department)
+        assert client.patch(f"/doctors/{other['doctor_id']}", json={"department_id": new_department}).status_code == 200
+        assert client.delete(f"/services_rendered/{services[1]['id']}").status_code == 200
+        assert_rollup_matches_rebuild(engine)
+    finally:
+        client.patch(f"/services/{service_ids[0]}", json={"price": price})
+        client.patch(f"/doctors/{other['doctor_id']}", json={"department_id": department})
+        client.request("DELETE", "/services_rendered/bulk", json=[service["id"] for service in services])
+        client.delete(f"/medical_records/{record['id']}")
+        client.delete(f"/appointments/{appointment['id']}")
+    assert_rollup_matches_rebuild(engine)
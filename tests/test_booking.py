@@ -0,0 +1,113 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session
+
+import bench
+from models import Appointments
+
+
+def test_booking_race_leaves_no_double_bookings(client, engine):
+    with Session(engine) as session:
+        ctx = bench.Context(session)
+    metrics, created = bench.booking_race(client, ctx, concurrency=8, seed=1)
+    try:
+        assert metrics["errors"] == 0
+        assert metrics["booked"] > 0 and metrics["rejected"] > 0
+        assert metrics["double_bookings"] == 0
+    finally:
+        client.request("DELETE", "/appointments/bulk", json=[id for _, id in created])
+
+
+def test_count_double_bookings_sees_overlap_written_past_checks(client, engine):
+    with Session(engine) as session:
+        ctx = bench.Context(session)
+    slot = bench._free_slot(client, random.Random(2), ctx)
+    booked = client.post("/appointments/", json=slot).json()
+    try:
+        with Session(engine) as session:
+            assert bench.count_double_bookings(session, [booked["id"]]) == 0
+            # Пересекающаяся запись мимо API: проверка booking.py ее не видит, подсчет — должен
+            start = datetime.fromisoformat(booked["datetime"])
+            session.add(Appointments(doctor_id=booked["doctor_id"], patient_id=booked["patient_id"],
+                                     datetime=start + timedelta(minutes=10)))
+            session.add(Appointments(doctor_id=booked["doctor_id"], patient_id=booked["patient_id"],
+                                     datetime=start + timedelta(minutes=bench.DEFAULT_APPOINTMENT_MINUTES)))
+            session.flush()
+            assert bench.count_double_bookings(session, [booked["id"]]) == 1
+            session.rollback()
+    finally:
+        client.delete(f"/appointments/{booked['id']}")
+
+
+@pytest.fixture
+def slots(client, engine):
+    """Три непересекающихся свободных слота одного врача в ближайшие недели"""
+    with Session(engine) as session:
+        ctx = bench.Context(session)
+    rng = random.Random(3)
+    for _ in range(50):
+        doctor_id = bench._doctor(rng, ctx)
+        start = datetime.now() + timedelta(days=rng.randint(1, 21))
+        found = client.get(f"/doctors/{doctor_id}/free-slots", params={
+            "from": start.isoformat(timespec="minutes"), "to": (start + bench.WEEK).isoformat(timespec="minutes")}).json()
+        if len(found) >= 5:
+            return [{"doctor_id": doctor_id, "patient_id": 1, "datetime": slot["start"]} for slot in found[:5:2]]
+    pytest.skip("no doctor with free slots")
+
+@pytest.fixture
+def booked(client, slots):
+    """Записи на первые два слота; третий остается свободным"""
+    ids = [client.post("/appointments/", json=slot).json()["id"] for slot in slots[:2]]
+    yield ids
+    client.request("DELETE", "/appointments/bulk", json=ids)
+
+
+def test_reschedule_into_occupied_slot_is_rejected(client, slots, booked):
+    response = client.patch(f"/appointments/{booked[1]}", json={"datetime": slots[0]["datetime"]})
+    assert response.status_code == 409
+    response = client.patch("/appointments/bulk", json=[{"id": booked[1], "datetime": slots[0]["datetime"]}])
+    assert response.status_code == 409
+    assert client.get(f"/appointments/{booked[1]}").json()["datetime"] == slots[1]["datetime"]
+
+def test_reschedule_into_free_slot_is_accepted(client, slots, booked):
+    response = client.patch(f"/appointments/{booked[1]}", json={"datetime": slots[2]["datetime"]})
+    assert response.status_code == 200
+    assert response.json()["datetime"] == slots[2]["datetime"]
+    response = client.patch("/appointments/bulk", json=[{"id": booked[1], "datetime": slots[1]["datetime"]}])
+    assert response.status_code == 200 and response.json()[0]["ok"]
+
+
+def free_starts(client, path: str, slot: dict, **params) -> list:
+    start = datetime.fromisoformat(slot["datetime"])
+    found = client.get(path, params={"from": (start - timedelta(hours=1)).isoformat(timespec="minutes"),
+                                     "to": (start + timedelta(hours=1)).isoformat(timespec="minutes"), **params})
+    assert found.status_code == 200, found.text
+    return [(row["doctor_id"], row["start"]) for row in found.json()]
+
+def test_booking_and_cancel_update_free_slots_at_once(client, slots):
+    path, slot = f"/doctors/{slots[2]['doctor_id']}/free-slots", slots[2]
+    key = (slot["doctor_id"], slot["datetime"])
+    assert key in free_starts(client, path, slot)
+    booked = client.post("/appointments/", json=slot).json()
+    try:
+        # Без ожидания AVAILABILITY_TTL_SECONDS: запись через API сбрасывает структуры врача
+        assert key not in free_starts(client, path, slot)
+    finally:
+        client.delete(f"/appointments/{booked['id']}")
+    assert key in free_starts(client, path, slot)
+
+def test_specialization_free_slots_merge_doctor_slots(client, slots):
+    specialization_id = client.get(f"/doctors/{slots[0]['doctor_id']}").json()["specialization_id"]
+    doctors = [row["id"] for row in client.get("/doctors/", params={"specialization_id": specialization_id,
+                                                                    "limit": 1000}).json()]
+    expected = sorted(slot for doctor_id in doctors
+                      for slot in free_starts(client, f"/doctors/{doctor_id}/free-slots", slots[0]))
+    path = f"/specializations/{specialization_id}/free-slots"
+    found = free_starts(client, path, slots[0], limit=1000)
+    assert (slots[0]["doctor_id"], slots[0]["datetime"]) in found
+    assert sorted(found) == expected
+    assert [start for _, start in found] == sorted(start for _, start in found)
+    limited = free_starts(client, path, slots[0], limit=2)
+    assert [start for _, start in limited] == [start for _, start in found][:2]
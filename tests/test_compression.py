@@ -0,0 +1,51 @@
+import gzip
+import json
+
+import pytest
+
+
+def _raw_get(client, path: str, **headers):
+    """Ответ и тело как пришло по сети — без распаковки на стороне httpx"""
+    with client.stream("GET", path, headers=headers) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_brotli_response_decodes_to_the_same_page(client):
+    brotli = pytest.importorskip("brotli")
+    plain = client.get("/patients/", params={"limit": 200}, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    response, raw = _raw_get(client, "/patients/?limit=200", **{"Accept-Encoding": "gzip, br"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "br"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert int(response.headers["content-length"]) == len(raw)
+    assert json.loads(brotli.decompress(raw)) == plain.json()
+
+
+def test_gzip_when_brotli_is_not_accepted(client):
+    response, raw = _raw_get(client, "/patients/?limit=200", **{"Accept-Encoding": "gzip, br;q=0"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(json.loads(gzip.decompress(raw))) == 200
+
+
+def test_small_responses_are_not_compressed(client):
+    response, raw = _raw_get(client, "/patients/?limit=1", **{"Accept-Encoding": "br"})
+    assert "content-encoding" not in response.headers
+    assert len(json.loads(raw)) == 1
+
+
+def test_etag_answers_304_until_the_table_changes(client):
+    first = client.get("/specializations/")
+    etag = first.headers["etag"]
+    assert client.get("/specializations/", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/specializations/", headers={"If-Modified-Since": first.headers["last-modified"]}).status_code == 304
+
+    created = client.post("/specializations/", json={"name": "Тест ETag"}).json()
+    try:
+        after = client.get("/specializations/", headers={"If-None-Match": etag})
+        assert after.status_code == 200
+        assert after.headers["etag"] != etag
+        assert created["id"] in [row["id"] for row in after.json()]
+    finally:
+        client.delete(f"/specializations/{created['id']}")
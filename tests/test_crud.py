@@ -0,0 +1,71 @@
+def test_bulk_patch_checks_versions_per_row(client):
+    created = client.post("/patients/bulk", json=[
+        {"last_name": f"Версия{n}", "first_name": "Тест", "birth_date": "1990-01-01"} for n in range(4)]).json()
+    ids = [patient["id"] for patient in created]
+    try:
+        results = client.patch("/patients/bulk", json=[
+            {"id": ids[0], "phone": "+70000000001", "version": 1},
+            {"id": ids[1], "phone": "+70000000002", "version": 7},
+            {"id": ids[2], "phone": "+70000000003"},
+            {"id": ids[3]},
+            {"id": 10**9, "phone": "+70000000004"},
+        ]).json()
+        assert [(r["ok"], r["detail"]) for r in results] == [
+            (True, None), (False, "Version conflict: current version is 1"), (True, None), (True, "No changes"),
+            (False, "Not found")]
+        rows = {id: client.get(f"/patients/{id}").json() for id in ids}
+        assert [rows[id]["version"] for id in ids] == [2, 1, 2, 1]
+        assert rows[ids[1]]["phone"] is None
+
+        # Устаревшая версия после успешной записи — конфликт, строка не меняется
+        results = client.patch("/patients/bulk", json=[{"id": ids[0], "phone": "+70000000009", "version": 1}]).json()
+        assert results[0]["ok"] is False
+        assert client.get(f"/patients/{ids[0]}").json()["phone"] == "+70000000001"
+
+        # Один id дважды в пачке — 422 до записи, даже если каждая запись по отдельности прошла бы
+        response = client.patch("/patients/bulk", json=[{"id": ids[0], "phone": "+70000000005", "version": 2},
+                                                        {"id": ids[0], "phone": "+70000000006", "version": 2}])
+        assert response.status_code == 422
+        assert client.get(f"/patients/{ids[0]}").json()["version"] == 2
+    finally:
+        client.request("DELETE", "/patients/bulk", json=ids)
+
+
+def test_create_rejects_values_the_table_model_cannot_parse(client):
+    prescription = {"drug_name": "Тест", "dosage": "1 таб.", "duration_days": 5}
+    response = client.post("/prescriptions/", json=dict(prescription, duration_days="abc"))
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "duration_days"]
+
+    # Пачка проверяется целиком до INSERT: ошибки всех записей, ни одна не записана
+    before = client.get("/prescriptions/", params={"limit": 1, "desc": True}).json()
+    response = client.post("/prescriptions/bulk", json=[
+        prescription, dict(prescription, duration_days="abc"), dict(prescription, duration_days="x")])
+    assert response.status_code == 422
+    assert [error["loc"] for error in response.json()["detail"]] == [["body", 1, "duration_days"], ["body", 2, "duration_days"]]
+    assert client.get("/prescriptions/", params={"limit": 1, "desc": True}).json() == before
+
+
+def test_order_by_cursor_survives_deleting_the_cursor_row(client):
+    created = client.post("/patients/bulk", json=[
+        {"last_name": "Курсор", "first_name": "Тест", "birth_date": f"19{80 - n}-01-01"} for n in range(5)]).json()
+    ids = [patient["id"] for patient in created]
+    params = {"last_name": "Курсор", "order_by": "birth_date", "limit": 2}
+    try:
+        first = client.get("/patients/", params=params)
+        assert [row["id"] for row in first.json()] == [ids[4], ids[3]]
+        cursor = first.headers["x-next-cursor"]
+        client.delete(f"/patients/{ids[3]}")
+
+        second = client.get("/patients/", params=dict(params, cursor=cursor))
+        assert [row["id"] for row in second.json()] == [ids[2], ids[1]]
+        third = client.get("/patients/", params=dict(params, cursor=second.headers["x-next-cursor"]))
+        assert [row["id"] for row in third.json()] == [ids[0]]
+        assert "x-next-cursor" not in third.headers
+
+        # Курсор другой сортировки и id вместо курсора при order_by — ошибка, а не пустая страница
+        assert client.get("/patients/", params=dict(params, cursor=cursor, desc=True)).status_code == 422
+        assert client.get("/patients/", params=dict(params, cursor="bm90IGpzb24")).status_code == 422
+        assert client.get("/patients/", params=dict(params, after_id=ids[3])).status_code == 422
+    finally:
+        client.request("DELETE", "/patients/bulk", json=ids)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import main
+from feed import change_feed
+
+PATH = "/specializations/"
+
+
+def parse(chunk: str) -> list:
+    """Сообщения SSE из куска тела: [{"id": ..., "event": ..., "data": ...}], комментарии и retry пропускаются"""
+    messages = []
+    for block in chunk.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            messages.append({"id": fields.get("id"), "event": fields["event"], "data": json.loads(fields["data"])})
+    return messages
+
+async def listen(count: int, last_event_id: str = None, writes=None) -> list:
+    """Подключается к /changes напрямую через ASGI, выполняет writes() в потоке и ждет count сообщений.
+    TestClient для бесконечного потока не годится: он ждет конца ответа"""
+    headers = [(b"host", b"testserver")]
+    if last_event_id is not None:
+        headers.append((b"last-event-id", last_event_id.encode()))
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/changes", "raw_path": b"/changes", "query_string": b"tables=specializations", "root_path": "",
+             "headers": headers, "client": ("testclient", 50000), "server": ("testserver", 80)}
+    chunks, received, disconnected, requested = asyncio.Queue(), [], asyncio.Event(), False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            await chunks.put(message["body"].decode())
+
+    task = asyncio.create_task(main.app(scope, receive, send))
+    try:
+        assert (await asyncio.wait_for(chunks.get(), 5)).startswith("retry:")  # подписчик уже зарегистрирован
+        if writes is not None:
+            await asyncio.to_thread(writes)
+        while len(received) < count:
+            received.extend(parse(await asyncio.wait_for(chunks.get(), 5)))
+    finally:
+        disconnected.set()
+        await asyncio.wait_for(task, 5)
+    return received
+
+
+def test_crud_writes_stream_and_replay_after_reconnect(client):
+    created = {}
+
+    def writes():
+        created.update(client.post(PATH, json={"name": "Лента"}).json())
+        assert client.patch(f"{PATH}{created['id']}", json={"name": "Лента изменена"}).status_code == 200
+
+    try:
+        first, second = asyncio.run(listen(2, writes=writes))
+        assert [first["event"], second["event"]] == ["change", "change"]
+        assert (first["data"]["op"], first["data"]["ids"]) == ("create", [created["id"]])
+        assert (second["data"]["op"], second["data"]["rows"][0]["name"]) == ("update", "Лента изменена")
+
+        # Переподключение с Last-Event-ID первого события: второе приходит повторно из истории
+        [replayed] = asyncio.run(listen(1, last_event_id=first["id"]))
+        assert replayed == second
+
+        # Номер из другой эпохи (другой процесс или перезапуск) — повтор невозможен, только resync
+        epoch, _, number = second["id"].partition(":")
+        assert epoch == change_feed.event_id(0).partition(":")[0]
+        for foreign in (f"{'0' * len(epoch)}:{number}", f"{epoch}:{int(number) + 1000}"):
+            [resync] = asyncio.run(listen(1, last_event_id=foreign))
+            assert (resync["event"], resync["data"]) == ("resync", {"table": None})
+    finally:
+        if created:
+            client.delete(f"{PATH}{created['id']}")
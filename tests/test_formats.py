@@ -0,0 +1,82 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+from pydantic_core import from_json
+
+import formats
+from formats import ARROW, COLUMNAR_JSON, JSON, MSGPACK, negotiate
+
+# Таблицы с датами, временем и Decimal: у них текстовое представление и типы Arrow отличаются от JSON
+PATHS = ["/doctors/", "/services/", "/appointments/", "/schedules/"]
+
+
+def page(client, path: str, accept: str) -> tuple:
+    response = client.get(path, params={"limit": 20}, headers={"Accept": accept})
+    assert response.status_code == 200, response.text
+    return response.headers["content-type"], response.content
+
+def rows_from_columns(columns: dict) -> list:
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+def as_json(value):
+    """Значение из Arrow в виде, как в JSON-ответе"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return value
+
+def json_rows(client, path: str) -> list:
+    content_type, body = page(client, path, JSON)
+    assert content_type == JSON
+    rows = from_json(body)
+    assert rows
+    return rows
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_columnar_json_matches_json_page(client, path):
+    content_type, body = page(client, path, COLUMNAR_JSON)
+    assert content_type == COLUMNAR_JSON
+    assert rows_from_columns(from_json(body)) == json_rows(client, path)
+
+@pytest.mark.parametrize("path", PATHS)
+def test_msgpack_matches_json_page(client, path):
+    msgpack = pytest.importorskip("msgpack")
+    content_type, body = page(client, path, MSGPACK)
+    assert content_type == MSGPACK
+    assert rows_from_columns(msgpack.unpackb(body, raw=False)) == json_rows(client, path)
+
+@pytest.mark.parametrize("path", PATHS)
+def test_arrow_matches_json_page(client, path):
+    pa = pytest.importorskip("pyarrow")
+    content_type, body = page(client, path, ARROW)
+    assert content_type == ARROW
+    decoded = pa.ipc.open_stream(body).read_all().to_pylist()
+    expected = json_rows(client, path)
+    assert [list(row) for row in decoded] == [list(row) for row in expected]
+    for got, want in zip(decoded, expected):
+        for name, value in got.items():
+            if isinstance(value, Decimal):
+                assert value == Decimal(want[name]), name
+            else:
+                assert as_json(value) == want[name], name
+
+
+def test_accept_negotiation(client):
+    assert negotiate("") == negotiate("*/*") == negotiate("text/html") == JSON
+    assert negotiate(f"{COLUMNAR_JSON}") == COLUMNAR_JSON
+    assert negotiate(f"{JSON};q=0.5, {COLUMNAR_JSON}") == COLUMNAR_JSON
+    assert negotiate(f"{COLUMNAR_JSON};q=0.2, {JSON};q=0.9") == JSON
+    assert negotiate(f"{COLUMNAR_JSON};q=0, text/html") == JSON
+    # При равном q — первый из перечисленных
+    assert negotiate(f"{COLUMNAR_JSON}, {JSON}") == COLUMNAR_JSON
+
+    if formats._AVAILABLE[MSGPACK]:
+        assert negotiate("application/x-msgpack") == MSGPACK
+    else:
+        assert negotiate(f"{MSGPACK}, {COLUMNAR_JSON};q=0.5") == COLUMNAR_JSON
+
+    # Один адрес, разные форматы: кэш страниц и ETag не смешивают ответы
+    response = client.get("/doctors/", params={"limit": 5}, headers={"Accept": "text/html"})
+    assert response.headers["content-type"] == JSON and "Accept" in response.headers["vary"]
+    assert page(client, "/doctors/", f"{JSON};q=0.1, {COLUMNAR_JSON}")[0] == COLUMNAR_JSON
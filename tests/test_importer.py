@@ -0,0 +1,107 @@
+import pytest
+from sqlalchemy import delete, select
+from sqlmodel import Session
+
+import importer
+from models import (Appointment_Statuses, Appointments, Departments, Diagnoses, Doctors, Insurance_Policies,
+                    Medical_Records, Patients, Specializations)
+from versions import table_versions
+
+
+def run(engine, kind: str, rows: list, batch_size: int = 1000) -> tuple:
+    messages = []
+    loaded, rejected, _ = importer.import_rows(kind, rows, engine=engine, batch_size=batch_size, log=messages.append)
+    return loaded, rejected, messages
+
+def policy(number: str) -> dict:
+    return {"policy_number": number, "company_name": "Тест", "expiration_date": "2030-01-01"}
+
+
+@pytest.fixture
+def cleanup(engine):
+    """Удаляет после теста строки, загруженные с меткой «Импорт»"""
+    yield
+    with Session(engine) as session:
+        patients = select(Patients.id).where(Patients.last_name.like("Импорт%"))
+        appointments = select(Appointments.id).where(Appointments.patient_id.in_(patients))
+        session.execute(delete(Medical_Records).where(Medical_Records.appointment_id.in_(appointments)))
+        session.execute(delete(Appointments).where(Appointments.id.in_(appointments)))
+        session.execute(delete(Patients).where(Patients.id.in_(patients)))
+        session.execute(delete(Doctors).where(Doctors.last_name.like("Импорт%")))
+        session.execute(delete(Insurance_Policies).where(Insurance_Policies.policy_number.like("IMP-%")))
+        session.execute(delete(Diagnoses).where(Diagnoses.mkb_code.like("IMP%")))
+        session.commit()
+
+
+def test_duplicate_policy_numbers_are_rejected_across_batches(engine, cleanup):
+    loaded, rejected, messages = run(engine, "policies", [policy("IMP-1"), policy("IMP-2"), policy("IMP-1")], batch_size=2)
+    assert (loaded, rejected) == (2, 1)
+    assert any("IMP-1" in message for message in messages)
+    # Повторная загрузка: номера уже в БД, дубль внутри пачки — тоже отбраковка
+    assert run(engine, "policies", [policy("IMP-2"), policy("IMP-3"), policy("IMP-3")])[:2] == (1, 2)
+
+def test_duplicate_diagnosis_codes_are_rejected(engine, cleanup):
+    rows = [{"mkb_code": "IMP.1", "description": "Тест"}, {"mkb_code": "IMP.1", "description": "Дубль"}]
+    assert run(engine, "diagnoses", rows)[:2] == (1, 1)
+    assert run(engine, "diagnoses", rows[:1])[:2] == (0, 1)
+
+
+def test_natural_keys_are_resolved_and_unknown_keys_rejected(engine, cleanup):
+    with Session(engine) as session:
+        specialization = session.exec(select(Specializations)).scalars().first()
+        department = session.exec(select(Departments)).scalars().first()
+        status = session.exec(select(Appointment_Statuses)).scalars().first()
+    run(engine, "policies", [policy("IMP-10"), policy("IMP-11")])
+    run(engine, "diagnoses", [{"mkb_code": "IMP.10", "description": "Тест"}])
+
+    loaded, rejected, _ = run(engine, "patients", [
+        {"last_name": "Импортов", "first_name": "Тест", "birth_date": "1990-01-01", "policy_number": "IMP-10"},
+        {"last_name": "Импортов", "first_name": "Без полиса", "birth_date": "1990-01-01", "policy_number": "IMP-404"}])
+    assert (loaded, rejected) == (1, 1)
+    loaded, rejected, _ = run(engine, "doctors", [
+        {"last_name": "Импортер", "first_name": "Тест", "specialization": specialization.name, "department": department.name},
+        {"last_name": "Импортер", "first_name": "Нет", "specialization": specialization.name, "department": "Нет такого"}])
+    assert (loaded, rejected) == (1, 1)
+    loaded, rejected, _ = run(engine, "appointments", [
+        {"patient_policy_number": "IMP-10", "doctor_last_name": "Импортер", "doctor_first_name": "Тест",
+         "datetime": "2001-02-03T10:00", "status": status.name, "mkb_code": "IMP.10", "complaints": "Тест"},
+        {"patient_policy_number": "IMP-10", "doctor_last_name": "Импортер", "doctor_first_name": "Другой",
+         "datetime": "2001-02-03T11:00", "status": status.name},
+        {"patient_policy_number": "IMP-11", "doctor_last_name": "Импортер", "doctor_first_name": "Тест",
+         "datetime": "2001-02-03T12:00", "status": status.name}])
+    # Второй — неизвестный врач, третий — полис без пациента
+    assert (loaded, rejected) == (1, 2)
+
+    with Session(engine) as session:
+        patient = session.exec(select(Patients).where(Patients.last_name == "Импортов")).scalars().one()
+        doctor = session.exec(select(Doctors).where(Doctors.last_name == "Импортер")).scalars().one()
+        appointment = session.exec(select(Appointments).where(Appointments.patient_id == patient.id)).scalars().one()
+        record = session.exec(select(Medical_Records).where(Medical_Records.appointment_id == appointment.id)).scalars().one()
+        diagnosis_id = session.exec(select(Diagnoses.id).where(Diagnoses.mkb_code == "IMP.10")).scalars().one()
+    assert patient.policy_id is not None
+    assert (doctor.specialization_id, doctor.department_id) == (specialization.id, department.id)
+    assert (appointment.doctor_id, appointment.status_id) == (doctor.id, status.id)
+    assert (record.diagnosis_id, record.complaints) == (diagnosis_id, "Тест")
+
+
+def test_multi_batch_load_and_notification_after_a_failed_batch(engine, cleanup, monkeypatch):
+    loaded, rejected, messages = run(engine, "policies", [policy(f"IMP-2{n}") for n in range(5)], batch_size=2)
+    assert (loaded, rejected) == (5, 0)
+    assert len([m for m in messages if m.startswith("policies:")]) == 3
+
+    # Вторая пачка падает: первая уже зафиксирована, и о ней узнают версии таблиц
+    write_batch, calls = importer.write_batch, []
+    def failing_write_batch(*args):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("сбой пачки")
+        write_batch(*args)
+    monkeypatch.setattr(importer, "write_batch", failing_write_batch)
+    before = table_versions.version("insurance_policies")[0]
+    with pytest.raises(RuntimeError):
+        run(engine, "policies", [policy(f"IMP-3{n}") for n in range(4)], batch_size=2)
+    assert table_versions.version("insurance_policies")[0] > before
+    with Session(engine) as session:
+        numbers = session.exec(select(Insurance_Policies.policy_number)
+                               .where(Insurance_Policies.policy_number.like("IMP-3%"))).scalars().all()
+    assert sorted(numbers) == ["IMP-30", "IMP-31"]
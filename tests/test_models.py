@@ -0,0 +1,30 @@
+from sqlalchemy import create_engine, inspect
+from sqlmodel import SQLModel
+
+from models import create_missing_indexes
+
+
+def existing_indexes(engine) -> dict:
+    inspector = inspect(engine)
+    return {table.name: {index["name"] for index in inspector.get_indexes(table.name)}
+            for table in SQLModel.metadata.sorted_tables}
+
+def declared_indexes() -> dict:
+    return {table.name: {index.name for index in table.indexes} for table in SQLModel.metadata.sorted_tables}
+
+
+def test_missing_indexes_are_created_in_an_old_database(tmp_path):
+    # Старая БД: таблицы есть, объявленных в моделях индексов нет
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    SQLModel.metadata.create_all(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=engine)
+    assert not any(existing_indexes(engine)[name] & declared for name, declared in declared_indexes().items())
+
+    create_missing_indexes(engine)
+    create_missing_indexes(engine)  # повторный запуск ничего не ломает
+    existing = existing_indexes(engine)
+    for name, declared in declared_indexes().items():
+        assert declared <= existing[name], name
+    engine.dispose()
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import delete, event, select
+from sqlmodel import Session
+
+from models import Appointments, Medical_Records, Prescriptions, Services_Rendered, Service_Catalog
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+    def on_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+
+@pytest.fixture
+def records(engine):
+    """Медкарты с 1 и 30 назначениями (и двумя услугами) на приемах в прошлом"""
+    ids = {}
+    with Session(engine) as session:
+        service_id = session.exec(select(Service_Catalog.id).limit(1)).scalar()
+        for prescriptions in (1, 30):
+            appointment = Appointments(doctor_id=1, patient_id=1, datetime=datetime(2001, 1, prescriptions, 10))
+            session.add(appointment)
+            session.flush()
+            record = Medical_Records(appointment_id=appointment.id, complaints="Тест")
+            session.add(record)
+            session.flush()
+            session.add_all(Prescriptions(record_id=record.id, drug_name=f"Препарат {n}", dosage="1 таб.", duration_days=5)
+                            for n in range(prescriptions))
+            session.add_all(Services_Rendered(record_id=record.id, service_id=service_id, quantity=1) for _ in range(2))
+            ids[prescriptions] = (appointment.id, record.id)
+        session.commit()
+    yield {count: record_id for count, (_, record_id) in ids.items()}
+    with Session(engine) as session:
+        record_ids = [record_id for _, record_id in ids.values()]
+        session.execute(delete(Prescriptions).where(Prescriptions.record_id.in_(record_ids)))
+        session.execute(delete(Services_Rendered).where(Services_Rendered.record_id.in_(record_ids)))
+        session.execute(delete(Medical_Records).where(Medical_Records.id.in_(record_ids)))
+        session.execute(delete(Appointments).where(Appointments.id.in_([id for id, _ in ids.values()])))
+        session.commit()
+
+
+def test_record_details_statement_count_does_not_grow_with_prescriptions(client, engine, records):
+    counts = {}
+    for prescriptions, record_id in records.items():
+        with count_statements(engine) as statements:
+            response = client.get(f"/medical_records/{record_id}/details")
+        assert response.status_code == 200
+        assert len(response.json()["prescriptions"]) == prescriptions
+        assert len(response.json()["services"]) == 2
+        counts[prescriptions] = len(statements)
+    assert counts == {1: 3, 30: 3}
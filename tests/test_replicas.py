@@ -0,0 +1,69 @@
+from time import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlmodel import Session, SQLModel
+
+import database
+import replicas
+from models import Specializations
+
+REPLICA_NAME = "Только на реплике"
+
+
+@pytest.fixture
+def replica(client, tmp_path, monkeypatch):
+    """Реплика-заглушка: отдельная БД SQLite, отставание задает тест (поток проверок не запущен)"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Specializations(name=REPLICA_NAME))
+        session.commit()
+    async_engine = None
+    if database.DB_ASYNC:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        async_engine = create_async_engine(database.async_database_url(str(engine.url)))
+    stub = replicas.Replica("stub", engine, async_engine)
+    monkeypatch.setattr(replicas.replicas, "replicas", [stub])
+    monkeypatch.setattr(replicas.replicas, "primary_reads", dict.fromkeys(replicas.replicas.primary_reads, 0))
+    yield stub
+    client.cookies.clear()
+    engine.dispose()
+    if async_engine is not None:
+        client.portal.call(async_engine.dispose)
+
+def set_lag(replica, lag: float):
+    replica.state = (True, lag, time(), None)
+
+def names(client, path: str, limit: int) -> set:
+    # Свой limit у каждого запроса: ответ не берется из кэша, заполненного другим запросом
+    response = client.get(path, params={"limit": limit})
+    assert response.status_code == 200, response.text
+    return {row["name"] for row in response.json()}
+
+
+def test_lagging_replica_falls_back_to_primary(client, replica):
+    set_lag(replica, replicas.REPLICA_MAX_LAG_SECONDS + 10)
+    assert REPLICA_NAME not in names(client, "/specializations/", 901)
+    assert replica.reads == 0 and replicas.replicas.primary_reads["no_usable_replica"] == 1
+    assert client.get("/db/replicas").json()["replicas"][0]["usable"] is False
+
+    set_lag(replica, 0)
+    assert names(client, "/specializations/", 902) == {REPLICA_NAME}
+    assert replica.reads == 1
+
+def test_client_reads_its_own_write_from_primary(client, replica):
+    set_lag(replica, 0)
+    created = client.post("/departments/", json={"name": "Чтение своих записей"})
+    assert created.status_code == 200, created.text
+    assert replicas.WRITE_COOKIE in client.cookies
+    try:
+        # Кука новее горизонта реплики: и чтение другой таблицы идет с первичной БД
+        assert names(client, "/specializations/", 903) - {REPLICA_NAME}
+        assert replica.reads == 0 and replicas.replicas.primary_reads["recent_write"] == 1
+
+        client.cookies.clear()
+        assert names(client, "/specializations/", 904) == {REPLICA_NAME}
+        assert replica.reads == 1
+    finally:
+        client.delete(f"/departments/{created.json()['id']}")
@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import select
+from sqlmodel import Session
+
+from models import Insurance_Policies, Patients
+
+PATH = "/patients/search"
+
+
+def search(client, q: str, limit: int = 100) -> list:
+    response = client.get(PATH, params={"q": q, "limit": limit})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+@pytest.fixture
+def patient(engine):
+    with Session(engine) as session:
+        return session.execute(select(Patients.id, Patients.last_name, Patients.first_name, Insurance_Policies.policy_number)
+                               .join(Insurance_Policies, Insurance_Policies.id == Patients.policy_id)
+                               .order_by(Patients.id).limit(1)).one()
+
+
+def test_surname_fragment_finds_patient(client, patient):
+    # Середина фамилии (по триграммам) и начало фамилии (короче трех символов), в другом регистре, вместе с именем
+    for fragment in (patient.last_name[1:4].upper(), patient.last_name[:2].lower()):
+        found = search(client, f"{fragment} {patient.first_name}")
+        assert patient.id in [row["id"] for row in found], fragment
+        assert all(fragment.lower() in row["last_name"].lower() or fragment.lower() in (row["middle_name"] or "").lower()
+                   or fragment.lower() in row["first_name"].lower() or fragment.lower() in (row["phone"] or "")
+                   or fragment.lower() in (row["policy_number"] or "").lower() for row in found)
+
+def test_exact_surname_ranks_first_and_policy_fragment_matches(client, patient):
+    found = search(client, f"{patient.last_name} {patient.first_name}")
+    assert found[0]["last_name"] == patient.last_name and found[0]["score"] == max(row["score"] for row in found)
+    assert patient.id in [row["id"] for row in search(client, patient.policy_number[-6:])]
+
+def test_new_and_renamed_patients_are_searchable(client):
+    created = client.post("/patients/", json={"last_name": "Поисковая", "first_name": "Тест", "birth_date": "1990-01-01"})
+    assert created.status_code == 200, created.text
+    patient_id = created.json()["id"]
+    try:
+        assert [row["id"] for row in search(client, "исков")] == [patient_id]
+        assert client.patch(f"/patients/{patient_id}", json={"last_name": "Найденная"}).status_code == 200
+        assert search(client, "исков") == []
+        assert [row["id"] for row in search(client, "найден")] == [patient_id]
+    finally:
+        client.delete(f"/patients/{patient_id}")
+    assert search(client, "найден") == []
+    assert client.get(PATH, params={"q": ""}).status_code == 422
@@ -0,0 +1,41 @@
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlmodel import Session
+
+import main
+from models import Appointments, Doctors
+
+
+def test_stats_match_direct_counts(client, engine):
+    date_from, date_to = date.today() - timedelta(days=30), date.today()
+    with Session(engine) as session:
+        rows = session.execute(select(Appointments.status_id, Appointments.doctor_id, Doctors.specialization_id,
+                                      Appointments.datetime)
+                               .outerjoin(Doctors, Doctors.id == Appointments.doctor_id)
+                               .where(Appointments.datetime >= datetime.combine(date_from, datetime.min.time()),
+                                      Appointments.datetime < datetime.combine(date_to + timedelta(days=1),
+                                                                               datetime.min.time()))).all()
+        stats = main.compute_stats(session, date_from, date_to)
+    assert rows and stats.total == len(rows)
+    assert {b.id: b.count for b in stats.by_status} == Counter(row[0] for row in rows)
+    assert {b.id: b.count for b in stats.by_doctor} == Counter(row[1] for row in rows)
+    assert {b.id: b.count for b in stats.by_specialization} == Counter(row[2] for row in rows)
+    assert {str(b.day): b.count for b in stats.by_day} == Counter(str(row[3].date()) for row in rows)
+    assert [b.count for b in stats.by_doctor] == sorted((b.count for b in stats.by_doctor), reverse=True)
+
+    response = client.get("/stats/", params={"date_from": str(date_from), "date_to": str(date_to)})
+    assert response.status_code == 200 and response.json()["total"] == len(rows)
+
+
+def test_stats_cache_evicts_least_recently_read(client, monkeypatch):
+    monkeypatch.setattr(main, "STATS_CACHE_SIZE", 2)
+    monkeypatch.setattr(main, "_stats_cache", type(main._stats_cache)())
+    days = [str(date.today() - timedelta(days=n)) for n in range(3)]
+    for day in days[:2]:
+        assert client.get("/stats/", params={"date_from": day, "date_to": day}).status_code == 200
+    # Повторное чтение первого окна делает вытесняемым второе
+    client.get("/stats/", params={"date_from": days[0], "date_to": days[0]})
+    client.get("/stats/", params={"date_from": days[2], "date_to": days[2]})
+    assert [str(key[0]) for key in main._stats_cache] == [days[0], days[2]]
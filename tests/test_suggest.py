@@ -0,0 +1,37 @@
+from sqlalchemy import select
+from sqlmodel import Session
+
+from models import Diagnoses
+from suggest import normalize_code
+
+PATH = "/diagnoses/suggest"
+
+
+def suggest(client, prefix: str, limit: int = 50) -> list:
+    response = client.get(PATH, params={"prefix": prefix, "limit": limit})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_code_prefix_finds_diagnoses(client, engine):
+    with Session(engine) as session:
+        codes = session.exec(select(Diagnoses.mkb_code)).scalars().all()
+    code = sorted(codes)[len(codes) // 2]
+    # Один символ — готовый список, три — бинарный поиск; точку и регистр пользователи пишут по-разному
+    for prefix in (code[0], code[:3], code[:3].lower(), code.replace(".", ""), code.replace(".", ",")):
+        found = suggest(client, prefix)
+        assert found and all(normalize_code(row["mkb_code"]).startswith(normalize_code(prefix)) for row in found), prefix
+        expected = sorted(c for c in codes if normalize_code(c).startswith(normalize_code(prefix)))[:50]
+        assert sorted(row["mkb_code"] for row in found) == expected, prefix
+
+def test_new_diagnosis_is_suggested_after_post(client):
+    assert suggest(client, "Z99.9") == []
+    created = client.post("/diagnoses/", json={"mkb_code": "Z99.9", "description": "Подсказка после записи"})
+    assert created.status_code == 200, created.text
+    try:
+        # Снимок перестраивается при следующем запросе: сменились поколение и версия таблицы
+        assert [row["id"] for row in suggest(client, "Z99")] == [created.json()["id"]]
+        assert [row["mkb_code"] for row in suggest(client, "подсказка после")] == ["Z99.9"]
+    finally:
+        client.delete(f"/diagnoses/{created.json()['id']}")
+    assert suggest(client, "Z99") == []
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlmodel import Session
+
+import sync
+from crud import NEXT_CURSOR_HEADER, SYNC_TOKEN_HEADER
+from models import Specializations, Tombstones, utc_now
+
+PATH = "/specializations/"
+
+
+def full_load(client) -> tuple:
+    """Первая загрузка клиента: все страницы списка и токен с первой из них"""
+    copy, params, token = {}, {"limit": 1000}, None
+    while True:
+        response = client.get(PATH, params=params)
+        token = token or response.headers[SYNC_TOKEN_HEADER]
+        copy.update({row["id"]: row for row in response.json()})
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return copy, token
+        params = {"limit": 1000, "after_id": cursor}
+
+def apply_changes(client, copy: dict, token: str, limit: int) -> tuple:
+    """Синхронизация по страницам ?updated_since=, как описано в sync.py. Возвращает (токен, число страниц)"""
+    pages = 0
+    while True:
+        body = client.get(PATH, params={"updated_since": token, "limit": limit}).json()
+        for id in body["deleted"]:
+            copy.pop(id, None)
+        copy.update({row["id"]: row for row in body["changed"]})
+        token, pages = body["next_token"], pages + 1
+        if not body["has_more"]:
+            return token, pages
+
+
+def test_client_copy_converges_through_small_pages(client, engine):
+    copy, token = full_load(client)
+    created = client.post(f"{PATH}bulk", json=[{"name": f"Синхронизация {n}"} for n in range(5)]).json()
+    ids = [row["id"] for row in created]
+    try:
+        assert client.delete(f"{PATH}{ids[3]}").status_code == 200
+        # Три изменения и удаление с одним временем: порядок на стыке страниц — по (время, вид, id)
+        moment = utc_now()
+        with Session(engine) as session:
+            session.execute(update(Specializations).where(Specializations.id.in_(ids[:3])).values(updated_at=moment))
+            session.execute(update(Tombstones).where(Tombstones.table_name == "specializations",
+                                                     Tombstones.row_id == ids[3]).values(deleted_at=moment))
+            session.commit()
+        assert client.patch(f"{PATH}{ids[4]}", json={"name": "Синхронизация изменена"}).status_code == 200
+
+        token, pages = apply_changes(client, copy, token, limit=2)
+        assert pages > 2
+        assert copy == full_load(client)[0]
+        assert ids[3] not in copy and copy[ids[4]]["name"] == "Синхронизация изменена"
+
+        # Следующая синхронизация, затем повтор с тем же токеном: строки на стыке приходят снова, копия не портится
+        assert client.delete(f"{PATH}{ids[0]}").status_code == 200
+        apply_changes(client, copy, token, limit=2)
+        apply_changes(client, copy, token, limit=1000)
+        assert copy == full_load(client)[0]
+    finally:
+        client.request("DELETE", f"{PATH}bulk", json=ids)
+
+
+def test_expired_and_invalid_tokens(client):
+    expired = sync._encode_token(datetime(2000, 1, 1), sync.CHANGED, 0, None)
+    assert client.get(PATH, params={"updated_since": expired}).status_code == 410
+    assert client.get(PATH, params={"updated_since": "not-a-token"}).status_code == 422
+    _, token = full_load(client)
+    assert client.get(PATH, params={"updated_since": token, "after_id": 1}).status_code == 422
+    assert client.get(PATH, params={"updated_since": token}).json()["has_more"] is False
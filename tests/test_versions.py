@@ -0,0 +1,34 @@
+from email.utils import formatdate
+
+import versions
+from versions import MemoryVersionsBackend, TableVersions, _not_modified_since
+
+
+def test_memory_validators_change_with_the_ttl_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(versions, "time", lambda: now[0])
+    table_versions = TableVersions(MemoryVersionsBackend(60))
+    table_versions.bump("patients")
+    etag, modified = table_versions.validators(("patients",))
+    assert modified == 1000.0
+
+    now[0] = 1019.0
+    assert table_versions.validators(("patients",)) == (etag, modified)
+
+    # Новое окно: запись через другой воркер здесь не видна, поэтому старые ETag и Last-Modified не подходят
+    now[0] = 1021.0
+    next_etag, next_modified = table_versions.validators(("patients",))
+    assert next_etag != etag
+    assert next_modified == 1020.0
+    assert not _not_modified_since(formatdate(modified, usegmt=True), next_modified)
+
+
+def test_zero_ttl_never_revalidates(client, monkeypatch):
+    backend = MemoryVersionsBackend(0)
+    table_versions = TableVersions(backend)
+    table_versions.validators(("specializations",))
+    assert table_versions.last_write(("specializations",)) == 0.0
+
+    monkeypatch.setattr(versions.table_versions, "backend", backend)
+    etag = client.get("/specializations/").headers["etag"]
+    assert client.get("/specializations/", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,164 @@
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from hashlib import blake2b
+from time import time
+from uuid import uuid4
+
+from fastapi import HTTPException, Request
+
+from cache import CACHE_BACKEND, CACHE_URL, CACHE_TTL_SECONDS
+
+# ===================================================================================
+# --- ВЕРСИИ ТАБЛИЦ И УСЛОВНЫЕ GET ---
+# ===================================================================================
+# Каждая запись через crud_router увеличивает номер версии таблицы и запоминает время записи
+# (write_listener bump). Эндпоинт чтения объявляет, от каких таблиц зависит его ответ:
+#   @app.get(..., dependencies=[Depends(table_versions.conditional("patients", ...))])
+# По версиям этих таблиц еще до обращения к БД вычисляются слабый ETag и Last-Modified.
+# Если If-None-Match совпал (или, когда его нет, If-Modified-Since не старше последней записи) —
+# ответ 304 без тела и без запросов к БД. Ответы с ETag помечаются Cache-Control: no-cache:
+# браузер хранит их, но перед использованием переспрашивает сервер.
+# С CACHE_BACKEND=redis версии общие для всех воркеров (тот же CACHE_URL). Иначе у каждого процесса свои,
+# и запись через соседний воркер здесь не видна — поэтому в этом режиме ETag и Last-Modified дополнительно
+# меняются раз в CACHE_TTL_SECONDS: ответ устаревает не дольше, чем memory-кэш ответов. При CACHE_TTL_SECONDS=0
+# (memory-кэш не хранит ответы) этот режим не отвечает 304 совсем.
+# Эндпоинты, ответ которых зависит от текущего времени (свободные слоты) или кэшируется по TTL (/stats/),
+# условными не делаются.
+
+VALIDATORS_STATE = "validators"  # ключ scope["state"]: заголовки для ответа 200
+
+
+class MemoryVersionsBackend:
+    """Версии в памяти процесса. Запись через другой процесс здесь не видна, поэтому версии действительны
+    только до конца текущего окна в ttl секунд"""
+    def __init__(self, ttl: int):
+        self._lock = threading.Lock()
+        self._versions = {}  # таблица -> (номер, время записи)
+        self._epoch = uuid4().hex
+        self.ttl = ttl
+        self.started = time()
+        self.revalidates = ttl > 0
+
+    def bump(self, table: str):
+        with self._lock:
+            number, _ = self._versions.get(table, (0, None))
+            self._versions[table] = (number + 1, time())
+
+    def read(self, tables: tuple) -> tuple:
+        """(эпоха, [(номер, время записи или None)], начало окна) — эпоха меняется при потере счетчиков
+        и с каждым окном ttl"""
+        now = time()
+        window = int(now // self.ttl) if self.ttl > 0 else 0
+        since = window * self.ttl if self.ttl > 0 else now
+        return f"{self._epoch}:{window}", [self._versions.get(t, (0, None)) for t in tables], since
+
+class RedisVersionsBackend:
+    """Версии в Redis: одни на все воркеры и на процессы импорта"""
+    def __init__(self, url: str):
+        import redis  # нужен только при CACHE_BACKEND=redis
+        self._client = redis.Redis.from_url(url)
+        self.started = time()
+        self.revalidates = True
+
+    def bump(self, table: str):
+        pipeline = self._client.pipeline()
+        pipeline.incr(f"ver:{table}")
+        pipeline.set(f"ver:{table}:at", repr(time()))
+        pipeline.execute()
+
+    def read(self, tables: tuple) -> tuple:
+        keys = ["ver:epoch"] + [key for t in tables for key in (f"ver:{t}", f"ver:{t}:at")]
+        epoch, *values = self._client.mget(keys)
+        if epoch is None:
+            # Redis очищен — счетчики начались заново, прежние ETag не должны совпасть с новыми
+            self._client.set("ver:epoch", uuid4().hex, nx=True)
+            epoch = self._client.get("ver:epoch")
+        pairs = zip(values[::2], values[1::2])
+        return epoch.decode(), [(int(number or 0), float(at) if at else None) for number, at in pairs], 0.0
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Слабое сравнение (RFC 9110): W/ не учитывается
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+def _not_modified_since(header: str, modified: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(modified) <= since
+
+
+class TableVersions:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def bump(self, table: str, *args):
+        """write_listener: (table, op, ids)"""
+        self.backend.bump(table)
+
+    def validators(self, tables: tuple, variant: str = "") -> tuple:
+        """(ETag, время последней записи) для ответа, собранного из tables; variant — вариант представления"""
+        epoch, versions, since = self.backend.read(tables)
+        digest = blake2b(repr((epoch, versions, variant)).encode(), digest_size=12).hexdigest()
+        # Last-Modified не раньше начала эпохи: If-Modified-Since из прошлого окна memory-бэкенда не даст 304
+        modified = max(max((at for _, at in versions if at is not None), default=self.backend.started), since)
+        return f'W/"{digest}"', modified
+
+    def last_write(self, tables: tuple) -> float:
+        """Время последней записи в tables (0 — записей не было)"""
+        _, versions, _ = self.backend.read(tables)
+        return max((at for _, at in versions if at is not None), default=0.0)
+
+    def version(self, table: str) -> tuple:
+        """(номер, время записи) таблицы: структуры в памяти сверяются с ним, чтобы видеть записи других процессов"""
+        return self.backend.read((table,))[1][0]
+
+    def conditional(self, *tables: str):
+        """Зависимость FastAPI: 304 по If-None-Match / If-Modified-Since, иначе заголовки для ответа 200"""
+        def check_versions(request: Request):
+            if request.method not in ("GET", "HEAD"):
+                return
+            variant = f"{request.url.path}?{request.url.query} {request.headers.get('accept', '')}"
+            etag, modified = self.validators(tables, variant)
+            headers = {"ETag": etag, "Last-Modified": formatdate(modified, usegmt=True), "Cache-Control": "no-cache"}
+            if_none_match = request.headers.get("if-none-match")
+            if_modified_since = request.headers.get("if-modified-since")
+            if self.backend.revalidates and (
+                    _etag_matches(if_none_match, etag) if if_none_match is not None
+                    else if_modified_since is not None and _not_modified_since(if_modified_since, modified)):
+                raise HTTPException(status_code=304, headers=headers)
+            setattr(request.state, VALIDATORS_STATE, headers)
+        return check_versions
+
+
+class ValidatorsMiddleware:
+    """Добавляет ETag / Last-Modified, вычисленные conditional(), к успешному ответу.
+    Через middleware, потому что CRUD-эндпоинты возвращают готовый Response"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = scope.get("state", {}).get(VALIDATORS_STATE)
+                if headers:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def build_versions() -> TableVersions:
+    if CACHE_BACKEND == "redis":
+        return TableVersions(RedisVersionsBackend(CACHE_URL))
+    return TableVersions(MemoryVersionsBackend(CACHE_TTL_SECONDS))
+
+table_versions = build_versions()